@@ -0,0 +1,178 @@
+import atexit
+import datetime
+import json
+import os
+import queue
+import threading
+import time
+
+DEFAULT_LOG_PATH = "app_activity.jsonl"
+
+
+class ActivityLogger:
+    """
+    Log aktivitas terstruktur (JSON lines) yang ditulis secara asinkron.
+    log() hanya memasukkan record ke antrian dan langsung kembali; thread
+    background menulis record per batch dan merotasi file berdasarkan ukuran
+    dan pergantian hari. Saat aplikasi berhenti normal antrian dikosongkan
+    lebih dulu sehingga tidak ada record yang hilang.
+    """
+
+    def __init__(self, path=DEFAULT_LOG_PATH, max_bytes=10 * 1024 * 1024, rotate_daily=True,
+                 backup_count=14, max_queue=50000, batch_size=256, flush_interval=1.0):
+        """
+        Args:
+            path: File log aktif
+            max_bytes: Ukuran file sebelum dirotasi
+            rotate_daily: Rotasi juga saat tanggal (UTC) berganti
+            backup_count: Jumlah file rotasi yang disimpan
+            max_queue: Kapasitas antrian; jika penuh record dibuang dan dihitung
+            batch_size: Jumlah record maksimal per penulisan
+            flush_interval: Jeda maksimal (detik) sebelum record ditulis
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_daily = rotate_daily
+        self.backup_count = backup_count
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._closed = False
+        self._file = None
+        self._file_day = None
+        self._thread = threading.Thread(target=self._run, name="activity-logger", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def log(self, user, action, **fields):
+        """
+        Catat satu aktivitas tanpa menunggu I/O
+        Args:
+            user: Username pelaku (None untuk aktivitas sistem)
+            action: Jenis aktivitas, contoh "login" atau "detect"
+            **fields: Field tambahan, contoh latency_ms, model_version, cache_hit
+        Returns:
+            bool: False jika record dibuang karena antrian penuh atau logger ditutup
+        """
+        record = {"ts": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds"),
+                  "user": user, "action": action}
+        record.update(fields)
+        return self.enqueue(record)
+
+    def enqueue(self, record):
+        """
+        Masukkan record (dict siap tulis) ke antrian tanpa menunggu I/O
+        Returns:
+            bool: False jika record dibuang karena antrian penuh atau logger ditutup
+        """
+        if self._closed:
+            return False
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    # ------------------------------------------------------------------
+    # Thread penulis
+    # ------------------------------------------------------------------
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                if self._closed:
+                    break
+                continue
+
+            stop = batch[0] is None
+            while not stop and len(batch) < self.batch_size:
+                try:
+                    record = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    stop = True
+                else:
+                    batch.append(record)
+
+            records = [record for record in batch if record is not None]
+            if records:
+                try:
+                    self._write(records)
+                except Exception as e:
+                    print(f"Error menulis log aktivitas: {e}")
+            if stop:
+                break
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, records):
+        lines = "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n" for record in records)
+        self._rotate_if_needed(len(lines.encode("utf-8")))
+        self._file.write(lines)
+        self._file.flush()
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._file_day = datetime.datetime.utcfromtimestamp(
+            os.path.getmtime(self.path) if self._file.tell() else time.time()).date()
+
+    def _rotate_if_needed(self, incoming_bytes):
+        if self._file is None:
+            self._open()
+
+        today = datetime.datetime.utcnow().date()
+        too_big = self._file.tell() > 0 and self._file.tell() + incoming_bytes > self.max_bytes
+        new_day = self.rotate_daily and self._file.tell() > 0 and today != self._file_day
+        if not (too_big or new_day):
+            return
+
+        self._file.close()
+        suffix = datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S-%f")
+        os.replace(self.path, f"{self.path}.{suffix}")
+        self._prune_backups()
+        self._open()
+
+    def _prune_backups(self):
+        directory = os.path.dirname(self.path) or "."
+        prefix = os.path.basename(self.path) + "."
+        with os.scandir(directory) as entries:
+            backups = sorted(entry.path for entry in entries if entry.name.startswith(prefix))
+        # Nama berakhiran timestamp, urutan nama = urutan waktu
+        for path in backups[:-self.backup_count] if self.backup_count else backups:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def close(self, timeout=10.0):
+        """Tulis semua record yang tersisa lalu hentikan thread penulis"""
+        if self._closed:
+            return
+        self._closed = True
+        # Penanda berhenti diletakkan setelah semua record yang sudah masuk antrian
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+
+_default_logger = None
+_default_lock = threading.Lock()
+
+
+def get_activity_logger():
+    """Logger aktivitas bersama untuk seluruh aplikasi (dibuat saat pertama dipakai)"""
+    global _default_logger
+    with _default_lock:
+        if _default_logger is None:
+            _default_logger = ActivityLogger()
+        return _default_logger
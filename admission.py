@@ -0,0 +1,154 @@
+import importlib.util
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from diagnostics import cpu_count
+
+
+class DetectorBusy(Exception):
+    """Deteksi ditolak karena antrian penuh atau batas waktu tunggu terlewati"""
+
+
+def pin_inference_threads(torch_threads, opencv_threads=1):
+    """
+    Tetapkan jumlah thread torch dan OpenCV untuk seluruh proses, supaya
+    beberapa inferensi paralel tidak saling berebut core
+    (torch_threads x max_concurrent sebaiknya tidak melebihi jumlah CPU)
+    """
+    if importlib.util.find_spec("torch") is not None:
+        import torch
+        torch.set_num_threads(torch_threads)
+    if importlib.util.find_spec("cv2") is not None:
+        import cv2
+        cv2.setNumThreads(opencv_threads)
+
+
+class AdmissionController:
+    """
+    Kontrol masuk di depan detector.
+    Paling banyak max_concurrent inferensi berjalan bersamaan; permintaan lain
+    menunggu di antrian FIFO berukuran max_queue. Permintaan ditolak
+    (DetectorBusy) jika antrian penuh, jika perkiraan waktu tunggunya sudah
+    melewati deadline, atau jika deadline habis saat menunggu. Dengan begitu
+    beban berlebih menghasilkan pesan "sibuk" yang cepat, bukan latensi yang
+    membengkak untuk semua user.
+    """
+
+    def __init__(self, max_concurrent=1, max_queue=8, deadline_seconds=30.0):
+        """
+        Args:
+            max_concurrent: Jumlah inferensi yang boleh berjalan bersamaan
+            max_queue: Jumlah permintaan maksimal yang menunggu
+            deadline_seconds: Waktu tunggu maksimal di antrian (detik)
+        """
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.deadline_seconds = deadline_seconds
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._queue = deque()
+        # Rata-rata bergerak (EWMA) lama satu inferensi, untuk perkiraan waktu tunggu
+        self._service_seconds = None
+        self.stats = {"admitted": 0, "queued": 0, "rejected_full": 0,
+                      "rejected_deadline": 0, "timed_out": 0}
+
+    def estimated_wait(self, position):
+        """Perkiraan waktu tunggu (detik) untuk posisi antrian tertentu"""
+        if self._service_seconds is None:
+            return 0.0
+        return position * self._service_seconds / self.max_concurrent
+
+    def _wait_for_turn(self, ticket, deadline, on_wait, poll_interval):
+        """Tunggu sampai tiket di depan antrian dan ada slot kosong (dipanggil dengan lock)"""
+        while not (self._queue[0] is ticket and self._active < self.max_concurrent):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.stats["timed_out"] += 1
+                raise DetectorBusy("Server sedang sibuk, waktu tunggu antrian habis. Silakan coba lagi.")
+            if on_wait is not None:
+                position = self._queue.index(ticket) + 1
+                on_wait(position, self.estimated_wait(position))
+            self._cond.wait(min(remaining, poll_interval))
+
+    @contextmanager
+    def slot(self, deadline_seconds=None, on_wait=None, poll_interval=0.5):
+        """
+        Ambil slot inferensi (context manager)
+        Args:
+            deadline_seconds: Batas tunggu, default self.deadline_seconds
+            on_wait: Callback (posisi antrian, perkiraan detik) selama menunggu
+            poll_interval: Jeda maksimal antar pemanggilan on_wait
+        Raises:
+            DetectorBusy: jika permintaan ditolak
+        """
+        deadline_seconds = self.deadline_seconds if deadline_seconds is None else deadline_seconds
+        deadline = time.monotonic() + deadline_seconds
+
+        with self._cond:
+            if self._active < self.max_concurrent and not self._queue:
+                self._active += 1
+            else:
+                if len(self._queue) >= self.max_queue:
+                    self.stats["rejected_full"] += 1
+                    raise DetectorBusy("Server sedang sibuk, antrian deteksi penuh. Silakan coba lagi.")
+                # Tolak lebih awal jika sudah pasti tidak terlayani sebelum deadline
+                if self.estimated_wait(len(self._queue) + 1) > deadline_seconds:
+                    self.stats["rejected_deadline"] += 1
+                    raise DetectorBusy("Server sedang sibuk, perkiraan waktu tunggu terlalu lama. Silakan coba lagi.")
+
+                ticket = object()
+                self._queue.append(ticket)
+                self.stats["queued"] += 1
+                try:
+                    self._wait_for_turn(ticket, deadline, on_wait, poll_interval)
+                finally:
+                    self._queue.remove(ticket)
+                    # Tiket berikutnya mungkin sekarang berada di depan
+                    self._cond.notify_all()
+                self._active += 1
+            self.stats["admitted"] += 1
+
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - start
+            with self._cond:
+                self._active -= 1
+                self._service_seconds = elapsed if self._service_seconds is None \
+                    else 0.8 * self._service_seconds + 0.2 * elapsed
+                self._cond.notify_all()
+
+    def snapshot(self):
+        """Status saat ini untuk halaman diagnostik"""
+        with self._cond:
+            return {
+                "active": self._active,
+                "waiting": len(self._queue),
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "service_seconds": self._service_seconds,
+                **self.stats,
+            }
+
+
+def admission_from_env():
+    """
+    Buat AdmissionController dan pin thread inferensi dari environment:
+    DETECTION_CONCURRENCY (default 1), DETECTION_QUEUE (default 8),
+    DETECTION_DEADLINE (detik, default 30), TORCH_THREADS (default CPU / concurrency)
+    """
+    cpus = cpu_count()
+    max_concurrent = max(1, int(os.environ.get("DETECTION_CONCURRENCY", 1)))
+    torch_threads = max(1, int(os.environ.get("TORCH_THREADS", cpus // max_concurrent or 1)))
+    pin_inference_threads(torch_threads, opencv_threads=1 if max_concurrent > 1 else min(cpus, 4))
+
+    return AdmissionController(
+        max_concurrent=max_concurrent,
+        max_queue=max(0, int(os.environ.get("DETECTION_QUEUE", 8))),
+        deadline_seconds=float(os.environ.get("DETECTION_DEADLINE", 30)),
+    )
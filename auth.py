@@ -1,14 +1,26 @@
-import hashlib
 import datetime
 from database import DatabaseManager
+from password_hashing import PasswordHasher, HasherBusy
+from sessions import SessionManager
+from user_cache import CachedUserStore
 
 class AuthManager:
-    def __init__(self, db_manager):
+    def __init__(self, db_manager, hasher=None, session_manager=None):
+        """
+        Args:
+            db_manager: DatabaseManager untuk data user
+            hasher: PasswordHasher (scrypt terkalibrasi), dibuat otomatis jika None
+            session_manager: SessionManager untuk token sesi, dibuat otomatis jika None
+        """
         self.db_manager = db_manager
+        # Semua akses data user lewat cache dengan invalidasi write-through
+        self.users = CachedUserStore(db_manager)
+        self.hasher = hasher or PasswordHasher()
+        self.sessions = session_manager or SessionManager(db_manager)
     
     def hash_password(self, password):
-        """Hash password menggunakan SHA256"""
-        return hashlib.sha256(password.encode()).hexdigest()
+        """Hash password menggunakan scrypt (dijalankan di worker pool hasher)"""
+        return self.hasher.hash(password)
     
     def register(self, nama_lengkap, username, password):
         """
@@ -16,15 +28,15 @@ class AuthManager:
         Returns: True jika berhasil, False jika username sudah ada
         """
         try:
-            # Cek apakah username sudah ada
-            if self.db_manager.user_exists(username):
+            # Username yang sudah diketahui ada (dari cache) tidak perlu di-hash
+            if self.users.user_exists(username):
                 return False
             
             # Hash password
             hashed_password = self.hash_password(password)
             
-            # Simpan user baru
-            return self.db_manager.create_user(nama_lengkap, username, hashed_password)
+            # Simpan user baru; INSERT ... ON CONFLICT sekaligus mengecek username
+            return self.users.create_user(nama_lengkap, username, hashed_password)
         
         except Exception as e:
             print(f"Error saat registrasi: {e}")
@@ -33,15 +45,26 @@ class AuthManager:
     def login(self, username, password):
         """
         Login user
+        Hash SHA-256 lama otomatis diganti dengan scrypt setelah login berhasil
         Returns: True jika berhasil, False jika gagal
         """
         try:
-            # Hash password yang diinput
-            hashed_password = self.hash_password(password)
+            stored_hash = self.users.get_password_hash(username)
+            if stored_hash is None:
+                # Tetap lakukan hashing agar waktu respons tidak membocorkan username
+                self.hasher.dummy_verify(password)
+                return False
+            
+            # Verifikasi di worker pool hasher
+            valid, needs_rehash = self.hasher.verify(password, stored_hash)
             
-            # Verifikasi dengan database
-            return self.db_manager.verify_user(username, hashed_password)
+            if valid and needs_rehash:
+                self.users.update_password(username, self.hash_password(password))
+            
+            return valid
         
+        except HasherBusy:
+            raise
         except Exception as e:
             print(f"Error saat login: {e}")
             return False
@@ -52,27 +75,56 @@ class AuthManager:
         Returns: True jika berhasil, False jika username tidak ada
         """
         try:
-            # Cek apakah user ada
-            if not self.db_manager.user_exists(username):
-                return False
-            
             # Hash password baru
             hashed_password = self.hash_password(new_password)
             
-            # Update password
-            return self.db_manager.update_password(username, hashed_password)
+            # Update password; rowcount 0 berarti username tidak ada
+            updated = self.users.update_password(username, hashed_password)
+            
+            # Semua sesi lama tidak berlaku lagi setelah password diganti
+            if updated:
+                self.sessions.revoke_user(username)
+            return updated
         
         except Exception as e:
             print(f"Error saat reset password: {e}")
             return False
     
+    def create_session(self, username):
+        """
+        Buat token sesi setelah login berhasil
+        Returns: token sesi
+        """
+        return self.sessions.create(username)
+    
+    def resume_session(self, token):
+        """
+        Pulihkan login dari token sesi (refresh browser / reconnect).
+        Token yang sudah pernah dilihat proses ini divalidasi dari cache tanpa
+        menyentuh disk; token baru hanya dibuat saat login, dan dicabut saat
+        logout atau reset password.
+        Returns: username jika token valid, None jika tidak
+        """
+        try:
+            return self.sessions.validate(token)
+        except Exception as e:
+            print(f"Error saat validasi sesi: {e}")
+            return None
+    
+    def logout(self, token):
+        """Cabut token sesi saat logout"""
+        try:
+            self.sessions.revoke(token)
+        except Exception as e:
+            print(f"Error saat logout: {e}")
+    
     def get_user_info(self, username):
         """
         Mendapatkan informasi user
         Returns: Dictionary dengan info user atau None
         """
         try:
-            return self.db_manager.get_user_info(username)
+            return self.users.get_user_info(username)
         except Exception as e:
             print(f"Error saat mengambil info user: {e}")
             return None
\ No newline at end of file
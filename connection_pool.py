@@ -0,0 +1,89 @@
+import sqlite3
+import threading
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Koneksi SQLite yang dikembalikan ke pool saat close(), sehingga kode
+    pemanggil tetap memakai pola connect -> close seperti koneksi biasa
+    """
+
+    _pool = None
+    _checked_out = False
+
+    def close(self):
+        pool = self._pool
+        if pool is None:
+            super().close()
+        elif self._checked_out:
+            pool.release(self)
+
+
+class ConnectionPool:
+    """
+    Pool koneksi idle untuk satu file SQLite.
+    Koneksi yang dikembalikan di-rollback jika masih dalam transaksi dan
+    isolation_level-nya dikembalikan ke default, jadi peminjam berikutnya
+    selalu mendapat koneksi yang bersih. Koneksi dipakai satu thread pada
+    satu waktu, tetapi boleh berpindah thread (check_same_thread=False).
+    """
+
+    def __init__(self, db_path, busy_timeout=30.0, max_idle=8):
+        """
+        Args:
+            db_path: Path file database SQLite
+            busy_timeout: Waktu tunggu (detik) saat database dikunci writer lain
+            max_idle: Jumlah koneksi idle maksimal yang disimpan
+        """
+        self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.max_idle = max_idle
+        self.opened = 0
+        self.reused = 0
+        self._idle = []
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def connect(self):
+        """Pinjam koneksi idle atau buka koneksi baru"""
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+            if conn is not None:
+                self.reused += 1
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout,
+                                   factory=PooledConnection, check_same_thread=False)
+            conn._pool = self
+            with self._lock:
+                self.opened += 1
+        conn._checked_out = True
+        return conn
+
+    def release(self, conn):
+        """Kembalikan koneksi ke pool (dipanggil lewat conn.close())"""
+        conn._checked_out = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.isolation_level = ""
+        except sqlite3.Error:
+            sqlite3.Connection.close(conn)
+            return
+
+        with self._lock:
+            if not self._closed and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        sqlite3.Connection.close(conn)
+
+    def close(self):
+        """Tutup semua koneksi idle; koneksi yang masih dipinjam ditutup saat dikembalikan"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            sqlite3.Connection.close(conn)
+
+    def stats(self):
+        with self._lock:
+            return {"opened": self.opened, "reused": self.reused, "idle": len(self._idle)}
@@ -1,28 +1,76 @@
 import sqlite3
 import datetime
 import os
+from connection_pool import ConnectionPool
+from history_writer import HistoryWriter
+from image_store import ImageStore, remove_variants
+from utils import parse_predictions
+
+
+def remove_file(path):
+    """
+    Hapus file gambar di luar ImageStore beserta variannya
+    Returns: jumlah byte yang dibebaskan
+    """
+    try:
+        reclaimed = remove_variants(path)
+        size = os.path.getsize(path)
+        os.remove(path)
+        return reclaimed + size
+    except FileNotFoundError:
+        return 0
+    except OSError as e:
+        print(f"Error saat menghapus file {path}: {e}")
+        return 0
+
 
 class DatabaseManager:
-    def __init__(self, db_path="skin_cancer_app.db"):
+    def __init__(self, db_path="skin_cancer_app.db", write_behind=True, busy_timeout=30.0, pool_size=0,
+                 image_root="history_images"):
+        """
+        Args:
+            db_path: Path ke file database SQLite
+            write_behind: Simpan history lewat antrian background dengan group commit
+            busy_timeout: Waktu tunggu (detik) saat database sedang dikunci writer lain
+            pool_size: Jumlah koneksi idle yang dipakai ulang (0 = koneksi baru setiap kali)
+            image_root: Direktori akar ImageStore
+        """
         self.db_path = db_path
+        self.busy_timeout = busy_timeout
+        self.pool = ConnectionPool(db_path, busy_timeout, max_idle=pool_size) if pool_size else None
+        self.image_store = ImageStore(self, root=image_root)
         self.init_database()
+        self.history_writer = HistoryWriter(self) if write_behind else None
+    
+    def _connect(self):
+        """Buka koneksi baru (atau pinjam dari pool) dengan busy timeout"""
+        if self.pool is not None:
+            return self.pool.connect()
+        return sqlite3.connect(self.db_path, timeout=self.busy_timeout)
+    
+    def close(self):
+        """Flush antrian history yang tertunda sebelum aplikasi berhenti"""
+        if self.history_writer is not None:
+            self.history_writer.close()
+        if self.pool is not None:
+            self.pool.close()
+    
+    def image_store_for(self, username):
+        """ImageStore tempat gambar milik user disimpan"""
+        return self.image_store
     
     def init_database(self):
         """Inisialisasi database dan tabel"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
+            # WAL agar pembaca tidak terblokir writer dan commit lebih murah
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA synchronous=NORMAL')
+            
             # Tabel users
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    nama_lengkap TEXT NOT NULL,
-                    username TEXT UNIQUE NOT NULL,
-                    password TEXT NOT NULL,
-                    tanggal_dibuat TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
+            self._create_users_table(cursor)
             
             # Tabel detection_history
             cursor.execute('''
@@ -37,6 +85,51 @@ class DatabaseManager:
                 )
             ''')
             
+            # Tabel image_blobs (penyimpanan gambar berbasis hash)
+            ImageStore.init_table(cursor)
+            self._ensure_column(cursor, 'detection_history', 'image_hash', 'TEXT')
+            
+            # Tabel detection_predictions: satu baris per prediksi, untuk pencarian
+            # berdasarkan kelas, confidence dan tanggal tanpa parsing hasil_deteksi
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS detection_predictions (
+                    history_id INTEGER NOT NULL,
+                    username TEXT NOT NULL,
+                    class TEXT NOT NULL,
+                    confidence REAL NOT NULL,
+                    tanggal_deteksi TIMESTAMP NOT NULL,
+                    FOREIGN KEY (history_id) REFERENCES detection_history (id)
+                )
+            ''')
+            
+            # Index untuk history per user dan pencarian
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_history_user_date
+                ON detection_history (username, tanggal_deteksi)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_history_user_hash
+                ON detection_history (username, image_hash)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_predictions_history
+                ON detection_predictions (history_id, class, confidence)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_predictions_user_class
+                ON detection_predictions (username, class, confidence)
+            ''')
+            cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_predictions_user_confidence
+                ON detection_predictions (username, confidence)
+            ''')
+            
+            # Isi detection_predictions untuk record lama (sekali saja)
+            cursor.execute('PRAGMA user_version')
+            if cursor.fetchone()[0] < 1:
+                self._backfill_predictions(cursor)
+                cursor.execute('PRAGMA user_version = 1')
+            
             conn.commit()
             conn.close()
             print("Database berhasil diinisialisasi")
@@ -44,20 +137,67 @@ class DatabaseManager:
         except Exception as e:
             print(f"Error saat inisialisasi database: {e}")
     
+    @staticmethod
+    def _create_users_table(cursor):
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                nama_lengkap TEXT NOT NULL,
+                username TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL,
+                tanggal_dibuat TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+    
+    def _ensure_column(self, cursor, table, column, definition):
+        """Tambahkan kolom baru ke tabel lama (migrasi sederhana)"""
+        cursor.execute(f'PRAGMA table_info({table})')
+        if column not in [row[1] for row in cursor.fetchall()]:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    
+    def _backfill_predictions(self, cursor):
+        """Isi detection_predictions dari hasil_deteksi record yang sudah ada"""
+        rows = cursor.execute('''
+            SELECT id, username, hasil_deteksi, tanggal_deteksi FROM detection_history
+        ''').fetchall()
+        for history_id, username, hasil_deteksi, tanggal_deteksi in rows:
+            cursor.executemany('''
+                INSERT INTO detection_predictions (history_id, username, class, confidence, tanggal_deteksi)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(history_id, username, cls, conf, tanggal_deteksi)
+                  for cls, conf in self._prediction_rows(hasil_deteksi)])
+    
+    @staticmethod
+    def _prediction_rows(hasil_deteksi):
+        """Ambil pasangan (kelas, confidence) dari string hasil_deteksi"""
+        rows = []
+        for pred in parse_predictions(hasil_deteksi):
+            try:
+                rows.append((str(pred['class']).lower().strip(), float(pred['confidence'])))
+            except (KeyError, TypeError, ValueError):
+                continue
+        return rows
+    
     def create_user(self, nama_lengkap, username, hashed_password):
-        """Membuat user baru"""
+        """
+        Membuat user baru
+        Returns: True jika berhasil, False jika username sudah ada
+        """
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
+            # Cek keberadaan username dan insert dalam satu statement
             cursor.execute('''
                 INSERT INTO users (nama_lengkap, username, password)
                 VALUES (?, ?, ?)
+                ON CONFLICT(username) DO NOTHING
             ''', (nama_lengkap, username, hashed_password))
             
             conn.commit()
+            created = cursor.rowcount
             conn.close()
-            return True
+            return created > 0
             
         except sqlite3.IntegrityError:
             return False
@@ -65,10 +205,77 @@ class DatabaseManager:
             print(f"Error saat membuat user: {e}")
             return False
     
+    def _select_existing_usernames(self, cursor, usernames):
+        """Username dari daftar yang sudah terdaftar (dicek per potongan karena batas parameter SQLite)"""
+        existing = set()
+        usernames = list(usernames)
+        for start in range(0, len(usernames), 500):
+            part = usernames[start:start + 500]
+            cursor.execute(
+                f"SELECT username FROM users WHERE username IN ({','.join('?' * len(part))})", part
+            )
+            existing.update(row[0] for row in cursor.fetchall())
+        return existing
+    
+    def existing_usernames(self, usernames):
+        """
+        Cari username yang sudah terdaftar dari sebuah daftar
+        Returns: set username yang sudah ada
+        """
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            existing = self._select_existing_usernames(cursor, usernames)
+            
+            conn.close()
+            return existing
+            
+        except Exception as e:
+            print(f"Error saat cek user: {e}")
+            return set()
+    
+    def create_users_bulk(self, users):
+        """
+        Membuat banyak user dalam satu transaksi dengan executemany
+        Args:
+            users: list tuple (nama_lengkap, username, hashed_password)
+        Returns:
+            tuple: (list username yang dibuat, list username yang sudah ada,
+                    list username yang gagal karena transaksinya error)
+        """
+        if not users:
+            return [], [], []
+        
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            
+            # Kunci tulis diambil di awal supaya hasil cek duplikat tetap benar
+            # sampai insert selesai, walaupun ada registrasi paralel
+            cursor.execute('BEGIN IMMEDIATE')
+            existing = self._select_existing_usernames(cursor, [user[1] for user in users])
+            
+            new_users = [user for user in users if user[1] not in existing]
+            cursor.executemany('''
+                INSERT INTO users (nama_lengkap, username, password)
+                VALUES (?, ?, ?)
+            ''', new_users)
+            
+            conn.commit()
+            return [user[1] for user in new_users], [user[1] for user in users if user[1] in existing], []
+            
+        except Exception as e:
+            conn.rollback()
+            print(f"Error saat membuat user massal: {e}")
+            return [], [], [user[1] for user in users]
+        finally:
+            conn.close()
+    
     def user_exists(self, username):
         """Cek apakah username sudah ada"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('SELECT COUNT(*) FROM users WHERE username = ?', (username,))
@@ -84,7 +291,7 @@ class DatabaseManager:
     def verify_user(self, username, hashed_password):
         """Verifikasi login user"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -101,10 +308,26 @@ class DatabaseManager:
             print(f"Error saat verifikasi user: {e}")
             return False
     
+    def get_password_hash(self, username):
+        """Ambil hash password tersimpan untuk diverifikasi di aplikasi"""
+        try:
+            conn = self._connect()
+            cursor = conn.cursor()
+            
+            cursor.execute('SELECT password FROM users WHERE username = ?', (username,))
+            row = cursor.fetchone()
+            
+            conn.close()
+            return row[0] if row else None
+            
+        except Exception as e:
+            print(f"Error saat mengambil password: {e}")
+            return None
+    
     def update_password(self, username, new_hashed_password):
         """Update password user"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -124,7 +347,7 @@ class DatabaseManager:
     def get_user_info(self, username):
         """Mendapatkan informasi user"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -141,29 +364,76 @@ class DatabaseManager:
             print(f"Error saat mengambil info user: {e}")
             return None
     
-    def save_detection_history(self, username, filename, filepath, hasil_deteksi):
-        """Simpan history deteksi"""
+    def save_detection_history(self, username, filename, filepath, hasil_deteksi, image_hash=None):
+        """
+        Simpan history deteksi
+        Record dimasukkan ke antrian write-behind; jika antrian penuh
+        record langsung ditulis secara sinkron
+        Args:
+            image_hash: Hash blob dari ImageStore.put(), referensinya diambil alih record ini
+        """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            if self.history_writer is not None and self.history_writer.submit(
+                    username, filename, filepath, hasil_deteksi, image_hash):
+                return True
             
-            cursor.execute('''
-                INSERT INTO detection_history (username, filename, filepath, hasil_deteksi)
-                VALUES (?, ?, ?, ?)
-            ''', (username, filename, filepath, hasil_deteksi))
-            
-            conn.commit()
-            conn.close()
+            self.insert_detection_history_batch([(username, filename, filepath, hasil_deteksi, image_hash)])
             return True
             
         except Exception as e:
             print(f"Error saat menyimpan history: {e}")
             return False
     
+    def insert_detection_history_batch(self, records):
+        """
+        Tulis beberapa record history dalam satu transaksi (group commit)
+        Args:
+            records: list of tuple (username, filename, filepath, hasil_deteksi, image_hash)
+        """
+        conn = self._connect()
+        try:
+            with conn:
+                self.insert_history_records(conn.cursor(), records)
+        finally:
+            conn.close()
+    
+    def insert_history_records(self, cursor, records):
+        """
+        Tulis record history beserta baris detection_predictions di dalam
+        transaksi yang sedang berjalan
+        Args:
+            cursor: Cursor dari transaksi aktif
+            records: list of tuple (username, filename, filepath, hasil_deteksi, image_hash)
+        Returns:
+            list id record yang dibuat
+        """
+        history_ids = []
+        prediction_rows = []
+        for record in records:
+            cursor.execute('''
+                INSERT INTO detection_history (username, filename, filepath, hasil_deteksi, image_hash)
+                VALUES (?, ?, ?, ?, ?)
+            ''', record)
+            history_id = cursor.lastrowid
+            history_ids.append(history_id)
+            prediction_rows.extend((history_id, cls, conf, history_id)
+                                   for cls, conf in self._prediction_rows(record[3]))
+        
+        # Tanggal disalin dari record history agar filter tanggal konsisten
+        cursor.executemany('''
+            INSERT INTO detection_predictions (history_id, username, class, confidence, tanggal_deteksi)
+            SELECT ?, username, ?, ?, tanggal_deteksi FROM detection_history WHERE id = ?
+        ''', prediction_rows)
+        return history_ids
+    
     def get_detection_history(self, username):
         """Mendapatkan history deteksi user"""
         try:
-            conn = sqlite3.connect(self.db_path)
+            # Pastikan record milik user yang masih di antrian sudah tersimpan
+            if self.history_writer is not None:
+                self.history_writer.wait_for_user(username)
+            
+            conn = self._connect()
             cursor = conn.cursor()
             
             cursor.execute('''
@@ -182,58 +452,293 @@ class DatabaseManager:
             print(f"Error saat mengambil history: {e}")
             return []
     
-    def delete_detection_history(self, history_id):
-        """Hapus satu history deteksi berdasar id dan hapus file gambarnya"""
+    # Jika jumlah prediksi yang cocok di bawah batas ini, pencarian dimulai dari
+    # index prediksi; jika lebih banyak, index tanggal history ditelusuri berurutan
+    SEARCH_SPARSE_LIMIT = 2000
+    
+    def search_detection_history(self, username, classes=None, min_confidence=None, max_confidence=None,
+                                 date_from=None, date_to=None, limit=20, cursor=None):
+        """
+        Cari history deteksi user dengan filter yang dijalankan di SQLite
+        Args:
+            username: Username pemilik history
+            classes: List kelas lesi (contoh ['mel', 'bcc']), None untuk semua
+            min_confidence: Confidence minimal (0-1)
+            max_confidence: Confidence maksimal (0-1)
+            date_from: datetime.date awal (inklusif)
+            date_to: datetime.date akhir (inklusif)
+            limit: Jumlah record per halaman
+            cursor: Posisi halaman dari pemanggilan sebelumnya (keyset pagination)
+        Returns:
+            tuple: (list record, cursor halaman berikutnya atau None)
+        """
+        try:
+            if self.history_writer is not None:
+                self.history_writer.wait_for_user(username)
+            
+            conditions = ['h.username = ?']
+            params = [username]
+            
+            if date_from is not None:
+                conditions.append('h.tanggal_deteksi >= ?')
+                params.append(date_from.strftime('%Y-%m-%d 00:00:00'))
+            if date_to is not None:
+                conditions.append('h.tanggal_deteksi < ?')
+                params.append((date_to + datetime.timedelta(days=1)).strftime('%Y-%m-%d 00:00:00'))
+            
+            # Keyset pagination: lanjut dari (tanggal, id) record terakhir halaman sebelumnya
+            if cursor is not None:
+                conditions.append('(h.tanggal_deteksi < ? OR (h.tanggal_deteksi = ? AND h.id < ?))')
+                params.extend([cursor[0], cursor[0], cursor[1]])
+            
+            prediction_conditions = []
+            prediction_params = []
+            if classes:
+                prediction_conditions.append(f"p.class IN ({','.join('?' * len(classes))})")
+                prediction_params.extend(cls.lower().strip() for cls in classes)
+            if min_confidence is not None:
+                prediction_conditions.append('p.confidence >= ?')
+                prediction_params.append(min_confidence)
+            if max_confidence is not None:
+                prediction_conditions.append('p.confidence <= ?')
+                prediction_params.append(max_confidence)
+            
+            conn = self._connect()
+            source = 'detection_history h INDEXED BY idx_history_user_date'
+            
+            if prediction_conditions:
+                prediction_filter = ' AND '.join(prediction_conditions)
+                # Hitung (dibatasi) prediksi yang cocok lewat index (username, class, confidence)
+                # atau (username, confidence) untuk filter confidence saja
+                matches = conn.execute(f'''
+                    SELECT COUNT(*) FROM (
+                        SELECT 1 FROM detection_predictions p
+                        WHERE p.username = ? AND {prediction_filter}
+                        LIMIT ?
+                    )
+                ''', [username, *prediction_params, self.SEARCH_SPARSE_LIMIT]).fetchone()[0]
+                sparse = matches < self.SEARCH_SPARSE_LIMIT
+                
+                if sparse:
+                    # Sedikit kecocokan: ambil id dari index prediksi lalu urutkan. NOT INDEXED
+                    # mencegah planner menelusuri seluruh history user lewat idx_history_user_date
+                    # dan memaksa lookup per id (INTEGER PRIMARY KEY)
+                    source = 'detection_history h NOT INDEXED'
+                    conditions.append(f'''h.id IN (
+                        SELECT p.history_id FROM detection_predictions p
+                        WHERE p.username = ? AND {prediction_filter}
+                    )''')
+                    params.extend([username, *prediction_params])
+                else:
+                    # Banyak kecocokan: telusuri history berurutan tanggal, berhenti setelah limit
+                    conditions.append(f'''EXISTS (
+                        SELECT 1 FROM detection_predictions p
+                        WHERE p.history_id = h.id AND {prediction_filter}
+                    )''')
+                    params.extend(prediction_params)
+            
+            rows = conn.execute(f'''
+                SELECT h.id, h.username, h.filename, h.filepath, h.tanggal_deteksi, h.hasil_deteksi
+                FROM {source}
+                WHERE {' AND '.join(conditions)}
+                ORDER BY h.tanggal_deteksi DESC, h.id DESC
+                LIMIT ?
+            ''', params + [limit + 1]).fetchall()
+            conn.close()
+            
+            next_cursor = None
+            if len(rows) > limit:
+                rows = rows[:limit]
+                next_cursor = (rows[-1][4], rows[-1][0])
+            return rows, next_cursor
+            
+        except Exception as e:
+            print(f"Error saat mencari history: {e}")
+            return [], None
+    
+    def count_detection_history(self, username):
+        """Jumlah history deteksi user (dihitung lewat index, tanpa mengambil baris)"""
+        try:
+            if self.history_writer is not None:
+                self.history_writer.wait_for_user(username)
+            
+            conn = self._connect()
+            count = conn.execute('SELECT COUNT(*) FROM detection_history WHERE username = ?',
+                                 (username,)).fetchone()[0]
+            conn.close()
+            return count
+            
+        except Exception as e:
+            print(f"Error saat menghitung history: {e}")
+            return 0
+    
+    def iter_detection_history(self, username, batch_size=500):
+        """
+        Iterasi history deteksi user secara bertahap (streaming)
+        Baris diambil per batch dari cursor yang tetap terbuka, sehingga
+        pemakaian memori konstan berapa pun jumlah history
+        Args:
+            username: Username pemilik history
+            batch_size: Jumlah baris per fetch
+        Yields:
+            tuple: (id, username, filename, filepath, tanggal_deteksi, hasil_deteksi, image_hash)
+        """
+        if self.history_writer is not None:
+            self.history_writer.wait_for_user(username)
+        
+        conn = self._connect()
+        try:
+            cursor = conn.execute('''
+                SELECT id, username, filename, filepath, tanggal_deteksi, hasil_deteksi, image_hash
+                FROM detection_history
+                WHERE username = ?
+                ORDER BY tanggal_deteksi DESC, id DESC
+            ''', (username,))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+    
+    def get_history_by_image_hashes(self, username, image_hashes):
+        """
+        Record history terbaru milik user untuk setiap image_hash
+        Hash yang tidak lagi punya record (riwayat sudah dihapus) tidak ada di hasil
+        Returns:
+            dict: image_hash -> (id, filename, filepath, tanggal_deteksi)
+        """
+        image_hashes = list(dict.fromkeys(image_hashes))
+        if not image_hashes:
+            return {}
         try:
-            conn = sqlite3.connect(self.db_path)
+            if self.history_writer is not None:
+                self.history_writer.wait_for_user(username)
+            
+            conn = self._connect()
+            try:
+                placeholders = ','.join('?' * len(image_hashes))
+                rows = conn.execute(f'''
+                    SELECT image_hash, id, filename, filepath, tanggal_deteksi
+                    FROM detection_history
+                    WHERE username = ? AND image_hash IN ({placeholders})
+                    ORDER BY tanggal_deteksi, id
+                ''', [username, *image_hashes]).fetchall()
+            finally:
+                conn.close()
+            # Baris terakhir (terbaru) per hash yang dipakai
+            return {row[0]: row[1:] for row in rows}
+        except Exception as e:
+            print(f"Error saat mengambil history berdasarkan gambar: {e}")
+            return {}
+    
+    def delete_history_records(self, cursor, history_ids):
+        """
+        Hapus record history di dalam transaksi yang sedang berjalan
+        Args:
+            cursor: Cursor dari transaksi aktif
+            history_ids: List id record yang dihapus
+        Returns:
+            tuple: (jumlah record terhapus, list path file yang sudah tidak dirujuk)
+        """
+        if not history_ids:
+            return 0, []
+        
+        placeholders = ','.join('?' * len(history_ids))
+        cursor.execute(f'SELECT filepath, image_hash FROM detection_history WHERE id IN ({placeholders})',
+                       list(history_ids))
+        rows = cursor.fetchall()
+        image_hashes = [row[1] for row in rows if row[1]]
+        filepaths = list({row[0] for row in rows if not row[1]})
+        
+        cursor.execute(f'DELETE FROM detection_predictions WHERE history_id IN ({placeholders})', list(history_ids))
+        cursor.execute(f'DELETE FROM detection_history WHERE id IN ({placeholders})', list(history_ids))
+        deleted = cursor.rowcount
+        
+        # Blob di ImageStore dihapus ketika refcount-nya habis
+        unused_blobs = ImageStore.release_references(cursor, image_hashes)
+        
+        # File lama (tanpa hash) yang masih dipakai record lain tidak boleh dihapus
+        if filepaths:
+            placeholders = ','.join('?' * len(filepaths))
+            cursor.execute(f'SELECT DISTINCT filepath FROM detection_history WHERE filepath IN ({placeholders})',
+                           filepaths)
+            still_used = {row[0] for row in cursor.fetchall()}
+            filepaths = [path for path in filepaths if path not in still_used]
+        
+        return deleted, filepaths + unused_blobs
+    
+    def referenced_image_paths(self, batch_size=500):
+        """
+        Semua path gambar yang masih dirujuk database (record lama tanpa hash
+        dan blob di image store), dalam bentuk normpath.
+        Error sengaja tidak ditangkap: set kosong berarti semua file dianggap yatim.
+        Returns: set path
+        """
+        conn = self._connect()
+        try:
+            cursor = conn.execute('''
+                SELECT filepath FROM detection_history WHERE image_hash IS NULL
+                UNION
+                SELECT filepath FROM image_blobs
+            ''')
+            referenced = set()
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return referenced
+                referenced.update(os.path.normpath(row[0]) for row in rows)
+        finally:
+            conn.close()
+    
+    def remove_files(self, filepaths, base_dir=None):
+        """
+        Hapus file gambar dari disk
+        Args:
+            base_dir: Direktori acuan path relatif, default direktori kerja
+        Returns: jumlah byte yang dibebaskan
+        """
+        reclaimed = 0
+        for path in filepaths:
+            if base_dir:
+                path = os.path.join(base_dir, path)
+            if self.image_store.owns(path, base_dir):
+                reclaimed += self.image_store.remove_if_unreferenced(path)
+            else:
+                reclaimed += remove_file(path)
+        return reclaimed
+    
+    def delete_detection_history(self, history_id, username=None):
+        """
+        Hapus satu history deteksi berdasar id dan hapus file gambarnya
+        Args:
+            username: Pemilik record (menentukan shard di ShardedDatabaseManager)
+        """
+        try:
+            conn = self._connect()
             cursor = conn.cursor()
             
-            # Ambil path gambar sebelum hapus
-            cursor.execute('SELECT filepath FROM detection_history WHERE id = ?', (history_id,))
-            row = cursor.fetchone()
-            if row and os.path.exists(row[0]):
-                os.remove(row[0])
-
-            # Hapus record
-            cursor.execute('DELETE FROM detection_history WHERE id = ?', (history_id,))
+            # Hapus record, file baru dihapus setelah commit berhasil
+            deleted, unused_files = self.delete_history_records(cursor, [history_id])
             conn.commit()
-            deleted = cursor.rowcount
             conn.close()
+            
+            self.remove_files(unused_files)
             return deleted > 0
         except Exception as e:
             print(f"Error saat menghapus history: {e}")
             return False
 
     def delete_old_detections(self, days=30):
-        """Hapus deteksi lama (opsional untuk maintenance)"""
+        """
+        Hapus deteksi lama (opsional untuk maintenance)
+        Dijalankan bertahap per chunk, lihat RetentionJob
+        """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
-            
-            cutoff_date = datetime.datetime.now() - datetime.timedelta(days=days)
-            
-            # Hapus file gambar terlebih dahulu
-            cursor.execute('''
-                SELECT filepath FROM detection_history 
-                WHERE tanggal_deteksi < ?
-            ''', (cutoff_date,))
-            
-            old_files = cursor.fetchall()
-            for file_path in old_files:
-                if os.path.exists(file_path[0]):
-                    os.remove(file_path[0])
-            
-            # Hapus record dari database
-            cursor.execute('''
-                DELETE FROM detection_history 
-                WHERE tanggal_deteksi < ?
-            ''', (cutoff_date,))
-            
-            conn.commit()
-            deleted_count = cursor.rowcount
-            conn.close()
+            from retention import RetentionJob
             
-            print(f"Dihapus {deleted_count} record lama")
+            RetentionJob(self, days=days).run_once()
             return True
             
         except Exception as e:
@@ -1,9 +1,15 @@
 import cv2
 import numpy as np
-from ultralytics import YOLO
 import os
+import hashlib
 from PIL import Image
 import streamlit as st
+from lesion_features import add_lesion_features
+
+# Threshold terendah saat model dijalankan; threshold tampilan difilter setelahnya
+CONFIDENCE_FLOOR = 0.05
+# Threshold tampilan default (UI dan ekspor)
+DEFAULT_CONFIDENCE_THRESHOLD = 0.25
 
 class SkinCancerDetector:
     def __init__(self, model_path="best.pt"):
@@ -14,14 +20,18 @@ class SkinCancerDetector:
         """
         self.model_path = model_path
         self.model = None
+        self.model_version = None
         self.load_model()
     
     def load_model(self):
         """Load model YOLO"""
         try:
             if os.path.exists(self.model_path):
+                # Import di sini: client remote (RemoteSkinCancerDetector) tidak butuh ultralytics
+                from ultralytics import YOLO
                 self.model = YOLO(self.model_path)
-                print(f"Model berhasil dimuat dari {self.model_path}")
+                self.model_version = self.compute_model_version(self.model_path)
+                print(f"Model berhasil dimuat dari {self.model_path} (versi {self.model_version})")
             else:
                 st.error(f"❌ File model tidak ditemukan: {self.model_path}")
                 st.info("📝 Pastikan file 'best.pt' ada di direktori yang sama dengan aplikasi")
@@ -30,33 +40,64 @@ class SkinCancerDetector:
             st.error(f"❌ Error saat memuat model: {str(e)}")
             self.model = None
     
-    def detect(self, image_path, confidence_threshold=0.25):
+    @staticmethod
+    def compute_model_version(model_path):
+        """Versi model = nama file + 12 karakter pertama SHA-256 isinya"""
+        digest = hashlib.sha256()
+        with open(model_path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(block)
+        return f"{os.path.basename(model_path)}:{digest.hexdigest()[:12]}"
+    
+    def detect(self, image_path, confidence_threshold=0.25, image=None):
         """
         Melakukan deteksi pada gambar
         Args:
             image_path: Path ke file gambar
             confidence_threshold: Threshold confidence untuk deteksi
+            image: Gambar RGB yang sudah di-decode (PIL, hasil ingest); jika ada,
+                   file di image_path tidak dibaca sama sekali
         Returns:
             tuple: (gambar hasil deteksi, list prediksi)
         """
+        image_rgb, raw_predictions = self.detect_raw(image_path, image=image)
+        predictions = self.filter_predictions(raw_predictions, confidence_threshold)
+        # Buffer milik pemanggil ini saja, anotasi langsung di tempat tanpa salinan
+        return self.annotate(image_rgb, predictions, in_place=True), predictions
+    
+    def detect_raw(self, image_path, image=None, image_scale=1.0):
+        """
+        Jalankan model sekali dengan threshold rendah (CONFIDENCE_FLOOR).
+        Threshold lain cukup diterapkan dengan filter_predictions + annotate
+        tanpa inferensi ulang.
+        Hanya satu buffer piksel yang dibuat: warna dibalik RGB -> BGR di tempat
+        untuk model, lalu dibalik lagi setelah inferensi untuk tampilan.
+        Setelah inferensi, fitur ABCDE (asimetri, border, warna, diameter)
+        dihitung untuk lesi-lesi teratas dan disimpan di prediksi (key "abcde").
+        Args:
+            image_scale: Skala image terhadap gambar asli (IngestedImage.scale);
+                         bbox dikembalikan dalam koordinat gambar asli
+        Returns:
+            tuple: (gambar RGB, list semua prediksi >= CONFIDENCE_FLOOR)
+        """
         if self.model is None:
             raise Exception("Model tidak tersedia. Pastikan file best.pt ada.")
         
         try:
-            # Baca gambar
-            image = cv2.imread(image_path)
-            if image is None:
-                raise Exception("Gagal membaca gambar")
-            
-            # Konversi BGR ke RGB untuk display
-            image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+            if image is not None:
+                # Pakai hasil decode yang sudah ada, model menerima array BGR
+                buffer = self.model_input(image)
+            else:
+                # Baca gambar
+                buffer = cv2.imread(image_path)
+                if buffer is None:
+                    raise Exception("Gagal membaca gambar")
             
-            # Lakukan prediksi
-            results = self.model(image_path, conf=confidence_threshold)
+            # Lakukan prediksi dari array yang sama (tanpa membaca file lagi)
+            results = self.model(buffer, conf=CONFIDENCE_FLOOR)
             
             # Ekstrak prediksi
             predictions = []
-            annotated_image = image_rgb.copy()
             
             if len(results) > 0 and len(results[0].boxes) > 0:
                 for result in results:
@@ -68,40 +109,84 @@ class SkinCancerDetector:
                         confidence = box.conf[0].cpu().numpy()
                         class_id = int(box.cls[0].cpu().numpy())
                         
-                        # Dapatkan nama kelas
-                        class_name = self.get_class_name(class_id)
-                        
                         # Simpan prediksi
                         predictions.append({
-                            'class': class_name,
+                            'class': self.get_class_name(class_id),
                             'confidence': float(confidence),
-                            'bbox': [int(x1), int(y1), int(x2), int(y2)]
+                            'bbox': [int(value / image_scale) for value in (x1, y1, x2, y2)]
                         })
-                        
-                        # Gambar bounding box dan label
-                        color = self.get_color_for_class(class_name)
-                        cv2.rectangle(annotated_image, (int(x1), int(y1)), (int(x2), int(y2)), color, 2)
-                        
-                        # Label dengan confidence
-                        label = f"{class_name}: {confidence:.2f}"
-                        label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)[0]
-                        
-                        # Background untuk text
-                        cv2.rectangle(annotated_image, 
-                                    (int(x1), int(y1) - label_size[1] - 10),
-                                    (int(x1) + label_size[0], int(y1)), 
-                                    color, -1)
-                        
-                        # Text label
-                        cv2.putText(annotated_image, label, 
-                                  (int(x1), int(y1) - 5),
-                                  cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
             
-            return annotated_image, predictions
+            # Tensor hasil model dilepas sebelum buffer dipakai ulang untuk tampilan
+            del results
+            cv2.cvtColor(buffer, cv2.COLOR_BGR2RGB, dst=buffer)
+            
+            # Fitur ABCDE semua lesi dalam satu pass; kegagalannya tidak menggagalkan deteksi
+            try:
+                add_lesion_features(buffer, predictions, scale=image_scale)
+            except Exception as e:
+                print(f"Error saat menghitung fitur ABCDE: {e}")
+            return buffer, predictions
             
         except Exception as e:
             raise Exception(f"Error saat deteksi: {str(e)}")
     
+    @staticmethod
+    def model_input(image):
+        """
+        Buffer BGR untuk model dari gambar PIL: satu salinan piksel, warna dibalik di tempat.
+        Array NumPy RGB (misal payload dari worker remote) langsung dipakai sebagai
+        buffer tanpa salinan; isinya kembali RGB setelah detect_raw selesai.
+        """
+        if isinstance(image, np.ndarray):
+            buffer = image
+        else:
+            buffer = np.array(image if image.mode == "RGB" else image.convert("RGB"))
+        return cv2.cvtColor(buffer, cv2.COLOR_RGB2BGR, dst=buffer)
+    
+    @staticmethod
+    def filter_predictions(predictions, confidence_threshold):
+        """Prediksi dengan confidence >= threshold (tanpa memanggil model)"""
+        return [pred for pred in predictions if pred['confidence'] >= confidence_threshold]
+    
+    def annotate(self, image_rgb, predictions, scale=1.0, in_place=False):
+        """
+        Gambar bounding box dan label pada salinan gambar
+        Args:
+            image_rgb: Gambar RGB (numpy array)
+            predictions: List prediksi dengan bbox di koordinat gambar asli
+            scale: Skala image_rgb terhadap gambar asli (untuk gambar tampilan yang diperkecil)
+            in_place: Gambar langsung pada image_rgb tanpa membuat salinan
+        Returns:
+            numpy array: gambar beranotasi
+        """
+        annotated_image = image_rgb if in_place else image_rgb.copy()
+        
+        for pred in predictions:
+            x1, y1, x2, y2 = (int(value * scale) for value in pred['bbox'])
+            class_name = pred['class']
+            confidence = pred['confidence']
+            
+            # Gambar bounding box dan label
+            color = self.get_color_for_class(class_name)
+            cv2.rectangle(annotated_image, (x1, y1), (x2, y2), color, 2)
+            
+            # Label dengan confidence
+            label = f"{class_name}: {confidence:.2f}"
+            label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 2)[0]
+            
+            # Background untuk text
+            cv2.rectangle(annotated_image, 
+                        (x1, y1 - label_size[1] - 10),
+                        (x1 + label_size[0], y1), 
+                        color, -1)
+            
+            # Text label
+            cv2.putText(annotated_image, label, 
+                      (x1, y1 - 5),
+                      cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+        
+        return annotated_image
+    
     def get_class_name(self, class_id):
         """
         Mendapatkan nama kelas berdasarkan ID
@@ -0,0 +1,510 @@
+import argparse
+import contextlib
+import importlib.metadata
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from utils import format_file_size
+
+# Paket yang diperiksa: nama modul -> nama distribusi (untuk versi)
+PACKAGES = {
+    "cv2": "opencv-python-headless",
+    "ultralytics": "ultralytics",
+    "torch": "torch",
+    "numpy": "numpy",
+    "PIL": "Pillow",
+    "streamlit": "streamlit",
+}
+OPENCV_DISTRIBUTIONS = ("opencv-python-headless", "opencv-python", "opencv-contrib-python")
+
+
+def cpu_count():
+    """Jumlah CPU yang benar-benar boleh dipakai proses ini"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _package_version(module, distribution):
+    names = OPENCV_DISTRIBUTIONS if module == "cv2" else (distribution,)
+    for name in names:
+        try:
+            return importlib.metadata.version(name)
+        except importlib.metadata.PackageNotFoundError:
+            continue
+    return None
+
+
+def probe_capabilities(model_path="best.pt", directories=("temp", "uploads", "history_images")):
+    """
+    Cek kemampuan host tanpa meng-import paket berat (hanya find_spec dan metadata)
+    Returns:
+        dict: python, cpu, memori, paket, model dan ruang disk
+    """
+    packages = {}
+    for module, distribution in PACKAGES.items():
+        installed = importlib.util.find_spec(module) is not None
+        packages[module] = {
+            "installed": installed,
+            "version": _package_version(module, distribution) if installed else None,
+        }
+
+    try:
+        memory_bytes = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        memory_bytes = None
+
+    disks = {}
+    for directory in directories:
+        if os.path.isdir(directory):
+            usage = shutil.disk_usage(directory)
+            disks[directory] = {"free_bytes": usage.free, "total_bytes": usage.total}
+
+    return {
+        "python": sys.version.split()[0],
+        "cpu_count": cpu_count(),
+        "memory_bytes": memory_bytes,
+        "packages": packages,
+        "model_available": os.path.exists(model_path),
+        "disks": disks,
+    }
+
+
+def _proc_status_bytes(field):
+    """Nilai field memori dari /proc/self/status (byte), None jika tidak tersedia"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+class PeakMemory:
+    """
+    Ukur puncak memori (RSS) proses selama satu permintaan.
+    Di Linux penanda puncak (VmHWM) di-reset lewat /proc/self/clear_refs saat
+    start(), sehingga peak_delta adalah tambahan RSS tertinggi selama
+    permintaan. RSS milik seluruh proses: permintaan lain yang berjalan
+    bersamaan ikut terhitung dan juga me-reset penanda, jadi nilai per
+    permintaan adalah perkiraan. Di platform tanpa clear_refs nilainya None.
+    """
+
+    def __init__(self):
+        self.start_bytes = None
+        self.peak_bytes = None
+        self._supported = False
+
+    def start(self):
+        try:
+            with open("/proc/self/clear_refs", "w") as f:
+                f.write("5")
+            self._supported = True
+        except OSError:
+            self._supported = False
+        self.start_bytes = _proc_status_bytes("VmRSS")
+        return self
+
+    def stop(self):
+        if self._supported:
+            self.peak_bytes = _proc_status_bytes("VmHWM")
+        return self
+
+    @property
+    def peak_delta_bytes(self):
+        if self.peak_bytes is None or self.start_bytes is None:
+            return None
+        return max(0, self.peak_bytes - self.start_bytes)
+
+    @property
+    def peak_delta_mb(self):
+        delta = self.peak_delta_bytes
+        return None if delta is None else round(delta / (1024 * 1024), 1)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+# ----------------------------------------------------------------------
+# Micro-benchmark
+# ----------------------------------------------------------------------
+
+def _inference_fn(model_path, imgsz):
+    """
+    Fungsi inferensi untuk benchmark: model YOLO asli jika best.pt ada,
+    jika tidak pakai beban konvolusi pengganti dengan ukuran input yang sama
+    Returns: tuple (fn(batch), sumber) atau (None, alasan)
+    """
+    if importlib.util.find_spec("torch") is None:
+        return None, "torch tidak terpasang"
+
+    import numpy as np
+    import torch
+
+    if os.path.exists(model_path) and importlib.util.find_spec("ultralytics") is not None:
+        from ultralytics import YOLO
+        model = YOLO(model_path)
+
+        def run(batch_size):
+            images = [np.zeros((imgsz, imgsz, 3), dtype=np.uint8)] * batch_size
+            model(images, imgsz=imgsz, verbose=False)
+        return run, "model"
+
+    layers = []
+    channels = 3
+    for width in (16, 32, 64, 128):
+        layers += [torch.nn.Conv2d(channels, width, 3, stride=2, padding=1), torch.nn.SiLU()]
+        channels = width
+    proxy = torch.nn.Sequential(*layers).eval()
+
+    def run(batch_size):
+        with torch.inference_mode():
+            proxy(torch.zeros(batch_size, 3, imgsz, imgsz))
+    return run, "proxy"
+
+
+def benchmark_inference(model_path="best.pt", thread_counts=None, batch_sizes=(1, 2, 4),
+                        imgsz=640, repeat=3):
+    """
+    Ukur throughput inferensi CPU pada beberapa jumlah thread torch dan ukuran batch
+    Returns:
+        dict: {"source": "model"/"proxy", "results": [{threads, batch, images_per_sec, batch_ms}]}
+    """
+    run, source = _inference_fn(model_path, imgsz)
+    if run is None:
+        return {"source": None, "error": source, "results": []}
+
+    import torch
+
+    cpus = cpu_count()
+    thread_counts = thread_counts or sorted({1, max(1, cpus // 2), cpus})
+    original_threads = torch.get_num_threads()
+    results = []
+    try:
+        for threads in thread_counts:
+            torch.set_num_threads(threads)
+            for batch_size in batch_sizes:
+                run(batch_size)  # pemanasan
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    run(batch_size)
+                    timings.append(time.perf_counter() - start)
+                batch_seconds = statistics.median(timings)
+                results.append({
+                    "threads": threads,
+                    "batch": batch_size,
+                    "batch_ms": round(batch_seconds * 1000, 1),
+                    "images_per_sec": round(batch_size / batch_seconds, 2),
+                })
+    finally:
+        torch.set_num_threads(original_threads)
+
+    return {"source": source, "results": results}
+
+
+def benchmark_sqlite(directory=".", commits=200):
+    """
+    Ukur latensi commit SQLite (WAL, synchronous=NORMAL seperti aplikasi)
+    di filesystem yang sama dengan database
+    Returns:
+        dict: p50_ms, p99_ms, commits_per_sec
+    """
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE t (id INTEGER PRIMARY KEY, payload TEXT)")
+            conn.commit()
+
+            latencies = []
+            start_total = time.perf_counter()
+            for i in range(commits):
+                start = time.perf_counter()
+                conn.execute("INSERT INTO t (payload) VALUES (?)", ("x" * 200,))
+                conn.commit()
+                latencies.append((time.perf_counter() - start) * 1000)
+            total = time.perf_counter() - start_total
+        finally:
+            conn.close()
+
+    latencies.sort()
+    return {
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 3),
+        "commits_per_sec": round(commits / total, 1),
+    }
+
+
+def benchmark_disk(directories=("temp", "uploads", "history_images"), size_mb=8):
+    """
+    Ukur kecepatan tulis (dengan fsync) di setiap direktori gambar
+    Returns:
+        dict: direktori -> MB/detik
+    """
+    block = os.urandom(1024 * 1024)
+    results = {}
+    for directory in directories:
+        if not os.path.isdir(directory):
+            continue
+        fd, path = tempfile.mkstemp(dir=directory, prefix=".bench-")
+        try:
+            start = time.perf_counter()
+            with os.fdopen(fd, "wb") as f:
+                for _ in range(size_mb):
+                    f.write(block)
+                f.flush()
+                os.fsync(f.fileno())
+            results[directory] = round(size_mb / (time.perf_counter() - start), 1)
+        finally:
+            os.remove(path)
+    return results
+
+
+def _detect_memory_worker(mode, image_path, model_path, results):
+    """
+    Satu alur deteksi di proses baru (RSS awal bersih), hasil dikirim lewat antrian.
+    mode "penuh": alur sebelum batas resolusi kerja (decode penuh, salinan BGR terpisah);
+    mode "dibatasi": alur sekarang (decode ke WORKING_MAX_SIDE, satu buffer di tempat).
+    """
+    import cv2
+    import numpy as np
+    from PIL import Image
+    from detection import SkinCancerDetector, CONFIDENCE_FLOOR
+    from ingest import ingest_upload, WORKING_MAX_SIDE
+
+    detector = SkinCancerDetector(model_path)
+    with open(image_path, "rb") as f:
+        data = f.read()
+    fallback_predictions = [{"class": "Melanoma", "confidence": 0.9, "bbox": [10, 10, 200, 200]}]
+
+    def run(payload, name):
+        if mode == "penuh":
+            ingested = ingest_upload(payload, name)
+            image_rgb = np.asarray(ingested.image)
+            image_bgr = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR)
+            if detector.model is not None:
+                detector.model(image_bgr, conf=CONFIDENCE_FLOOR, verbose=False)
+            scale = min(1.0, 1280 / max(image_rgb.shape[:2]))
+            display = image_rgb
+            if scale < 1.0:
+                display = cv2.resize(image_rgb, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+            predictions = fallback_predictions
+        else:
+            ingested = ingest_upload(payload, name, max_side=WORKING_MAX_SIDE)
+            if detector.model is not None:
+                display, predictions = detector.detect_raw(None, image=ingested.image,
+                                                           image_scale=ingested.scale)
+            else:
+                display = detector.model_input(ingested.image)
+                cv2.cvtColor(display, cv2.COLOR_BGR2RGB, dst=display)
+                predictions = fallback_predictions
+            scale = ingested.scale
+        annotated = detector.annotate(display, predictions, scale=scale)
+        # Seperti di aplikasi: gambar ingest dan hasil tampilan tetap disimpan di sesi
+        return ingested, annotated
+
+    # Pemanasan (inisialisasi lazy OpenCV/torch) dengan gambar kecil
+    warmup = io.BytesIO()
+    Image.new("RGB", (64, 64)).save(warmup, format="JPEG")
+    run(warmup.getvalue(), "warmup.jpg")
+
+    with PeakMemory() as memory:
+        kept = run(data, os.path.basename(image_path))
+    results.put({
+        "mode": mode,
+        "peak_delta_mb": memory.peak_delta_mb,
+        "retained_image_mb": round((kept[0].image.width * kept[0].image.height * 4
+                                    + kept[1].nbytes) / (1024 * 1024), 1),
+        "model": detector.model is not None,
+    })
+
+
+def benchmark_detect_memory(image_path, model_path="best.pt"):
+    """
+    Bandingkan puncak memori per permintaan deteksi: decode resolusi penuh vs
+    decode ke resolusi kerja dengan satu buffer. Setiap alur dijalankan di
+    proses terpisah agar memori yang ditahan allocator tidak saling memengaruhi.
+    Tanpa best.pt langkah inferensi dilewati (decode, konversi warna dan anotasi tetap diukur).
+    Returns:
+        list dict: mode, peak_delta_mb, retained_image_mb, model
+    """
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    rows = []
+    for mode in ("penuh", "dibatasi"):
+        process = context.Process(target=_detect_memory_worker, args=(mode, image_path, model_path, results))
+        process.start()
+        rows.append(results.get(timeout=600))
+        process.join()
+    return rows
+
+
+# ----------------------------------------------------------------------
+# Rekomendasi
+# ----------------------------------------------------------------------
+
+def recommend_settings(capabilities, inference, sqlite_result):
+    """
+    Turunkan pengaturan dari hasil benchmark, langsung dalam bentuk variabel
+    environment yang dibaca aplikasi (lihat admission_from_env dan main.init_managers)
+    Returns:
+        dict: env (nama variabel -> nilai) dan notes (alasan)
+    """
+    cpus = capabilities["cpu_count"]
+    torch_threads = max(1, cpus)
+    concurrency = 1
+    notes = []
+
+    results = inference.get("results") or []
+    single = [row for row in results if row["batch"] == 1]
+    if single:
+        # Aplikasi selalu menginferensi satu gambar per panggilan, jadi hanya baris batch 1 yang relevan
+        best_single = max(single, key=lambda row: row["images_per_sec"])
+        torch_threads = best_single["threads"]
+        # Sisa core dipakai inferensi paralel, masing-masing dengan jumlah thread yang sama
+        concurrency = max(1, cpus // torch_threads)
+        notes.append(
+            f"Inferensi ({inference['source']}): {best_single['images_per_sec']} gambar/detik "
+            f"dengan {torch_threads} thread torch")
+    else:
+        notes.append(f"Benchmark inferensi dilewati: {inference.get('error')}")
+
+    if concurrency > 1:
+        notes.append("OpenCV otomatis dibatasi ke 1 thread karena DETECTION_CONCURRENCY > 1")
+
+    p50 = sqlite_result["p50_ms"]
+    if p50 > 5:
+        notes.append(f"Commit SQLite lambat ({p50} ms), pertimbangkan disk yang lebih cepat untuk database")
+
+    return {
+        "env": {
+            # Thread worker job hanya berguna sebanyak slot inferensi yang tersedia
+            "DETECTION_JOB_WORKERS": concurrency,
+            "DETECTION_CONCURRENCY": concurrency,
+            "TORCH_THREADS": torch_threads,
+        },
+        "notes": notes,
+    }
+
+
+def run_diagnostics(model_path="best.pt", db_directory=".", quick=False):
+    """
+    Jalankan semua probe dan benchmark
+    Args:
+        quick: Benchmark lebih singkat (untuk halaman admin)
+    Returns:
+        dict: capabilities, inference, sqlite, disk, recommendation
+    """
+    capabilities = probe_capabilities(model_path)
+    inference = benchmark_inference(
+        model_path,
+        batch_sizes=(1, 2) if quick else (1, 2, 4),
+        imgsz=320 if quick else 640,
+        repeat=2 if quick else 3,
+    )
+    sqlite_result = benchmark_sqlite(db_directory, commits=50 if quick else 200)
+    disk = benchmark_disk(size_mb=2 if quick else 8)
+    return {
+        "capabilities": capabilities,
+        "inference": inference,
+        "sqlite": sqlite_result,
+        "disk_mb_per_sec": disk,
+        "recommendation": recommend_settings(capabilities, inference, sqlite_result),
+    }
+
+
+def run_diagnostics_subprocess(model_path="best.pt", quick=True, timeout=900):
+    """
+    Jalankan run_diagnostics di proses terpisah (python diagnostics.py --json).
+    Benchmark mengubah torch.set_num_threads yang berlaku untuk seluruh proses
+    dan memuat model kedua, jadi tidak boleh berjalan di proses aplikasi yang
+    sedang melayani inferensi user lain.
+    Returns: dict hasil run_diagnostics; RuntimeError jika proses gagal
+    """
+    command = [sys.executable, os.path.abspath(__file__), "--model", model_path, "--json"]
+    if quick:
+        command.append("--quick")
+    result = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+    if result.returncode != 0:
+        raise RuntimeError(f"Benchmark gagal (kode {result.returncode}): {result.stderr.strip()[-500:]}")
+    # Output library yang tidak lewat sys.stdout bisa muncul sebelum JSON
+    return json.loads(result.stdout[result.stdout.index("{"):])
+
+
+def print_report(report):
+    capabilities = report["capabilities"]
+    print(f"Python {capabilities['python']}, {capabilities['cpu_count']} CPU, "
+          f"memori {format_file_size(capabilities['memory_bytes']) if capabilities['memory_bytes'] else '?'}")
+    for module, info in capabilities["packages"].items():
+        status = (info["version"] or "terpasang") if info["installed"] else "TIDAK ADA"
+        print(f"  {module:<12} {status}")
+    print(f"  model        {'ada' if capabilities['model_available'] else 'TIDAK ADA'}")
+
+    inference = report["inference"]
+    if inference["results"]:
+        print(f"\nInferensi ({inference['source']}):")
+        print(f"{'thread':>8} {'batch':>6} {'ms/batch':>10} {'gambar/dtk':>11}")
+        for row in inference["results"]:
+            print(f"{row['threads']:>8} {row['batch']:>6} {row['batch_ms']:>10} {row['images_per_sec']:>11}")
+
+    sqlite_result = report["sqlite"]
+    print(f"\nSQLite commit: p50 {sqlite_result['p50_ms']} ms, p99 {sqlite_result['p99_ms']} ms, "
+          f"{sqlite_result['commits_per_sec']} commit/detik")
+    for directory, speed in report["disk_mb_per_sec"].items():
+        print(f"Tulis disk {directory}: {speed} MB/detik")
+
+    recommendation = report["recommendation"]
+    print("\nRekomendasi (environment):")
+    for name, value in recommendation["env"].items():
+        print(f"  {name}={value}")
+    for note in recommendation["notes"]:
+        print(f"  - {note}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Diagnostik host dan rekomendasi pengaturan")
+    parser.add_argument("--model", default="best.pt", help="Path model YOLO")
+    parser.add_argument("--quick", action="store_true", help="Benchmark singkat")
+    parser.add_argument("--json", action="store_true", help="Cetak hasil sebagai JSON")
+    parser.add_argument("--detect-memory", metavar="GAMBAR",
+                        help="Ukur puncak memori per permintaan deteksi untuk gambar ini")
+    args = parser.parse_args()
+
+    if args.detect_memory:
+        rows = benchmark_detect_memory(args.detect_memory, args.model)
+        if args.json:
+            print(json.dumps(rows, indent=2))
+        else:
+            print(f"{'alur':<10} {'puncak (MB)':>12} {'ditahan sesi (MB)':>18}")
+            for row in rows:
+                print(f"{row['mode']:<10} {row['peak_delta_mb']!s:>12} {row['retained_image_mb']:>18}")
+            if not rows[0]["model"]:
+                print("Catatan: best.pt tidak ada, langkah inferensi tidak diukur")
+        sys.exit(0)
+
+    if args.json:
+        # Pesan dari probe/benchmark ke stderr supaya stdout hanya berisi JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            result = run_diagnostics(args.model, quick=args.quick)
+        print(json.dumps(result, indent=2))
+        sys.exit(0)
+
+    print_report(run_diagnostics(args.model, quick=args.quick))
@@ -0,0 +1,113 @@
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+
+from detection import DEFAULT_CONFIDENCE_THRESHOLD
+from utils import parse_predictions
+
+CSV_COLUMNS = ["id", "tanggal_deteksi", "filename", "image", "jumlah_deteksi", "hasil_deteksi"]
+
+
+def _image_arcname(row):
+    """Nama file gambar di dalam arsip: images/<id><ekstensi>"""
+    ext = os.path.splitext(row[3])[1].lower() or ".jpg"
+    return f"images/{row[0]}{ext}"
+
+
+def _row_to_record(row, has_image, threshold):
+    # Riwayat menyimpan deteksi mentah; yang diekspor sama dengan yang ditampilkan
+    predictions = [pred for pred in parse_predictions(row[5]) if pred["confidence"] >= threshold]
+    return {
+        "id": row[0],
+        "tanggal_deteksi": row[4],
+        "filename": row[2],
+        "image": _image_arcname(row) if has_image else "",
+        "jumlah_deteksi": len(predictions),
+        "hasil_deteksi": predictions,
+    }
+
+
+def export_history_zip(db_manager, username, output, include_images=True, batch_size=500,
+                       threshold=DEFAULT_CONFIDENCE_THRESHOLD):
+    """
+    Ekspor seluruh history deteksi user ke arsip ZIP secara streaming.
+    Arsip berisi history.csv, history.jsonl dan folder images/. History dibaca
+    sekali dari cursor DatabaseManager.iter_detection_history() per batch:
+    CSV langsung ditulis ke arsip, sedangkan JSONL dan daftar gambar ditampung
+    di file sementara, jadi ketiga bagian berasal dari snapshot yang sama dan
+    memori yang dipakai konstan berapa pun jumlah history. Gambar disalin per
+    file. output boleh berupa stream yang tidak bisa di-seek.
+    Args:
+        db_manager: DatabaseManager sumber data
+        username: Username pemilik history
+        output: Path file atau file object biner tujuan
+        include_images: Sertakan file gambar asli
+        batch_size: Jumlah baris per fetch dari database
+        threshold: Threshold keyakinan tampilan; prediksi di bawahnya tidak diekspor
+    Returns:
+        int: Jumlah record yang diekspor
+    """
+    count = 0
+    with zipfile.ZipFile(output, "w", compression=zipfile.ZIP_DEFLATED) as archive, \
+            tempfile.TemporaryFile() as jsonl, \
+            tempfile.TemporaryFile(mode="w+", encoding="utf-8") as images:
+        # history.csv, sekaligus menampung history.jsonl dan daftar gambar
+        with archive.open("history.csv", "w", force_zip64=True) as raw:
+            text = io.TextIOWrapper(raw, encoding="utf-8", newline="")
+            writer = csv.writer(text)
+            writer.writerow(CSV_COLUMNS)
+            for row in db_manager.iter_detection_history(username, batch_size):
+                has_image = include_images and os.path.exists(row[3])
+                record = _row_to_record(row, has_image, threshold)
+                jsonl.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+                if has_image:
+                    images.write(json.dumps([row[3], record["image"]]) + "\n")
+                record["hasil_deteksi"] = json.dumps(record["hasil_deteksi"], ensure_ascii=False)
+                writer.writerow([record[column] for column in CSV_COLUMNS])
+                count += 1
+            text.flush()
+            text.detach()
+
+        # history.jsonl (satu record JSON per baris)
+        jsonl.seek(0)
+        with archive.open("history.jsonl", "w", force_zip64=True) as raw:
+            shutil.copyfileobj(jsonl, raw)
+
+        # Gambar sudah terkompresi, disimpan tanpa deflate
+        images.seek(0)
+        for line in images:
+            path, arcname = json.loads(line)
+            try:
+                archive.write(path, arcname, compress_type=zipfile.ZIP_STORED)
+            except FileNotFoundError:
+                print(f"Gambar {path} hilang saat ekspor, dilewati")
+
+    return count
+
+
+if __name__ == "__main__":
+    from sharding import open_database
+
+    parser = argparse.ArgumentParser(description="Ekspor history deteksi user ke arsip ZIP")
+    parser.add_argument("username", help="Username pemilik history")
+    parser.add_argument("output", help="Path file ZIP tujuan, '-' untuk stdout")
+    parser.add_argument("--db", default="skin_cancer_app.db", help="Path database SQLite")
+    parser.add_argument("--no-images", action="store_true", help="Jangan sertakan file gambar")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_CONFIDENCE_THRESHOLD,
+                        help="Threshold keyakinan (0-1); prediksi di bawahnya tidak diekspor")
+    args = parser.parse_args()
+
+    # Pesan inisialisasi database tidak boleh ikut masuk ke stdout saat output '-'
+    with contextlib.redirect_stdout(sys.stderr):
+        db_manager = open_database(args.db, write_behind=False)
+    output = sys.stdout.buffer if args.output == "-" else args.output
+    total = export_history_zip(db_manager, args.username, output, include_images=not args.no_images,
+                               threshold=args.threshold)
+    print(f"{total} record diekspor", file=sys.stderr)
@@ -0,0 +1,284 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+
+
+class _GroupTask:
+    """Fungsi fn(cursor) yang dijalankan di transaksi grup berikutnya, hasilnya ditunggu pemanggil"""
+
+    __slots__ = ("username", "fn", "done", "value", "error")
+
+    def __init__(self, username, fn):
+        self.username = username
+        self.fn = fn
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+def _owner(item):
+    return item.username if isinstance(item, _GroupTask) else item[0]
+
+
+class HistoryWriter:
+    """
+    Penulis history deteksi di background (write-behind) dengan group commit.
+    Record dimasukkan ke antrian terbatas lalu di-commit berkelompok oleh satu
+    thread, sehingga fsync tidak lagi berada di jalur klik user.
+    Penyelesaian job deteksi (execute) ikut di transaksi grup yang sama, jadi
+    beberapa worker yang selesai bersamaan berbagi satu commit.
+    Grup yang tetap gagal setelah max_retries ditulis ulang per record; record
+    yang masih gagal disimpan ke file spill (JSON lines, beserta referensi
+    gambarnya) dan dimasukkan kembali saat writer berikutnya dibuat. Task
+    execute yang gagal dikembalikan sebagai exception ke pemanggilnya.
+    """
+
+    def __init__(self, db_manager, max_queue=1000, batch_size=64, max_delay=0.05,
+                 put_timeout=0.5, max_retries=5, spill_path=None):
+        """
+        Args:
+            db_manager: DatabaseManager pemilik tabel detection_history
+            max_queue: Kapasitas maksimal antrian record
+            batch_size: Jumlah record maksimal per commit
+            max_delay: Waktu tunggu maksimal (detik) untuk mengumpulkan satu grup
+            put_timeout: Waktu tunggu (detik) saat antrian penuh sebelum menyerah
+            max_retries: Jumlah percobaan ulang commit sebelum grup dianggap gagal
+            spill_path: File record yang gagal disimpan, default <db_path>.spill.jsonl
+        """
+        self.db_manager = db_manager
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self.spill_path = spill_path or f"{db_manager.db_path}.spill.jsonl"
+        # Jumlah record yang masuk file spill sejak proses berjalan
+        self.spilled = 0
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = {}  # username -> jumlah record yang belum di-commit
+        self._cond = threading.Condition()
+        self._closed = False
+        self._spill_lock = threading.Lock()
+        self.recover_spill()
+
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, username, filename, filepath, hasil_deteksi, image_hash=None):
+        """
+        Masukkan record ke antrian
+        Returns: True jika masuk antrian, False jika antrian penuh atau writer sudah ditutup
+        """
+        with self._cond:
+            if self._closed:
+                return False
+            self._pending[username] = self._pending.get(username, 0) + 1
+
+        try:
+            self._queue.put((username, filename, filepath, hasil_deteksi, image_hash), timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            self._mark_done([username])
+            return False
+
+    def execute(self, username, fn, timeout=30.0):
+        """
+        Jalankan fn(cursor) di transaksi grup berikutnya dan tunggu commit-nya.
+        Jika antrian penuh atau writer sudah ditutup, fn dijalankan langsung di
+        transaksi sendiri.
+        Args:
+            username: Pemilik data yang ditulis (untuk wait_for_user)
+            fn: Fungsi yang menerima cursor transaksi aktif
+        Returns: nilai kembali fn; exception fn (atau commit) diteruskan ke pemanggil
+        """
+        task = _GroupTask(username, fn)
+        with self._cond:
+            queued = not self._closed
+            if queued:
+                self._pending[username] = self._pending.get(username, 0) + 1
+
+        if queued:
+            try:
+                self._queue.put(task, timeout=self.put_timeout)
+            except queue.Full:
+                self._mark_done([username])
+                queued = False
+        if not queued:
+            return self._transaction([], [task])[0]
+
+        if not task.done.wait(timeout):
+            raise TimeoutError(f"Commit history tidak selesai dalam {timeout} detik")
+        if task.error is not None:
+            raise task.error
+        return task.value
+
+    def wait_for_user(self, username, timeout=5.0):
+        """
+        Tunggu sampai semua record milik user sudah di-commit (read-your-writes)
+        Returns: True jika tidak ada lagi record yang tertunda
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending.get(username, 0) == 0, timeout)
+
+    def flush(self, timeout=30.0):
+        """Tunggu sampai seluruh antrian selesai di-commit"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending, timeout)
+
+    def close(self, timeout=30.0):
+        """Tutup writer, semua record di antrian di-commit terlebih dahulu"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            # Thread tetap mengosongkan antrian lalu berhenti karena _closed
+            print("Antrian history penuh saat ditutup, menunggu writer selesai")
+        self._thread.join(timeout)
+
+    def _mark_done(self, usernames):
+        with self._cond:
+            for username in usernames:
+                remaining = self._pending.get(username, 0) - 1
+                if remaining > 0:
+                    self._pending[username] = remaining
+                else:
+                    self._pending.pop(username, None)
+            self._cond.notify_all()
+
+    def _collect_batch(self, first):
+        """Kumpulkan record sampai batch_size atau max_delay tercapai"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_delay
+        stop = False
+
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+
+        return batch, stop
+
+    def _transaction(self, records, tasks):
+        """Tulis record dan jalankan task dalam satu transaksi; Returns: hasil tiap task"""
+        conn = self.db_manager._connect()
+        try:
+            with conn:
+                cursor = conn.cursor()
+                if records:
+                    self.db_manager.insert_history_records(cursor, records)
+                return [task.fn(cursor) for task in tasks]
+        finally:
+            conn.close()
+
+    def _commit_batch(self, records, tasks):
+        for attempt in range(self.max_retries):
+            try:
+                for task, value in zip(tasks, self._transaction(records, tasks)):
+                    task.value = value
+                return True
+            except Exception as e:
+                print(f"Error saat commit history (percobaan {attempt + 1}): {e}")
+                time.sleep(min(0.05 * (2 ** attempt), 1.0))
+        return False
+
+    def _save_batch(self, batch):
+        """Commit grup; jika tetap gagal, tulis per item lalu simpan record yang tersisa ke file spill"""
+        records = [item for item in batch if not isinstance(item, _GroupTask)]
+        tasks = [item for item in batch if isinstance(item, _GroupTask)]
+        try:
+            if self._commit_batch(records, tasks):
+                return
+            failed = []
+            for record in records:
+                try:
+                    self._transaction([record], [])
+                except Exception as e:
+                    print(f"Error saat menyimpan history secara sinkron: {e}")
+                    failed.append(record)
+            for task in tasks:
+                try:
+                    task.value = self._transaction([], [task])[0]
+                except Exception as e:
+                    task.error = e
+            if failed:
+                self._spill(failed)
+        finally:
+            for task in tasks:
+                task.done.set()
+
+    def _spill(self, records):
+        try:
+            with self._spill_lock, open(self.spill_path, "a", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.spilled += len(records)
+            print(f"Gagal menyimpan {len(records)} record history, disimpan di {self.spill_path}")
+        except OSError as e:
+            print(f"Error saat menyimpan spill history: {e}; {len(records)} record hilang")
+
+    def recover_spill(self):
+        """
+        Masukkan kembali record dari file spill (dipanggil saat writer dibuat)
+        Returns: jumlah record yang berhasil dipulihkan
+        """
+        with self._spill_lock:
+            if not os.path.exists(self.spill_path):
+                return 0
+            try:
+                with open(self.spill_path, encoding="utf-8") as f:
+                    records = [tuple(json.loads(line)) for line in f if line.strip()]
+                self.db_manager.insert_detection_history_batch(records)
+                os.remove(self.spill_path)
+                print(f"{len(records)} record history dipulihkan dari {self.spill_path}")
+                return len(records)
+
+            except Exception as e:
+                print(f"Error saat memulihkan spill history: {e}")
+                return 0
+
+    def _run(self):
+        stop = False
+        while not stop:
+            try:
+                item = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._closed:
+                    break
+                continue
+            if item is None:
+                break
+
+            batch, stop = self._collect_batch(item)
+            self._save_batch(batch)
+            self._mark_done([_owner(item) for item in batch])
+
+        # Kosongkan sisa antrian sebelum thread berhenti
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                leftovers.append(item)
+
+        for start in range(0, len(leftovers), self.batch_size):
+            batch = leftovers[start:start + self.batch_size]
+            self._save_batch(batch)
+            self._mark_done([_owner(item) for item in batch])
@@ -0,0 +1,289 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+from PIL import Image, ImageOps
+
+# Varian tampilan yang disimpan berdampingan dengan gambar sumber: nama -> ukuran maksimal
+DISPLAY_VARIANTS = {
+    "preview": (640, 640),
+}
+VARIANT_FORMAT = "webp"
+VARIANT_QUALITY = 80
+
+
+def variant_path(source_path, variant):
+    """Path varian tampilan, contoh: abcd.jpg -> abcd.jpg.preview.webp"""
+    return f"{source_path}.{variant}.{VARIANT_FORMAT}"
+
+
+def variant_source(path):
+    """Kebalikan dari variant_path(); None jika path bukan file varian"""
+    for variant in DISPLAY_VARIANTS:
+        suffix = f".{variant}.{VARIANT_FORMAT}"
+        if path.endswith(suffix):
+            return path[:-len(suffix)]
+    return None
+
+
+def generate_variants(source_path, variants=None, image=None):
+    """
+    Buat varian tampilan (WebP) dari gambar sumber dengan satu kali decode.
+    Untuk JPEG dipakai draft mode sehingga decoder langsung mengecilkan
+    gambar dengan skala 1/2, 1/4 atau 1/8 tanpa decode resolusi penuh.
+    Args:
+        source_path: Path gambar sumber
+        variants: List nama varian, default semua DISPLAY_VARIANTS
+        image: Gambar RGB yang sudah di-decode (hasil ingest), jika ada
+               file sumber tidak dibaca ulang
+    Returns:
+        dict: nama varian -> path file varian
+    """
+    variants = variants or list(DISPLAY_VARIANTS)
+    largest = max((DISPLAY_VARIANTS[name] for name in variants), key=lambda size: size[0] * size[1])
+    paths = {}
+
+    if image is not None:
+        # Salinan langsung pada ukuran varian terbesar, bukan salinan seukuran sumber
+        ratio = min(largest[0] / image.width, largest[1] / image.height)
+        if ratio < 1:
+            size = (max(1, round(image.width * ratio)), max(1, round(image.height * ratio)))
+            image = image.resize(size, Image.Resampling.BILINEAR, reducing_gap=2.0)
+        else:
+            image = image.copy()
+    else:
+        with Image.open(source_path) as source:
+            source.draft("RGB", largest)
+            image = ImageOps.exif_transpose(source)
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGB")
+
+    # Dari varian terbesar ke terkecil supaya setiap resize memakai hasil sebelumnya
+    for name in sorted(variants, key=lambda n: DISPLAY_VARIANTS[n][0] * DISPLAY_VARIANTS[n][1], reverse=True):
+        image.thumbnail(DISPLAY_VARIANTS[name], Image.Resampling.BILINEAR, reducing_gap=2.0)
+        path = variant_path(source_path, name)
+        # File sementara unik: sesi lain bisa membuat varian yang sama bersamaan
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".tmp-",
+                                        suffix=f".{VARIANT_FORMAT}")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                image.save(f, format=VARIANT_FORMAT.upper(), quality=VARIANT_QUALITY, method=4)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        paths[name] = path
+
+    return paths
+
+
+def get_variant(source_path, variant="preview"):
+    """
+    Ambil path varian tampilan, dibuat saat itu juga untuk record lama
+    yang belum punya varian. Jika gagal, path sumber dikembalikan.
+    """
+    path = variant_path(source_path, variant)
+    if os.path.exists(path):
+        return path
+    try:
+        return generate_variants(source_path).get(variant, source_path)
+    except Exception as e:
+        print(f"Error membuat varian {variant} untuk {source_path}: {e}")
+        return source_path
+
+
+def remove_variants(source_path):
+    """
+    Hapus semua varian tampilan milik gambar sumber
+    Returns: jumlah byte yang dibebaskan
+    """
+    reclaimed = 0
+    for variant in DISPLAY_VARIANTS:
+        path = variant_path(source_path, variant)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            reclaimed += size
+        except FileNotFoundError:
+            pass
+    return reclaimed
+
+
+class ImageStore:
+    """
+    Penyimpanan gambar berbasis isi (content-addressed).
+    Setiap gambar disimpan sekali dengan nama hash SHA-256 di direktori
+    yang di-shard dua tingkat (ab/cd/abcd...jpg). Jumlah referensi disimpan
+    di tabel image_blobs; file baru dihapus ketika tidak ada lagi record
+    history yang merujuknya.
+    """
+
+    def __init__(self, db_manager, root="history_images"):
+        """
+        Args:
+            db_manager: DatabaseManager pemilik tabel image_blobs
+            root: Direktori akar penyimpanan blob
+        """
+        self.db_manager = db_manager
+        self.root = root
+        # Melindungi jeda antara cek referensi dan operasi file
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def init_table(cursor):
+        """Buat tabel image_blobs di dalam transaksi inisialisasi database"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS image_blobs (
+                hash TEXT PRIMARY KEY,
+                filepath TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                refcount INTEGER NOT NULL DEFAULT 0,
+                tanggal_dibuat TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+
+    @staticmethod
+    def compute_hash(data):
+        return hashlib.sha256(data).hexdigest()
+
+    @staticmethod
+    def normalize_extension(filename):
+        """Ambil ekstensi file dalam bentuk baku (.jpeg -> .jpg)"""
+        ext = os.path.splitext(filename or "")[1].lower()
+        if ext in ("", ".jpeg", ".jpe"):
+            return ".jpg"
+        if ext == ".tif":
+            return ".tiff"
+        return ext
+
+    def blob_path(self, image_hash, ext):
+        """Path blob dengan shard dua tingkat berdasarkan prefix hash"""
+        return os.path.join(self.root, image_hash[:2], image_hash[2:4], f"{image_hash}{ext}")
+
+    def owns(self, filepath, base_dir=None):
+        """
+        Cek apakah path berada di dalam store
+        Args:
+            base_dir: Direktori acuan path relatif (root dan filepath), default direktori kerja
+        """
+        base_dir = base_dir or ""
+        root = os.path.abspath(os.path.join(base_dir, self.root)) + os.sep
+        return os.path.abspath(os.path.join(base_dir, filepath)).startswith(root)
+
+    def _write_atomic(self, path, data):
+        """Tulis ke file sementara lalu rename, sehingga pembaca tidak pernah melihat file setengah jadi"""
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def put(self, data, filename="", image=None):
+        """
+        Simpan gambar dan ambil satu referensi ke blob tersebut.
+        Referensi ini kemudian dimiliki oleh record history yang disimpan
+        dengan image_hash yang sama; jika record batal dibuat panggil release().
+        Args:
+            data: Isi file gambar (bytes)
+            filename: Nama file asli, dipakai untuk menentukan ekstensi
+            image: Gambar hasil ingest, dipakai untuk membuat varian tanpa decode ulang
+        Returns:
+            tuple: (hash, path file di store)
+        """
+        image_hash = self.compute_hash(data)
+        path = self.blob_path(image_hash, self.normalize_extension(filename))
+
+        with self._lock:
+            conn = self.db_manager._connect()
+            try:
+                with conn:
+                    conn.execute('''
+                        INSERT INTO image_blobs (hash, filepath, size, refcount)
+                        VALUES (?, ?, ?, 1)
+                        ON CONFLICT(hash) DO UPDATE SET refcount = refcount + 1
+                    ''', (image_hash, path, len(data)))
+                    # Blob yang sudah ada tetap memakai path lamanya
+                    path = conn.execute('SELECT filepath FROM image_blobs WHERE hash = ?',
+                                        (image_hash,)).fetchone()[0]
+            finally:
+                conn.close()
+
+            if not os.path.exists(path):
+                self._write_atomic(path, data)
+
+        # Varian tampilan dibuat sekali saat gambar disimpan
+        if not os.path.exists(variant_path(path, "preview")):
+            try:
+                generate_variants(path, image=image)
+            except Exception as e:
+                print(f"Error membuat varian tampilan: {e}")
+
+        return image_hash, path
+
+    def release(self, image_hash):
+        """Lepas satu referensi yang diambil put() tanpa record history"""
+        conn = self.db_manager._connect()
+        try:
+            with conn:
+                unused = self.release_references(conn.cursor(), [image_hash])
+        finally:
+            conn.close()
+        self.db_manager.remove_files(unused)
+
+    @staticmethod
+    def release_references(cursor, image_hashes):
+        """
+        Kurangi refcount di dalam transaksi yang sedang berjalan
+        Returns: list path blob yang refcount-nya habis
+        """
+        if not image_hashes:
+            return []
+
+        cursor.executemany('UPDATE image_blobs SET refcount = refcount - 1 WHERE hash = ?',
+                           [(image_hash,) for image_hash in image_hashes])
+
+        unique_hashes = list(set(image_hashes))
+        placeholders = ','.join('?' * len(unique_hashes))
+        cursor.execute(f'''
+            SELECT hash, filepath FROM image_blobs
+            WHERE hash IN ({placeholders}) AND refcount <= 0
+        ''', unique_hashes)
+        unused = cursor.fetchall()
+
+        if unused:
+            cursor.executemany('DELETE FROM image_blobs WHERE hash = ?', [(row[0],) for row in unused])
+        return [row[1] for row in unused]
+
+    def remove_if_unreferenced(self, filepath):
+        """
+        Hapus file blob hanya jika hash-nya tidak terdaftar lagi
+        (bisa saja upload baru dengan isi sama mendaftarkannya kembali)
+        Returns: jumlah byte yang dibebaskan
+        """
+        image_hash = os.path.splitext(os.path.basename(filepath))[0]
+        with self._lock:
+            conn = self.db_manager._connect()
+            try:
+                row = conn.execute('SELECT 1 FROM image_blobs WHERE hash = ?', (image_hash,)).fetchone()
+            finally:
+                conn.close()
+            if row:
+                return 0
+
+            reclaimed = remove_variants(filepath)
+            try:
+                size = os.path.getsize(filepath)
+                os.remove(filepath)
+                return reclaimed + size
+            except FileNotFoundError:
+                return reclaimed
@@ -0,0 +1,369 @@
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import signal
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+from ingest import ingest_upload, InvalidImage, WORKING_MAX_SIDE, MAX_UPLOAD_BYTES, MAX_IMAGE_PIXELS
+
+# ----------------------------------------------------------------------
+# Protokol: setiap pesan = header tetap + metadata JSON + payload biner.
+# Header: magic (4 byte), tipe pesan (1 byte), panjang JSON, panjang payload
+# (uint32 big-endian). Piksel gambar dikirim apa adanya sebagai payload,
+# tanpa base64 atau encode ulang.
+# Jika worker memakai shared secret (INFERENCE_SECRET), setiap koneksi diawali
+# CHALLENGE berisi nonce acak dari worker; client membalas AUTH berisi
+# HMAC-SHA256(secret, nonce) sebelum permintaan pertama.
+# ----------------------------------------------------------------------
+
+FRAME_MAGIC = b"SKD1"
+FRAME_HEADER = struct.Struct("!4sBII")
+
+MSG_DETECT = 1
+MSG_HEALTH = 2
+MSG_RESULT = 3
+MSG_ERROR = 4
+MSG_CHALLENGE = 5
+MSG_AUTH = 6
+
+# Batas waktu client menjawab challenge (detik)
+HANDSHAKE_TIMEOUT = 10.0
+LOOPBACK_HOSTS = ("127.0.0.1", "::1", "localhost")
+
+MAX_META_BYTES = 1024 * 1024
+# Payload terbesar: gambar mentah RGB pada batas piksel ingest
+MAX_PAYLOAD_BYTES = max(MAX_UPLOAD_BYTES, MAX_IMAGE_PIXELS * 3)
+
+
+class ProtocolError(Exception):
+    """Frame rusak atau melebihi batas"""
+
+
+def parse_address(address):
+    """
+    Alamat worker: "tcp://host:port" atau "unix:///path/ke/socket"
+    Returns: tuple (family, alamat socket)
+    """
+    if address.startswith("unix://"):
+        return socket.AF_UNIX, address[len("unix://"):]
+    if address.startswith("tcp://"):
+        address = address[len("tcp://"):]
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Alamat worker tidak valid: {address}")
+    return socket.AF_INET, (host.strip("[]"), int(port))
+
+
+def _auth_mac(secret, nonce):
+    return hmac.new(secret.encode("utf-8"), bytes.fromhex(nonce), hashlib.sha256).hexdigest()
+
+
+def connect(address, timeout=3.0, secret=None):
+    """
+    Buka koneksi ke worker
+    Args:
+        secret: Shared secret worker; jika diisi, challenge dari worker dijawab
+                sebelum koneksi dikembalikan
+    """
+    family, target = parse_address(address)
+    if family == socket.AF_UNIX:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(target)
+        except OSError:
+            sock.close()
+            raise
+    else:
+        sock = socket.create_connection(target, timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    if secret:
+        try:
+            frame = recv_frame(sock)
+            if frame is None or frame[0] != MSG_CHALLENGE:
+                raise ProtocolError("Worker tidak mengirim challenge autentikasi")
+            send_frame(sock, MSG_AUTH, {"mac": _auth_mac(secret, frame[1]["nonce"])})
+            frame = recv_frame(sock)
+            if frame is None or frame[0] != MSG_RESULT:
+                raise ProtocolError("Autentikasi ke worker ditolak")
+        except BaseException:
+            sock.close()
+            raise
+    return sock
+
+
+def send_frame(sock, msg_type, meta, payload=b""):
+    """
+    Kirim satu frame. payload boleh berupa objek buffer apa pun (bytes,
+    memoryview, array NumPy kontigu) dan dikirim tanpa disalin.
+    """
+    meta_bytes = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+    payload = memoryview(payload).cast("B")
+    sock.sendall(FRAME_HEADER.pack(FRAME_MAGIC, msg_type, len(meta_bytes), payload.nbytes) + meta_bytes)
+    if payload.nbytes:
+        sock.sendall(payload)
+
+
+def _recv_into(sock, buffer):
+    view = memoryview(buffer)
+    while view.nbytes:
+        received = sock.recv_into(view)
+        if received == 0:
+            raise ConnectionError("Koneksi ditutup di tengah frame")
+        view = view[received:]
+
+
+def recv_frame(sock):
+    """
+    Terima satu frame
+    Returns:
+        tuple (tipe pesan, metadata dict, payload bytearray), atau None jika
+        koneksi ditutup rapi sebelum frame berikutnya
+    """
+    header = bytearray(FRAME_HEADER.size)
+    first = sock.recv_into(header)
+    if first == 0:
+        return None
+    if first < len(header):
+        _recv_into(sock, memoryview(header)[first:])
+
+    magic, msg_type, meta_length, payload_length = FRAME_HEADER.unpack(header)
+    if magic != FRAME_MAGIC:
+        raise ProtocolError("Magic frame tidak dikenal")
+    if meta_length > MAX_META_BYTES or payload_length > MAX_PAYLOAD_BYTES:
+        raise ProtocolError("Frame melebihi batas ukuran")
+
+    meta = bytearray(meta_length)
+    _recv_into(sock, meta)
+    payload = bytearray(payload_length)
+    _recv_into(sock, payload)
+    return msg_type, json.loads(meta) if meta_length else {}, payload
+
+
+# ----------------------------------------------------------------------
+# Worker
+# ----------------------------------------------------------------------
+
+class InferenceWorker:
+    """
+    Daemon inferensi: memuat SkinCancerDetector sekali lalu melayani
+    permintaan DETECT dan HEALTH dari banyak front-end lewat TCP atau Unix
+    socket. Setiap koneksi dilayani thread sendiri dan boleh dipakai ulang
+    untuk banyak permintaan (pooling di sisi client); inferensi dibatasi
+    `concurrency` sekaligus dan permintaan di atas `max_pending` ditolak
+    sebagai "busy" sehingga client langsung pindah ke worker lain.
+    """
+
+    def __init__(self, model_path="best.pt", concurrency=1, max_pending=8, name=None):
+        from detection import SkinCancerDetector
+
+        self.detector = SkinCancerDetector(model_path)
+        if self.detector.model is None:
+            raise RuntimeError(f"Model tidak dapat dimuat: {model_path}")
+        self.concurrency = concurrency
+        self.max_pending = max_pending
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}"
+
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self._served = 0
+        self._errors = 0
+        self._started = time.time()
+
+    def status(self):
+        with self._lock:
+            return {
+                "status": "ok",
+                "worker": self.name,
+                "model_version": self.detector.model_version,
+                "inflight": self._inflight,
+                "concurrency": self.concurrency,
+                "served": self._served,
+                "errors": self._errors,
+                "uptime_seconds": round(time.time() - self._started, 1),
+            }
+
+    def _decode(self, meta, payload):
+        """
+        Payload "raw": piksel RGB uint8 dengan shape di metadata (dipakai langsung
+        sebagai buffer inferensi). Payload "encoded": bytes file gambar, divalidasi
+        dan di-decode lewat ingest ke resolusi kerja.
+        Returns: tuple (gambar, skala terhadap gambar asli)
+        """
+        scale = float(meta.get("image_scale", 1.0))
+        if meta.get("encoding") == "raw":
+            height, width, channels = meta["shape"]
+            if channels != 3 or height * width > MAX_IMAGE_PIXELS or len(payload) != height * width * 3:
+                raise InvalidImage("Ukuran payload gambar tidak sesuai")
+            # bytearray bisa ditulis, jadi array ini boleh diubah di tempat oleh detector
+            return np.frombuffer(payload, dtype=np.uint8).reshape(height, width, 3), scale
+        ingested = ingest_upload(bytes(payload), max_side=WORKING_MAX_SIDE)
+        return ingested.image, scale * ingested.scale
+
+    def handle_detect(self, meta, payload):
+        with self._lock:
+            if self._inflight >= self.concurrency + self.max_pending:
+                return MSG_ERROR, {"error": "Worker sedang sibuk", "retryable": True, "inflight": self._inflight}
+            self._inflight += 1
+        try:
+            image, scale = self._decode(meta, payload)
+            start = time.perf_counter()
+            with self._slots:
+                _, predictions = self.detector.detect_raw(None, image=image, image_scale=scale)
+            with self._lock:
+                self._served += 1
+                inflight = self._inflight - 1
+            return MSG_RESULT, {
+                "predictions": predictions,
+                "model_version": self.detector.model_version,
+                "inference_ms": round((time.perf_counter() - start) * 1000, 1),
+                "worker": self.name,
+                "inflight": inflight,
+            }
+        except Exception as e:
+            if not isinstance(e, InvalidImage):
+                print(f"Error saat inferensi: {e}")
+            with self._lock:
+                self._errors += 1
+            # Hanya gangguan sementara (memori, I/O) yang dicoba di worker lain; error
+            # lain berasal dari permintaannya sendiri dan akan gagal di semua worker
+            return MSG_ERROR, {"error": str(e), "retryable": isinstance(e, (MemoryError, OSError))}
+        finally:
+            with self._lock:
+                self._inflight -= 1
+
+    def handle(self, msg_type, meta, payload):
+        if msg_type == MSG_DETECT:
+            return self.handle_detect(meta, payload)
+        if msg_type == MSG_HEALTH:
+            return MSG_RESULT, self.status()
+        return MSG_ERROR, {"error": f"Tipe pesan tidak dikenal: {msg_type}", "retryable": False}
+
+
+class _ConnectionHandler(socketserver.BaseRequestHandler):
+    def authenticate(self, sock, secret):
+        """Challenge-response HMAC; Returns: True jika client mengetahui secret"""
+        nonce = secrets.token_hex(16)
+        sock.settimeout(HANDSHAKE_TIMEOUT)
+        try:
+            # Client tanpa secret membaca challenge sebagai error yang tidak dicoba ulang
+            send_frame(sock, MSG_CHALLENGE, {"nonce": nonce, "retryable": False,
+                                             "error": "Worker membutuhkan autentikasi (INFERENCE_SECRET)"})
+            frame = recv_frame(sock)
+            if (frame is None or frame[0] != MSG_AUTH
+                    or not hmac.compare_digest(str(frame[1].get("mac", "")), _auth_mac(secret, nonce))):
+                send_frame(sock, MSG_ERROR, {"error": "Autentikasi gagal", "retryable": False})
+                return False
+            send_frame(sock, MSG_RESULT, {})
+            return True
+        except (ConnectionError, ProtocolError, OSError, ValueError):
+            return False
+        finally:
+            sock.settimeout(None)
+
+    def handle(self):
+        worker = self.server.worker
+        sock = self.request
+        if sock.family != socket.AF_UNIX:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.server.secret and not self.authenticate(sock, self.server.secret):
+            return
+        while True:
+            try:
+                frame = recv_frame(sock)
+            except (ConnectionError, ProtocolError, OSError):
+                break
+            if frame is None:
+                break
+            msg_type, meta, payload = frame
+            reply_type, reply = worker.handle(msg_type, meta, payload)
+            del payload
+            try:
+                send_frame(sock, reply_type, reply)
+            except OSError:
+                break
+
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+    class _ThreadingUnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+else:
+    _ThreadingUnixServer = None
+
+
+def serve(address, worker, secret=None):
+    """
+    Jalankan server worker sampai SIGTERM/SIGINT.
+    Protokol tidak terenkripsi: tanpa secret worker hanya boleh mendengarkan di
+    loopback atau Unix socket; untuk alamat jaringan lain secret wajib dan
+    jaringannya tetap harus privat (gambar pasien dikirim apa adanya).
+    Args:
+        address: "tcp://host:port" atau "unix:///path"
+        worker: InferenceWorker
+        secret: Shared secret untuk autentikasi client (INFERENCE_SECRET)
+    """
+    family, target = parse_address(address)
+    if family != socket.AF_UNIX and target[0] not in LOOPBACK_HOSTS and not secret:
+        raise RuntimeError(f"Menolak mendengarkan di {address} tanpa autentikasi: "
+                           f"set INFERENCE_SECRET atau gunakan 127.0.0.1 / unix://")
+    if family == socket.AF_UNIX:
+        if _ThreadingUnixServer is None:
+            raise RuntimeError("Unix socket tidak didukung di platform ini")
+        if os.path.exists(target):
+            os.remove(target)
+        server = _ThreadingUnixServer(target, _ConnectionHandler)
+    else:
+        server = _ThreadingTCPServer(target, _ConnectionHandler)
+    server.worker = worker
+    server.secret = secret
+
+    def stop(signum, frame):
+        # shutdown() menunggu serve_forever selesai, jadi dipanggil dari thread lain
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"Worker inferensi {worker.name} siap di {address} (model {worker.detector.model_version})")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if family == socket.AF_UNIX and os.path.exists(target):
+            os.remove(target)
+        print(f"Worker inferensi {worker.name} berhenti")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Daemon worker inferensi deteksi kanker kulit")
+    parser.add_argument("--listen", default="tcp://127.0.0.1:7601",
+                        help="Alamat, contoh unix:///run/skd.sock atau tcp://127.0.0.1:7601; alamat "
+                             "jaringan lain (tcp://10.0.0.5:7601) butuh INFERENCE_SECRET")
+    parser.add_argument("--model", default="best.pt", help="Path model YOLO")
+    parser.add_argument("--concurrency", type=int, default=1, help="Inferensi bersamaan")
+    parser.add_argument("--max-pending", type=int, default=8, help="Permintaan menunggu sebelum ditolak")
+    parser.add_argument("--torch-threads", type=int, default=None, help="Thread torch per inferensi")
+    args = parser.parse_args()
+
+    if args.torch_threads:
+        from admission import pin_inference_threads
+        pin_inference_threads(args.torch_threads)
+
+    serve(args.listen, InferenceWorker(args.model, concurrency=args.concurrency,
+                                       max_pending=args.max_pending),
+          secret=os.environ.get("INFERENCE_SECRET"))
@@ -0,0 +1,181 @@
+import argparse
+import functools
+import hashlib
+import io
+import os
+import time
+
+from PIL import Image, ImageOps
+
+# Batas upload, dicek sebelum gambar di-decode
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024  # 10MB
+MAX_IMAGE_PIXELS = 40_000_000  # kira-kira 7300x5500
+# Sisi terpanjang gambar kerja (tampilan, deteksi, anotasi). Bytes asli tetap
+# disimpan utuh; hanya salinan di memori yang dibatasi resolusinya.
+WORKING_MAX_SIDE = 1280
+
+# Magic bytes -> (format PIL, ekstensi baku)
+MAGIC_SIGNATURES = (
+    (b"\xff\xd8\xff", ("JPEG", ".jpg")),
+    (b"\x89PNG\r\n\x1a\n", ("PNG", ".png")),
+    (b"BM", ("BMP", ".bmp")),
+    (b"II*\x00", ("TIFF", ".tiff")),
+    (b"MM\x00*", ("TIFF", ".tiff")),
+)
+
+
+class InvalidImage(Exception):
+    """Upload ditolak saat ingest (format, ukuran atau isi tidak valid)"""
+
+
+def sniff_format(data):
+    """
+    Tentukan format gambar dari magic bytes, bukan dari nama file
+    Returns: tuple (format PIL, ekstensi) atau None jika tidak dikenal
+    """
+    for signature, result in MAGIC_SIGNATURES:
+        if data.startswith(signature):
+            return result
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return ("WEBP", ".webp")
+    return None
+
+
+class IngestedImage:
+    """
+    Hasil ingest satu upload: bytes asli beserta satu gambar RGB yang sudah
+    di-decode. Objek ini dipakai bersama untuk tampilan, penyimpanan dan
+    deteksi sehingga upload hanya di-decode sekali.
+    Jika gambar di-decode ke resolusi kerja yang lebih kecil, scale adalah
+    perbandingan ukuran gambar kerja terhadap gambar asli.
+    """
+
+    def __init__(self, data, filename, image_format, extension, image, scale=1.0):
+        self.data = data
+        self.image_format = image_format
+        self.extension = extension
+        self.image = image
+        self.scale = scale
+        # Ekstensi nama file disesuaikan dengan format sebenarnya
+        self.filename = os.path.splitext(os.path.basename(filename or "upload"))[0] + extension
+
+    @functools.cached_property
+    def content_hash(self):
+        """SHA-256 isi file, sama dengan hash yang dipakai ImageStore"""
+        return hashlib.sha256(self.data).hexdigest()
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    @property
+    def width(self):
+        return self.image.width
+
+    @property
+    def height(self):
+        return self.image.height
+
+
+def ingest_upload(data, filename="", max_bytes=MAX_UPLOAD_BYTES, max_pixels=MAX_IMAGE_PIXELS,
+                  max_side=None):
+    """
+    Validasi dan decode upload tepat satu kali.
+    Ukuran file dan format (magic bytes) dicek lebih dulu, lalu dimensi dibaca
+    dari header; hanya gambar yang lolos semua batas yang di-decode.
+    Args:
+        data: Isi file upload (bytes)
+        filename: Nama file asli
+        max_bytes: Ukuran file maksimal
+        max_pixels: Jumlah piksel maksimal (lebar x tinggi)
+        max_side: Sisi terpanjang gambar hasil decode (None = resolusi penuh).
+                  JPEG langsung di-decode pada skala 1/2, 1/4 atau 1/8 (draft
+                  mode) sehingga buffer resolusi penuh tidak pernah dibuat.
+    Returns:
+        IngestedImage
+    Raises:
+        InvalidImage: jika upload ditolak
+    """
+    if not data:
+        raise InvalidImage("Tidak ada file yang diupload")
+    if len(data) > max_bytes:
+        raise InvalidImage(f"Ukuran file terlalu besar. Maksimal {max_bytes // (1024 * 1024)}MB")
+
+    sniffed = sniff_format(data)
+    if sniffed is None:
+        raise InvalidImage("Format file tidak didukung. Gunakan: jpg, png, bmp, tiff, webp")
+    image_format, extension = sniffed
+
+    try:
+        # Image.open hanya membaca header, belum decode piksel
+        image = Image.open(io.BytesIO(data), formats=[image_format])
+        width, height = image.size
+        if width * height > max_pixels:
+            raise InvalidImage(f"Resolusi gambar terlalu besar ({width}x{height})")
+
+        if max_side is not None and max(width, height) > max_side:
+            image.draft("RGB", (max_side, max_side))
+        image.load()
+        # in_place menghindari salinan penuh untuk gambar tanpa tag orientasi
+        ImageOps.exif_transpose(image, in_place=True)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        if max_side is not None and max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    except InvalidImage:
+        raise
+    except Exception:
+        raise InvalidImage("File bukan gambar yang valid")
+
+    # Rotasi EXIF tidak mengubah sisi terpanjang, jadi skala cukup dari sisi itu
+    scale = max(image.size) / max(width, height)
+    return IngestedImage(data, filename, image_format, extension, image, scale=scale)
+
+
+def benchmark_ingest(image_path, repeat=10):
+    """
+    Bandingkan waktu CPU per upload: alur lama (verify, decode untuk tampilan,
+    cv2.imread dua kali di detect) vs satu kali ingest yang dipakai bersama
+    """
+    import cv2
+    import numpy as np
+
+    with open(image_path, "rb") as f:
+        data = f.read()
+
+    def legacy():
+        image = Image.open(io.BytesIO(data))
+        image.verify()
+        Image.open(io.BytesIO(data)).convert("RGB")  # st.image pada upload
+        buffer = np.frombuffer(data, np.uint8)
+        image_bgr = cv2.imdecode(buffer, cv2.IMREAD_COLOR)  # cv2.imread di detect
+        cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+        cv2.imdecode(buffer, cv2.IMREAD_COLOR)  # model(image_path) membaca file lagi
+
+    def shared():
+        ingested = ingest_upload(data, os.path.basename(image_path))
+        image_rgb = np.asarray(ingested.image)
+        cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR)  # input model
+
+    results = {}
+    for name, fn in (("lama", legacy), ("ingest", shared)):
+        fn()
+        start = time.process_time()
+        for _ in range(repeat):
+            fn()
+        results[name] = (time.process_time() - start) / repeat * 1000
+
+    print(f"Alur lama : {results['lama']:.1f} ms CPU per upload")
+    print(f"Ingest    : {results['ingest']:.1f} ms CPU per upload")
+    print(f"Hemat     : {results['lama'] - results['ingest']:.1f} ms "
+          f"({(1 - results['ingest'] / results['lama']) * 100:.0f}%)")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark CPU ingest upload gambar")
+    parser.add_argument("image", help="Path gambar contoh")
+    parser.add_argument("--repeat", type=int, default=10, help="Jumlah pengulangan")
+    args = parser.parse_args()
+
+    benchmark_ingest(args.image, args.repeat)
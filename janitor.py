@@ -0,0 +1,281 @@
+import argparse
+import datetime
+import os
+import threading
+import time
+
+from image_store import variant_source
+from retention import init_checkpoint_table
+from utils import format_file_size
+
+# Kebijakan per direktori: umur maksimal file yatim (jam, None = tanpa batas umur)
+# dan anggaran ukuran total direktori (byte)
+DEFAULT_POLICIES = {
+    "temp": {"max_age_hours": 24, "max_bytes": 512 * 1024 * 1024},
+    "uploads": {"max_age_hours": 24 * 7, "max_bytes": 1024 * 1024 * 1024},
+    "history_images": {"max_age_hours": None, "max_bytes": 5 * 1024 * 1024 * 1024},
+}
+
+
+class DiskJanitor:
+    """
+    Pembersih disk di background untuk direktori gambar dan file sementara.
+    Setiap direktori dipindai dengan os.scandir (satu stat per file), lalu:
+    1. file yatim yang melewati umur maksimal dihapus;
+    2. jika ukuran direktori masih di atas anggaran, file yatim dihapus
+       mulai dari yang paling lama tidak dipakai (LRU), baru kemudian varian
+       tampilan (bisa dibuat ulang oleh get_variant).
+    File yang masih dirujuk record history tidak pernah dihapus, dan file yang
+    lebih muda dari masa tenggang dilewati karena mungkin sedang ditulis.
+    Jumlah byte yang dibebaskan disimpan di maintenance_checkpoints.
+    """
+
+    JOB_NAME = "janitor"
+
+    def __init__(self, db_manager, policies=None, grace_minutes=10, interval_minutes=15):
+        """
+        Args:
+            db_manager: DatabaseManager untuk cek referensi file
+            policies: Kebijakan per direktori, default DEFAULT_POLICIES
+            grace_minutes: File lebih muda dari ini tidak pernah dihapus
+            interval_minutes: Jarak antar eksekusi saat berjalan di background
+        """
+        self.db_manager = db_manager
+        self.policies = policies or DEFAULT_POLICIES
+        self.grace_minutes = grace_minutes
+        self.interval_minutes = interval_minutes
+
+        # Statistik proses ini, per direktori
+        self.stats = {
+            directory: {"files_removed": 0, "bytes_reclaimed": 0, "bytes_used": 0, "over_budget": False}
+            for directory in self.policies
+        }
+        self._stats_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._run_lock = threading.Lock()
+        init_checkpoint_table(db_manager)
+
+    # ------------------------------------------------------------------
+    # Pemindaian
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _scan(directory):
+        """
+        Pindai direktori secara rekursif
+        Returns: list tuple (path, ukuran, waktu terakhir dipakai)
+        """
+        files = []
+        stack = [directory] if os.path.isdir(directory) else []
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        try:
+                            stat = entry.stat(follow_symlinks=False)
+                        except FileNotFoundError:
+                            continue
+                        # atime bisa tidak diperbarui (noatime/relatime), mtime sebagai batas bawah
+                        files.append((entry.path, stat.st_size, max(stat.st_atime, stat.st_mtime)))
+        return files
+
+    def _remove(self, path, is_variant):
+        """Hapus satu file, returns: byte yang dibebaskan"""
+        if is_variant:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                return size
+            except FileNotFoundError:
+                return 0
+        # Blob di image store dicek ulang ke image_blobs sebelum dihapus
+        return self.db_manager.remove_files([path])
+
+    def clean_directory(self, directory, policy, referenced):
+        """
+        Terapkan kebijakan umur dan anggaran pada satu direktori
+        Returns:
+            dict: files_removed, bytes_reclaimed, bytes_used, over_budget
+        """
+        now = time.time()
+        grace_cutoff = now - self.grace_minutes * 60
+        max_age_hours = policy.get("max_age_hours")
+        age_cutoff = now - max_age_hours * 3600 if max_age_hours is not None else None
+
+        files = self._scan(directory)
+        bytes_used = sum(size for _, size, _ in files)
+        orphans = []
+        variants = []
+        for path, size, last_used in files:
+            normalized = os.path.normpath(path)
+            if normalized in referenced or last_used >= grace_cutoff:
+                continue
+            source = variant_source(path)
+            if source is None:
+                orphans.append((last_used, path, size))
+            elif os.path.normpath(source) in referenced:
+                variants.append((last_used, path, size))
+            else:
+                # Varian milik gambar yang sudah tidak dirujuk ikut dianggap yatim
+                orphans.append((last_used, path, size))
+
+        files_removed = 0
+        bytes_reclaimed = 0
+
+        def evict(path, is_variant):
+            nonlocal files_removed, bytes_reclaimed, bytes_used
+            freed = self._remove(path, is_variant)
+            if freed:
+                files_removed += 1
+                bytes_reclaimed += freed
+                bytes_used -= freed
+
+        # 1. Batas umur (hanya file yatim)
+        orphans.sort()
+        remaining = []
+        for last_used, path, size in orphans:
+            if age_cutoff is not None and last_used < age_cutoff:
+                evict(path, False)
+            else:
+                remaining.append((last_used, path, size))
+
+        # 2. Anggaran ukuran: LRU file yatim dulu, lalu varian yang bisa dibuat ulang
+        max_bytes = policy.get("max_bytes")
+        if max_bytes is not None:
+            variants.sort()
+            for candidates, is_variant in ((remaining, False), (variants, True)):
+                for _, path, _ in candidates:
+                    if bytes_used <= max_bytes or self._stop_event.is_set():
+                        break
+                    evict(path, is_variant)
+
+        over_budget = max_bytes is not None and bytes_used > max_bytes
+        if over_budget:
+            print(f"Peringatan: {directory} masih {format_file_size(bytes_used)} "
+                  f"(anggaran {format_file_size(max_bytes)}), sisanya file yang masih dirujuk")
+
+        return {
+            "files_removed": files_removed,
+            "bytes_reclaimed": bytes_reclaimed,
+            "bytes_used": bytes_used,
+            "over_budget": over_budget,
+        }
+
+    def run_once(self):
+        """
+        Jalankan satu putaran pembersihan semua direktori
+        Returns:
+            dict: Ringkasan per direktori untuk putaran ini
+        """
+        with self._run_lock:
+            # Record di antrian write-behind harus sudah tersimpan sebelum cek referensi
+            if getattr(self.db_manager, "history_writer", None) is not None:
+                self.db_manager.history_writer.flush()
+            referenced = self.db_manager.referenced_image_paths()
+
+            summary = {}
+            for directory, policy in self.policies.items():
+                if self._stop_event.is_set():
+                    break
+                result = self.clean_directory(directory, policy, referenced)
+                summary[directory] = result
+                with self._stats_lock:
+                    stats = self.stats[directory]
+                    stats["files_removed"] += result["files_removed"]
+                    stats["bytes_reclaimed"] += result["bytes_reclaimed"]
+                    stats["bytes_used"] = result["bytes_used"]
+                    stats["over_budget"] = result["over_budget"]
+
+            files_removed = sum(result["files_removed"] for result in summary.values())
+            bytes_reclaimed = sum(result["bytes_reclaimed"] for result in summary.values())
+            self._record(files_removed, bytes_reclaimed)
+            if files_removed:
+                print(f"Janitor: {files_removed} file dihapus, {format_file_size(bytes_reclaimed)} dibebaskan")
+            return summary
+
+    def _record(self, files_removed, bytes_reclaimed):
+        """Akumulasi total byte yang dibebaskan di maintenance_checkpoints"""
+        conn = self.db_manager._connect()
+        try:
+            with conn:
+                conn.execute('''
+                    INSERT INTO maintenance_checkpoints
+                        (job, phase, cutoff, files_removed, bytes_reclaimed, updated_at)
+                    VALUES (?, 'done', ?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(job) DO UPDATE SET
+                        cutoff = excluded.cutoff,
+                        files_removed = files_removed + excluded.files_removed,
+                        bytes_reclaimed = bytes_reclaimed + excluded.bytes_reclaimed,
+                        updated_at = CURRENT_TIMESTAMP
+                ''', (self.JOB_NAME, datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+                      files_removed, bytes_reclaimed))
+        finally:
+            conn.close()
+
+    def get_stats(self):
+        """
+        Statistik janitor: total sepanjang waktu (dari database) dan per direktori
+        (sejak proses ini berjalan)
+        """
+        conn = self.db_manager._connect()
+        try:
+            row = conn.execute('''
+                SELECT files_removed, bytes_reclaimed, updated_at
+                FROM maintenance_checkpoints WHERE job = ?
+            ''', (self.JOB_NAME,)).fetchone()
+        finally:
+            conn.close()
+
+        with self._stats_lock:
+            directories = {directory: dict(stats) for directory, stats in self.stats.items()}
+        return {
+            "files_removed": row[0] if row else 0,
+            "bytes_reclaimed": row[1] if row else 0,
+            "last_run": row[2] if row else None,
+            "directories": directories,
+        }
+
+    # ------------------------------------------------------------------
+    # Background
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """Jalankan janitor secara periodik di thread background"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="disk-janitor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30.0):
+        """Hentikan janitor setelah file yang sedang diproses selesai"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error saat menjalankan janitor: {e}")
+            self._stop_event.wait(self.interval_minutes * 60)
+
+
+if __name__ == "__main__":
+    from sharding import open_database
+
+    parser = argparse.ArgumentParser(description="Bersihkan direktori gambar sesuai umur dan kuota disk")
+    parser.add_argument("--db", default="skin_cancer_app.db", help="Path database SQLite")
+    parser.add_argument("--grace-minutes", type=int, default=10, help="File lebih muda dari ini dilewati")
+    args = parser.parse_args()
+
+    db_manager = open_database(args.db, write_behind=False)
+    janitor = DiskJanitor(db_manager, grace_minutes=args.grace_minutes)
+    for directory, result in janitor.run_once().items():
+        print(f"{directory}: {result['files_removed']} file dihapus, "
+              f"{format_file_size(result['bytes_reclaimed'])} dibebaskan, "
+              f"terpakai {format_file_size(result['bytes_used'])}")
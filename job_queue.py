@@ -0,0 +1,684 @@
+import argparse
+import json
+import os
+import signal
+import socket
+import threading
+import time
+import uuid
+
+from ingest import ingest_upload, InvalidImage, WORKING_MAX_SIDE
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+ACTIVE_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+
+# Jumlah foto lama yang dicari dan similarity minimal untuk ditampilkan. Embedding
+# lesion_index berupa statistik warna/bentuk buatan tangan: skornya menumpuk di dekat 1
+# (lesi yang jelas berbeda bisa mendapat 0.91-0.97) dan belum dikalibrasi pada pasangan
+# lesi sama/berbeda, jadi batas ini hanya menyaring yang sangat tidak mirip. Hasilnya
+# ditampilkan sebagai urutan foto yang tampak serupa, bukan sebagai lesi yang sama
+SIMILAR_LESION_COUNT = 3
+SIMILAR_LESION_MIN_SIMILARITY = 0.9
+
+JOB_COLUMNS = ('id', 'username', 'filename', 'filepath', 'image_hash', 'status', 'stage', 'progress',
+               'attempts', 'max_attempts', 'error', 'history_id', 'result', 'created_at',
+               'started_at', 'finished_at')
+
+
+def init_job_table(db_manager):
+    """Tabel detection_jobs: antrian deteksi yang bertahan walau proses restart"""
+    conn = db_manager._connect()
+    try:
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS detection_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    username TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    filepath TEXT NOT NULL,
+                    image_hash TEXT,
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    stage TEXT,
+                    progress REAL NOT NULL DEFAULT 0,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL DEFAULT 3,
+                    available_at REAL NOT NULL,
+                    worker TEXT,
+                    lease_until REAL,
+                    error TEXT,
+                    history_id INTEGER,
+                    result TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_jobs_status
+                ON detection_jobs (status, available_at, id)
+            ''')
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_jobs_user
+                ON detection_jobs (username, id)
+            ''')
+    finally:
+        conn.close()
+
+
+class DetectionJobQueue:
+    """
+    Antrian job deteksi di SQLite (tabel detection_jobs).
+    Job diambil worker secara atomik (BEGIN IMMEDIATE) dengan lease: worker
+    memperpanjang lease selama bekerja, dan job yang lease-nya habis (worker
+    crash atau proses dimatikan) diambil ulang oleh worker lain. Job yang gagal
+    dicoba lagi dengan jeda bertambah sampai max_attempts, lalu ditandai gagal.
+    Hasil ditulis ke detection_history di transaksi yang sama dengan
+    penyelesaian job, sehingga crash tidak menghasilkan riwayat ganda;
+    transaksi itu berjalan di group commit HistoryWriter jika write-behind aktif.
+    Tahap/progress job disimpan di memori dan baru ditulis ke database saat
+    lease diperpanjang, jadi satu deteksi hanya butuh submit, claim dan commit.
+    Job memegang satu referensi gambar di ImageStore yang diambil alih oleh
+    record history saat job selesai.
+    """
+
+    def __init__(self, db_manager, max_attempts=3, lease_seconds=60.0, retry_delay=5.0,
+                 max_retry_delay=300.0):
+        """
+        Args:
+            db_manager: DatabaseManager pemilik detection_history
+            max_attempts: Jumlah percobaan maksimal per job
+            lease_seconds: Lama lease sebelum job dianggap ditinggal worker-nya
+            retry_delay: Jeda awal sebelum job gagal dicoba lagi (detik, berlipat tiap percobaan)
+            max_retry_delay: Jeda maksimal antar percobaan (detik)
+        """
+        self.db_manager = db_manager
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        # Membangunkan worker di proses yang sama begitu ada job baru
+        self._wakeup = threading.Event()
+        # job_id -> (stage, progress) job yang berjalan di proses ini
+        self._progress = {}
+        self._progress_lock = threading.Lock()
+        init_job_table(db_manager)
+
+    def _row_to_job(self, row):
+        job = dict(zip(JOB_COLUMNS, row))
+        job["result"] = json.loads(job["result"]) if job["result"] else {}
+        # Progress terbaru dari worker di proses ini belum tentu sudah ditulis
+        if job["status"] == JOB_RUNNING:
+            with self._progress_lock:
+                reported = self._progress.get(job["id"])
+            if reported is not None:
+                job["stage"], job["progress"] = reported
+        return job
+
+    def report_progress(self, job_id, stage, progress):
+        """Catat tahap/progress job di memori; ditulis ke database oleh heartbeat berikutnya"""
+        with self._progress_lock:
+            self._progress[job_id] = (stage, progress)
+
+    def _forget_progress(self, job_id):
+        with self._progress_lock:
+            self._progress.pop(job_id, None)
+
+    def submit(self, username, filename, filepath, image_hash=None):
+        """
+        Masukkan job baru ke antrian
+        Args:
+            filepath: Path gambar yang sudah disimpan (ImageStore.put)
+            image_hash: Hash blob, referensinya diambil alih job ini
+        Returns: id job
+        """
+        conn = self.db_manager._connect()
+        try:
+            with conn:
+                cursor = conn.execute('''
+                    INSERT INTO detection_jobs (username, filename, filepath, image_hash, status, stage,
+                                                max_attempts, available_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (username, filename, filepath, image_hash, JOB_QUEUED, "Menunggu worker",
+                      self.max_attempts, time.time()))
+                job_id = cursor.lastrowid
+        finally:
+            conn.close()
+        self._wakeup.set()
+        return job_id
+
+    def wait(self, timeout):
+        """Tunggu job baru (dari proses ini) atau sampai timeout"""
+        woken = self._wakeup.wait(timeout)
+        self._wakeup.clear()
+        return woken
+
+    def claim(self, worker_id):
+        """
+        Ambil satu job secara atomik: job antrian yang sudah boleh dijalankan,
+        atau job berjalan yang lease-nya habis (worker sebelumnya mati).
+        Job dengan lease habis yang percobaannya sudah habis ditandai gagal.
+        Returns: dict job atau None jika antrian kosong
+        """
+        now = time.time()
+        claimable = '(status = ? AND available_at <= ?) OR (status = ? AND lease_until < ?)'
+        conn = self.db_manager._connect()
+        try:
+            # Cek baca dulu: worker yang menganggur tidak perlu mengambil kunci tulis setiap polling
+            if conn.execute(f'SELECT 1 FROM detection_jobs WHERE {claimable} LIMIT 1',
+                            (JOB_QUEUED, now, JOB_RUNNING, now)).fetchone() is None:
+                return None
+
+            # BEGIN IMMEDIATE mengambil kunci tulis sebelum SELECT, jadi dua
+            # worker (di proses mana pun) tidak bisa mengambil job yang sama
+            conn.isolation_level = None
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                conn.execute('''
+                    UPDATE detection_jobs
+                    SET status = ?, stage = NULL, worker = NULL, lease_until = NULL, finished_at = ?,
+                        error = 'Worker berhenti saat memproses job (lease habis)'
+                    WHERE status = ? AND lease_until < ? AND attempts >= max_attempts
+                ''', (JOB_FAILED, now, JOB_RUNNING, now))
+
+                row = conn.execute(f'SELECT id FROM detection_jobs WHERE {claimable} ORDER BY id LIMIT 1',
+                                   (JOB_QUEUED, now, JOB_RUNNING, now)).fetchone()
+                if row is None:
+                    conn.execute('COMMIT')
+                    return None
+
+                conn.execute('''
+                    UPDATE detection_jobs
+                    SET status = ?, stage = ?, progress = 0, worker = ?, lease_until = ?,
+                        attempts = attempts + 1, started_at = ?, error = NULL
+                    WHERE id = ?
+                ''', (JOB_RUNNING, "Memulai", worker_id, now + self.lease_seconds, now, row[0]))
+                job = conn.execute(f'SELECT {", ".join(JOB_COLUMNS)} FROM detection_jobs WHERE id = ?',
+                                   (row[0],)).fetchone()
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        finally:
+            conn.close()
+        return self._row_to_job(job)
+
+    def heartbeat(self, job_id, worker_id, stage=None, progress=None):
+        """
+        Perpanjang lease dan perbarui tahap/progress job (default: yang terakhir
+        dicatat report_progress)
+        Returns: False jika job sudah tidak dipegang worker ini
+        """
+        if stage is None and progress is None:
+            with self._progress_lock:
+                stage, progress = self._progress.get(job_id, (None, None))
+        conn = self.db_manager._connect()
+        try:
+            with conn:
+                cursor = conn.execute('''
+                    UPDATE detection_jobs
+                    SET lease_until = ?, stage = COALESCE(?, stage), progress = COALESCE(?, progress)
+                    WHERE id = ? AND worker = ? AND status = ?
+                ''', (time.time() + self.lease_seconds, stage, progress, job_id, worker_id, JOB_RUNNING))
+                return cursor.rowcount > 0
+        finally:
+            conn.close()
+
+    def complete(self, job_id, worker_id, hasil_deteksi, result=None, username=None):
+        """
+        Tulis riwayat deteksi dan tandai job selesai dalam satu transaksi
+        (group commit HistoryWriter jika ada)
+        Args:
+            hasil_deteksi: String prediksi untuk detection_history
+            result: Data tambahan untuk UI (JSON), contoh lesi yang mirip
+            username: Pemilik job, agar pembacaan history user menunggu commit ini
+        Returns: id history, atau None jika job sudah diambil alih worker lain
+        """
+        def apply(cursor):
+            return self._complete(cursor, job_id, worker_id, hasil_deteksi, result)
+
+        try:
+            writer = getattr(self.db_manager, "history_writer", None)
+            if writer is not None:
+                return writer.execute(username, apply)
+
+            conn = self.db_manager._connect()
+            try:
+                with conn:
+                    return apply(conn.cursor())
+            finally:
+                conn.close()
+        finally:
+            self._forget_progress(job_id)
+
+    def _complete(self, cursor, job_id, worker_id, hasil_deteksi, result):
+        """Selesaikan job di transaksi cursor; Returns: id history atau None"""
+        row = cursor.execute('''
+            SELECT username, filename, filepath, image_hash FROM detection_jobs
+            WHERE id = ? AND worker = ? AND status = ?
+        ''', (job_id, worker_id, JOB_RUNNING)).fetchone()
+        if row is None:
+            return None
+
+        # Referensi gambar milik job berpindah ke record history
+        history_id = self.db_manager.insert_history_records(
+            cursor, [(row[0], row[1], row[2], hasil_deteksi, row[3])])[0]
+        cursor.execute('''
+            UPDATE detection_jobs
+            SET status = ?, stage = NULL, progress = 1, history_id = ?, result = ?,
+                lease_until = NULL, finished_at = ?
+            WHERE id = ?
+        ''', (JOB_DONE, history_id, json.dumps(result or {}), time.time(), job_id))
+        return history_id
+
+    def fail(self, job_id, worker_id, error, retryable=True):
+        """
+        Catat kegagalan. Job dijadwalkan ulang dengan jeda berlipat jika masih
+        ada sisa percobaan, selain itu ditandai gagal (bisa dicoba lagi dari UI).
+        Returns: status job setelahnya
+        """
+        self._forget_progress(job_id)
+        conn = self.db_manager._connect()
+        try:
+            with conn:
+                row = conn.execute('''
+                    SELECT attempts, max_attempts FROM detection_jobs
+                    WHERE id = ? AND worker = ? AND status = ?
+                ''', (job_id, worker_id, JOB_RUNNING)).fetchone()
+                if row is None:
+                    return None
+
+                attempts, max_attempts = row
+                now = time.time()
+                if retryable and attempts < max_attempts:
+                    delay = min(self.max_retry_delay, self.retry_delay * 2 ** (attempts - 1))
+                    conn.execute('''
+                        UPDATE detection_jobs
+                        SET status = ?, stage = ?, worker = NULL, lease_until = NULL,
+                            available_at = ?, error = ?
+                        WHERE id = ?
+                    ''', (JOB_QUEUED, f"Menunggu percobaan ke-{attempts + 1}", now + delay, str(error), job_id))
+                    return JOB_QUEUED
+
+                conn.execute('''
+                    UPDATE detection_jobs
+                    SET status = ?, stage = NULL, worker = NULL, lease_until = NULL,
+                        finished_at = ?, error = ?
+                    WHERE id = ?
+                ''', (JOB_FAILED, now, str(error), job_id))
+                return JOB_FAILED
+        finally:
+            conn.close()
+
+    def postpone(self, job_id, worker_id, delay, stage="Menunggu giliran model"):
+        """
+        Kembalikan job ke antrian tanpa menghitung percobaan (detector sedang
+        penuh, bukan kesalahan job)
+        """
+        self._forget_progress(job_id)
+        conn = self.db_manager._connect()
+        try:
+            with conn:
+                conn.execute('''
+                    UPDATE detection_jobs
+                    SET status = ?, stage = ?, worker = NULL, lease_until = NULL,
+                        attempts = MAX(attempts - 1, 0), available_at = ?
+                    WHERE id = ? AND worker = ? AND status = ?
+                ''', (JOB_QUEUED, stage, time.time() + delay, job_id, worker_id, JOB_RUNNING))
+        finally:
+            conn.close()
+
+    def retry(self, job_id, username):
+        """Jadwalkan ulang job gagal milik user dengan jatah percobaan baru"""
+        conn = self.db_manager._connect()
+        try:
+            with conn:
+                cursor = conn.execute('''
+                    UPDATE detection_jobs
+                    SET status = ?, stage = ?, progress = 0, attempts = 0, error = NULL,
+                        available_at = ?, finished_at = NULL
+                    WHERE id = ? AND username = ? AND status = ?
+                ''', (JOB_QUEUED, "Menunggu worker", time.time(), job_id, username, JOB_FAILED))
+                retried = cursor.rowcount > 0
+        finally:
+            conn.close()
+        if retried:
+            self._wakeup.set()
+        return retried
+
+    def dismiss(self, job_id, username):
+        """Hapus job gagal milik user dan lepas referensi gambarnya"""
+        return self._delete_jobs('id = ? AND username = ? AND status = ?', (job_id, username, JOB_FAILED)) > 0
+
+    def purge_finished(self, days=7):
+        """
+        Hapus job selesai/gagal yang lebih tua dari `days` hari
+        Returns: jumlah job yang dihapus
+        """
+        cutoff = time.time() - days * 86400
+        return self._delete_jobs('status IN (?, ?) AND finished_at < ?', (JOB_DONE, JOB_FAILED, cutoff))
+
+    def _delete_jobs(self, where, params):
+        from image_store import ImageStore
+
+        conn = self.db_manager._connect()
+        try:
+            with conn:
+                cursor = conn.cursor()
+                # Hanya job gagal yang masih memegang referensi gambar
+                cursor.execute(f'SELECT image_hash FROM detection_jobs WHERE {where} AND status = ? '
+                               f'AND image_hash IS NOT NULL', (*params, JOB_FAILED))
+                unused = ImageStore.release_references(cursor, [row[0] for row in cursor.fetchall()])
+                cursor.execute(f'DELETE FROM detection_jobs WHERE {where}', params)
+                deleted = cursor.rowcount
+        finally:
+            conn.close()
+        self.db_manager.remove_files(unused)
+        return deleted
+
+    def get_job(self, job_id, username=None):
+        """Returns: dict job (dengan hasil_deteksi jika sudah selesai) atau None"""
+        conn = self.db_manager._connect()
+        try:
+            query = f'''
+                SELECT {", ".join("j." + column for column in JOB_COLUMNS)}, h.hasil_deteksi
+                FROM detection_jobs j LEFT JOIN detection_history h ON h.id = j.history_id
+                WHERE j.id = ?
+            '''
+            params = [job_id]
+            if username is not None:
+                query += ' AND j.username = ?'
+                params.append(username)
+            row = conn.execute(query, params).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = self._row_to_job(row[:-1])
+        job["hasil_deteksi"] = row[-1]
+        return job
+
+    def user_jobs(self, username, statuses=(JOB_QUEUED, JOB_RUNNING, JOB_FAILED), limit=20):
+        """Job terbaru milik user dengan status tertentu (untuk halaman riwayat)"""
+        conn = self.db_manager._connect()
+        try:
+            placeholders = ','.join('?' * len(statuses))
+            rows = conn.execute(f'''
+                SELECT {", ".join(JOB_COLUMNS)} FROM detection_jobs
+                WHERE username = ? AND status IN ({placeholders})
+                ORDER BY id DESC LIMIT ?
+            ''', (username, *statuses, limit)).fetchall()
+        finally:
+            conn.close()
+        return [self._row_to_job(row) for row in rows]
+
+    def queue_position(self, job_id):
+        """Jumlah job antrian di depan job ini (0 = berikutnya)"""
+        conn = self.db_manager._connect()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM detection_jobs WHERE status = ? AND id < ?',
+                                (JOB_QUEUED, job_id)).fetchone()[0]
+        finally:
+            conn.close()
+
+    def stats(self):
+        """Jumlah job per status dan umur job antrian tertua (detik)"""
+        conn = self.db_manager._connect()
+        try:
+            counts = dict(conn.execute('SELECT status, COUNT(*) FROM detection_jobs GROUP BY status').fetchall())
+            oldest = conn.execute('SELECT MIN(available_at) FROM detection_jobs WHERE status = ?',
+                                  (JOB_QUEUED,)).fetchone()[0]
+        finally:
+            conn.close()
+        stats = {status: counts.get(status, 0) for status in (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED)}
+        stats["oldest_queued_seconds"] = round(max(0.0, time.time() - oldest), 1) if oldest else 0.0
+        return stats
+
+
+class DetectionJobWorker:
+    """
+    Worker background yang mengambil job dari DetectionJobQueue, menjalankan
+    SkinCancerDetector (lewat kontrol masuk yang sama dengan deteksi
+    interaktif jika diberikan) lalu menulis hasil ke detection_history.
+    Bisa berjalan sebagai thread di proses Streamlit atau sebagai proses
+    terpisah (python job_queue.py); banyak worker boleh memakai database sama.
+    """
+
+    def __init__(self, job_queue, detector, admission=None, lesion_index=None, threads=1,
+                 poll_interval=1.0, busy_delay=2.0, purge_days=7, name=None, measure_memory=None):
+        """
+        Args:
+            job_queue: DetectionJobQueue
+            detector: SkinCancerDetector atau RemoteSkinCancerDetector
+            admission: AdmissionController (opsional)
+            lesion_index: LesionIndex untuk mencari foto lama yang mirip (opsional)
+            threads: Jumlah thread worker
+            poll_interval: Jarak cek antrian saat kosong (detik)
+            busy_delay: Jeda sebelum job dicoba lagi jika detector penuh (detik)
+            purge_days: Umur job selesai/gagal sebelum dihapus
+            measure_memory: Catat puncak RSS per job (default dari env PROFILE_JOB_MEMORY).
+                            PeakMemory me-reset VmHWM milik seluruh proses, jadi hanya
+                            bermakna dengan satu thread worker tanpa beban lain
+        """
+        self.job_queue = job_queue
+        self.detector = detector
+        self.admission = admission
+        self.lesion_index = lesion_index
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.busy_delay = busy_delay
+        self.purge_days = purge_days
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        if measure_memory is None:
+            measure_memory = os.environ.get("PROFILE_JOB_MEMORY", "").lower() in ("1", "true", "yes")
+        self.measure_memory = measure_memory
+
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._active = {}  # job_id -> worker_id, lease-nya diperpanjang thread heartbeat
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Jalankan thread worker dan heartbeat"""
+        if self._threads:
+            return self
+        for index in range(self.threads):
+            thread = threading.Thread(target=self._run, args=(f"{self.name}/{index}",),
+                                      name=f"detection-job-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat_loop, name="detection-job-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+        return self
+
+    def stop(self, timeout=30.0):
+        """Berhenti mengambil job baru dan tunggu job yang sedang berjalan"""
+        self._stop_event.set()
+        self.job_queue._wakeup.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _run(self, worker_id):
+        last_purge = 0.0
+        while not self._stop_event.is_set():
+            try:
+                # Job lama dibersihkan paling sering sekali per jam
+                if self.purge_days and time.monotonic() - last_purge > 3600:
+                    last_purge = time.monotonic()
+                    self.job_queue.purge_finished(self.purge_days)
+
+                job = self.job_queue.claim(worker_id)
+            except Exception as e:
+                print(f"Error saat mengambil job deteksi: {e}")
+                job = None
+
+            if job is None:
+                self.job_queue.wait(self.poll_interval)
+                continue
+            self.process(job, worker_id)
+
+    def _heartbeat_loop(self):
+        interval = max(1.0, self.job_queue.lease_seconds / 3)
+        while not self._stop_event.wait(interval):
+            with self._lock:
+                active = list(self._active.items())
+            for job_id, worker_id in active:
+                try:
+                    self.job_queue.heartbeat(job_id, worker_id)
+                except Exception as e:
+                    print(f"Error saat memperpanjang lease job {job_id}: {e}")
+
+    def _stage(self, job, stage, progress):
+        # Hanya di memori; ikut tertulis saat lease diperpanjang thread heartbeat
+        self.job_queue.report_progress(job["id"], stage, progress)
+
+    def process(self, job, worker_id):
+        """Jalankan satu job yang sudah di-claim"""
+        from admission import DetectorBusy
+        from diagnostics import PeakMemory
+        from tracing import StageTimer, trace_request, image_info
+        from utils import log_activity
+
+        timer = StageTimer()
+        memory = PeakMemory().start() if self.measure_memory else None
+        ingested = None
+        with self._lock:
+            self._active[job["id"]] = worker_id
+        try:
+            self._stage(job, "Membaca gambar", 0.1)
+            with timer.stage("ingest"):
+                with open(job["filepath"], "rb") as f:
+                    ingested = ingest_upload(f.read(), job["filename"], max_side=WORKING_MAX_SIDE)
+
+            self._stage(job, "Menunggu giliran model", 0.2)
+            if self.admission is not None:
+                waiting_since = time.perf_counter()
+                with self.admission.slot():
+                    timer.add("admission", waiting_since)
+                    self._stage(job, "Menganalisis gambar", 0.3)
+                    with timer.stage("inference"):
+                        image_rgb, raw_predictions = self.detector.detect_raw(
+                            job["filepath"], image=ingested.image, image_scale=ingested.scale)
+            else:
+                self._stage(job, "Menganalisis gambar", 0.3)
+                with timer.stage("inference"):
+                    image_rgb, raw_predictions = self.detector.detect_raw(
+                        job["filepath"], image=ingested.image, image_scale=ingested.scale)
+
+            self._stage(job, "Mencari foto yang mirip", 0.8)
+            with timer.stage("index"):
+                similar = self.index_lesions(job, image_rgb, raw_predictions, ingested.scale)
+            del image_rgb
+
+            with timer.stage("store"):
+                history_id = self.job_queue.complete(job["id"], worker_id, str(raw_predictions),
+                                                     {"similar": similar}, username=job["username"])
+            memory_fields = {}
+            if memory is not None:
+                memory_fields["peak_rss_delta_mb"] = memory.stop().peak_delta_mb
+            if history_id is not None:
+                log_activity(job["username"], "detect",
+                             latency_ms=timer.elapsed_ms(),
+                             model_version=self.detector.model_version, cache_hit=False,
+                             image_hash=job["image_hash"], detections=len(raw_predictions),
+                             job_id=job["id"], attempt=job["attempts"], **memory_fields)
+                trace_request(job["username"], "detect", timer=timer, image=image_info(ingested),
+                              model_version=self.detector.model_version, detections=len(raw_predictions),
+                              attempt=job["attempts"])
+        except DetectorBusy as e:
+            # Detector penuh oleh deteksi lain: kembali ke antrian tanpa menghabiskan percobaan
+            self.job_queue.postpone(job["id"], worker_id, self.busy_delay)
+            trace_request(job["username"], "detect", "busy", timer=timer, error=e,
+                          image=image_info(ingested) if ingested else None)
+        except (InvalidImage, FileNotFoundError) as e:
+            self.job_queue.fail(job["id"], worker_id, e, retryable=False)
+            log_activity(job["username"], "detect_failed", job_id=job["id"], error=str(e))
+            trace_request(job["username"], "detect", "invalid", timer=timer, error=e)
+        except Exception as e:
+            print(f"Error saat menjalankan job deteksi {job['id']}: {e}")
+            status = self.job_queue.fail(job["id"], worker_id, e)
+            log_activity(job["username"], "detect_failed", job_id=job["id"], error=str(e),
+                         attempt=job["attempts"], status=status)
+            trace_request(job["username"], "detect", "error", timer=timer, error=e,
+                          image=image_info(ingested) if ingested else None,
+                          model_version=self.detector.model_version, attempt=job["attempts"])
+        finally:
+            with self._lock:
+                self._active.pop(job["id"], None)
+
+    def index_lesions(self, job, image_rgb, raw_predictions, scale):
+        """
+        Cari foto lama yang tampak serupa dengan lesi pada gambar ini, lalu tambahkan
+        embedding lesinya ke index user. Kegagalan index tidak menggagalkan job.
+        Returns: list hasil LesionIndex.search
+        """
+        if self.lesion_index is None:
+            return []
+        try:
+            from lesion_index import lesion_embeddings
+
+            vectors, classes = lesion_embeddings(image_rgb, raw_predictions, scale=scale)
+            similar = self.lesion_index.search(job["username"], vectors, exclude_hash=job["image_hash"],
+                                               top_k=SIMILAR_LESION_COUNT,
+                                               min_similarity=SIMILAR_LESION_MIN_SIMILARITY)
+            self.lesion_index.add(job["username"], job["image_hash"], vectors, classes)
+            return similar
+        except Exception as e:
+            print(f"Error saat mengindeks lesi: {e}")
+            return []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker antrian deteksi (tabel detection_jobs)")
+    parser.add_argument("--db", default="skin_cancer_app.db", help="Path database SQLite")
+    parser.add_argument("--model", default="best.pt", help="Path model YOLO")
+    parser.add_argument("--threads", type=int, default=1, help="Jumlah thread worker")
+    parser.add_argument("--inference-workers", default=os.environ.get("INFERENCE_WORKERS", ""),
+                        help="Alamat worker inferensi remote, dipisah koma")
+    parser.add_argument("--no-lesion-index", action="store_true", help="Jangan perbarui index kemiripan lesi")
+    parser.add_argument("--status", action="store_true", help="Tampilkan jumlah job per status lalu keluar")
+    parser.add_argument("--purge-days", type=int, default=None,
+                        help="Hapus job selesai/gagal lebih tua dari N hari lalu keluar")
+    args = parser.parse_args()
+
+    from sharding import open_database, open_job_queue
+
+    # Dengan TENANT_DIRECTORY worker melayani job semua tenant. Write-behind
+    # aktif supaya penyelesaian job dari semua thread di-commit berkelompok
+    db_manager = open_database(args.db)
+    job_queue = open_job_queue(db_manager)
+    if args.status:
+        for key, value in job_queue.stats().items():
+            print(f"{key}: {value}")
+    elif args.purge_days is not None:
+        print(f"{job_queue.purge_finished(args.purge_days)} job dihapus")
+    else:
+        workers = [address.strip() for address in args.inference_workers.split(",") if address.strip()]
+        if workers:
+            from remote_detection import RemoteSkinCancerDetector
+            detector = RemoteSkinCancerDetector(workers)
+        else:
+            from detection import SkinCancerDetector
+            detector = SkinCancerDetector(args.model)
+            if detector.model is None:
+                raise SystemExit(f"Model tidak dapat dimuat: {args.model}")
+
+        lesion_index = None
+        if not args.no_lesion_index:
+            from lesion_index import LesionIndex
+            lesion_index = LesionIndex()
+
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop_event.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: stop_event.set())
+
+        worker = DetectionJobWorker(job_queue, detector, lesion_index=lesion_index, threads=args.threads).start()
+        print(f"Worker job deteksi {worker.name} berjalan ({args.threads} thread)")
+        stop_event.wait()
+        # Job yang terputus di tengah jalan akan diambil ulang setelah lease-nya habis
+        print("Menunggu job yang sedang berjalan selesai...")
+        worker.stop()
+    db_manager.close()
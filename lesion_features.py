@@ -0,0 +1,301 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+# Sisi crop persegi (piksel) tempat fitur ABCDE dihitung untuk setiap lesi.
+# 48 cukup untuk bentuk dan warna, dan menjaga biaya ~1-4 ms per gambar
+FEATURE_CROP_SIZE = 48
+# Margin di sekitar bbox (proporsi sisi terpanjang bbox) agar tepi lesi dan kulit ikut terlihat
+FEATURE_MARGIN = 0.15
+# Fitur dihitung untuk MAX_FEATURE_LESIONS prediksi dengan confidence tertinggi
+# (prediksi mentah di CONFIDENCE_FLOOR bisa puluhan, sebagian besar tidak pernah ditampilkan)
+MAX_FEATURE_LESIONS = 8
+# Warna dihitung ada jika menutupi minimal proporsi lesi ini
+MIN_COLOR_FRACTION = 0.05
+
+# Perkiraan enam warna dermoskopi (RGB): putih, merah, coklat muda, coklat tua, biru-abu, hitam
+DERMOSCOPY_COLORS = np.array([
+    [230, 225, 225],
+    [190, 60, 60],
+    [190, 135, 95],
+    [105, 65, 45],
+    [95, 115, 140],
+    [35, 30, 30],
+], dtype=np.uint8)
+
+FEATURE_KEYS = ("asymmetry_major", "asymmetry_minor", "border_irregularity",
+                "color_variance", "color_count", "diameter_px")
+
+# Offset titik sampel dalam crop, relatif terhadap pusat (-0.5 .. 0.5)
+_OFFSETS = (np.arange(FEATURE_CROP_SIZE, dtype=np.float32) + 0.5) / FEATURE_CROP_SIZE - 0.5
+_GRID_Y, _GRID_X = np.mgrid[0:FEATURE_CROP_SIZE, 0:FEATURE_CROP_SIZE].astype(np.float32)
+
+
+def _to_lab(rgb):
+    """RGB uint8 (..., 3) ke CIELAB float (L 0-100, a/b sekitar -128..127) dengan satu panggilan OpenCV"""
+    rows = rgb.shape[-2] if rgb.ndim > 2 else 1
+    lab = cv2.cvtColor(np.ascontiguousarray(rgb).reshape(-1, rows, 3),
+                       cv2.COLOR_RGB2LAB).reshape(rgb.shape).astype(np.float32)
+    lab[..., 0] *= 100.0 / 255.0
+    lab[..., 1:] -= 128.0
+    return lab
+
+
+_DERMOSCOPY_LAB = _to_lab(DERMOSCOPY_COLORS[None, :, :])[0]
+
+
+def sample_crops(image_rgb, boxes):
+    """
+    Ambil crop persegi semua lesi sekaligus dengan satu indexing NumPy
+    (nearest neighbour, piksel di luar gambar memakai tepi terdekat)
+    Args:
+        image_rgb: Gambar RGB (H, W, 3)
+        boxes: array (N, 4) [x1, y1, x2, y2] di koordinat image_rgb
+    Returns:
+        tuple: (crops (N, S, S, 3) uint8, sisi crop di piksel image_rgb (N,))
+    """
+    height, width = image_rgb.shape[:2]
+    center_x = (boxes[:, 0] + boxes[:, 2]) / 2
+    center_y = (boxes[:, 1] + boxes[:, 3]) / 2
+    side = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]) * (1 + 2 * FEATURE_MARGIN)
+    side = np.maximum(side, 1.0)
+
+    xs = np.clip(center_x[:, None] + _OFFSETS[None, :] * side[:, None], 0, width - 1).astype(np.intp)
+    ys = np.clip(center_y[:, None] + _OFFSETS[None, :] * side[:, None], 0, height - 1).astype(np.intp)
+    # Indeks piksel datar: satu take() untuk semua crop
+    pixels = np.ascontiguousarray(image_rgb).reshape(-1, 3)
+    return pixels.take(ys[:, :, None] * width + xs[:, None, :], axis=0), side
+
+
+def otsu_thresholds(values):
+    """
+    Threshold Otsu untuk banyak crop sekaligus
+    Args:
+        values: array (N, P) nilai 0-255 (dibulatkan ke bin 1)
+    Returns:
+        array (N,) threshold
+    """
+    count = values.shape[0]
+    bins = np.clip(values, 0, 255).astype(np.int64) + 256 * np.arange(count)[:, None]
+    hist = np.bincount(bins.ravel(), minlength=256 * count).reshape(count, 256).astype(np.float64)
+    levels = np.arange(256, dtype=np.float64)
+
+    weight_low = np.cumsum(hist, axis=1)
+    weight_high = weight_low[:, -1:] - weight_low
+    sum_low = np.cumsum(hist * levels, axis=1)
+    mean_low = sum_low / np.maximum(weight_low, 1e-9)
+    mean_high = (sum_low[:, -1:] - sum_low) / np.maximum(weight_high, 1e-9)
+    between = weight_low * weight_high * (mean_low - mean_high) ** 2
+    return np.argmax(between, axis=1).astype(np.float32)
+
+
+def _shift_any(mask):
+    """Dilasi 3x3 per crop dengan pergeseran array (tanpa loop per piksel)"""
+    padded = np.pad(mask, ((0, 0), (1, 1), (1, 1)))
+    size = mask.shape[1]
+    result = np.zeros_like(mask)
+    for dy in range(3):
+        for dx in range(3):
+            result |= padded[:, dy:dy + size, dx:dx + size]
+    return result
+
+
+def lesion_masks(lab, boxes_in_crop):
+    """
+    Mask lesi per crop: piksel lebih gelap dari threshold Otsu kanal L,
+    dibersihkan dengan opening 3x3. Mask yang hampir kosong atau penuh (Otsu
+    gagal, misal lesi pucat) diganti elips di dalam bbox.
+    Args:
+        lab: array (N, S, S, 3) CIELAB
+        boxes_in_crop: array (N, 4) bbox dalam koordinat crop
+    Returns:
+        array bool (N, S, S)
+    """
+    count = lab.shape[0]
+    lightness = lab[..., 0] * (255.0 / 100.0)
+    thresholds = otsu_thresholds(lightness.reshape(count, -1))
+    masks = lightness <= thresholds[:, None, None]
+    # Opening: erosi = komplemen dilasi komplemen
+    masks = _shift_any(~_shift_any(~masks))
+
+    center_x = (boxes_in_crop[:, 0] + boxes_in_crop[:, 2])[:, None, None] / 2
+    center_y = (boxes_in_crop[:, 1] + boxes_in_crop[:, 3])[:, None, None] / 2
+    radius_x = np.maximum((boxes_in_crop[:, 2] - boxes_in_crop[:, 0]) / 2, 1.0)[:, None, None]
+    radius_y = np.maximum((boxes_in_crop[:, 3] - boxes_in_crop[:, 1]) / 2, 1.0)[:, None, None]
+    ellipse = ((_GRID_X + 0.5 - center_x) / radius_x) ** 2 + ((_GRID_Y + 0.5 - center_y) / radius_y) ** 2 <= 1.0
+
+    fraction = masks.mean(axis=(1, 2))
+    failed = (fraction < 0.02) | (fraction > 0.9)
+    masks[failed] = ellipse[failed]
+    return masks
+
+
+def compute_features(image_rgb, boxes):
+    """
+    Fitur ABCDE kuantitatif untuk N lesi dalam satu pass tervektorisasi
+    (operasi pada array (N, S, S) dan daftar piksel lesi, tanpa loop per piksel atau per lesi)
+    Args:
+        image_rgb: Gambar RGB (H, W, 3)
+        boxes: array (N, 4) bbox di koordinat image_rgb
+    Returns:
+        dict nama fitur -> array (N,):
+            asymmetry_major / asymmetry_minor: proporsi luas lesi yang tidak tertutup
+                setelah mask dicerminkan terhadap sumbu panjang / pendek (0 = simetris)
+            border_irregularity: keliling^2 / (4 pi luas) (1 = lingkaran, makin besar makin tidak rata)
+            color_variance: variansi warna CIELAB di dalam lesi (jumlah variansi L, a, b)
+            color_count: jumlah warna dermoskopi (dari 6) yang menutupi >= MIN_COLOR_FRACTION lesi
+            diameter_px: panjang sumbu utama elips ekuivalen, dalam piksel image_rgb
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    count = len(boxes)
+    if count == 0:
+        return {key: np.zeros(0, dtype=np.float32) for key in FEATURE_KEYS}
+
+    crops, side = sample_crops(image_rgb, boxes)
+    lab = _to_lab(crops)
+    crop_scale = FEATURE_CROP_SIZE / side
+    origin_x = (boxes[:, 0] + boxes[:, 2]) / 2 - side / 2
+    origin_y = (boxes[:, 1] + boxes[:, 3]) / 2 - side / 2
+    boxes_in_crop = (boxes - np.stack([origin_x, origin_y, origin_x, origin_y], axis=1)) * crop_scale[:, None]
+    masks = lesion_masks(lab, boxes_in_crop)
+    # Semua perhitungan berikutnya memakai daftar piksel lesi (owner = nomor lesi),
+    # dijumlahkan per lesi dengan bincount
+    owner, pixel_y, pixel_x = np.nonzero(masks)
+    pixel_x = pixel_x.astype(np.float32)
+    pixel_y = pixel_y.astype(np.float32)
+
+    def per_lesion(values):
+        return np.bincount(owner, weights=values, minlength=count)
+
+    # Momen orde 0-2
+    area = np.maximum(np.bincount(owner, minlength=count), 1).astype(np.float64)
+    center_x = per_lesion(pixel_x) / area
+    center_y = per_lesion(pixel_y) / area
+    dx = pixel_x - center_x[owner]
+    dy = pixel_y - center_y[owner]
+    mu20 = per_lesion(dx * dx) / area
+    mu02 = per_lesion(dy * dy) / area
+    mu11 = per_lesion(dx * dy) / area
+    spread = np.sqrt(((mu20 - mu02) / 2) ** 2 + mu11 ** 2)
+    major_variance = (mu20 + mu02) / 2 + spread
+    theta = 0.5 * np.arctan2(2 * mu11, mu20 - mu02)
+    axis_x, axis_y = np.cos(theta), np.sin(theta)
+
+    def asymmetry(line_x, line_y):
+        """Proporsi piksel lesi yang pantulannya terhadap garis melalui pusat jatuh di luar lesi"""
+        line_x = line_x[owner]
+        line_y = line_y[owner]
+        projection = dx * line_x + dy * line_y
+        reflected_x = np.rint(2 * projection * line_x - dx + center_x[owner]).astype(np.intp)
+        reflected_y = np.rint(2 * projection * line_y - dy + center_y[owner]).astype(np.intp)
+        inside = ((reflected_x >= 0) & (reflected_x < FEATURE_CROP_SIZE)
+                  & (reflected_y >= 0) & (reflected_y < FEATURE_CROP_SIZE))
+        covered = np.zeros(len(owner), dtype=bool)
+        covered[inside] = masks[owner[inside], reflected_y[inside], reflected_x[inside]]
+        return per_lesion(~covered) / area
+
+    # A: cerminkan terhadap sumbu panjang dan sumbu pendek
+    asymmetry_major = asymmetry(axis_x, axis_y)
+    asymmetry_minor = asymmetry(-axis_y, axis_x)
+
+    # B: keliling dari jumlah sisi piksel batas (crack length x pi/4 ~ keliling kontur halus)
+    padded = np.pad(masks, ((0, 0), (1, 1), (1, 1)))
+    crack = ((padded[:, 1:, :] != padded[:, :-1, :]).sum(axis=(1, 2))
+             + (padded[:, :, 1:] != padded[:, :, :-1]).sum(axis=(1, 2)))
+    perimeter = crack * (np.pi / 4)
+    border_irregularity = perimeter ** 2 / (4 * np.pi * area)
+
+    # C: variansi warna (E[x^2] - E[x]^2 per kanal) dan jumlah warna dermoskopi di dalam lesi
+    lesion_pixels = lab[masks]
+    color_variance = np.zeros(count)
+    for channel in range(3):
+        values = lesion_pixels[:, channel]
+        mean = per_lesion(values) / area
+        color_variance += np.maximum(per_lesion(values * values) / area - mean * mean, 0)
+    # Warna terdekat: |x - c|^2 = |x|^2 - 2 x.c + |c|^2, |x|^2 tidak mengubah argmin
+    nearest = np.argmin(np.square(_DERMOSCOPY_LAB).sum(axis=1) - 2 * lesion_pixels @ _DERMOSCOPY_LAB.T, axis=1)
+    color_area = np.bincount(nearest + len(DERMOSCOPY_COLORS) * owner, minlength=len(DERMOSCOPY_COLORS) * count)
+    color_area = color_area.reshape(count, len(DERMOSCOPY_COLORS)) / area[:, None]
+    color_count = (color_area >= MIN_COLOR_FRACTION).sum(axis=1)
+
+    # D: sumbu utama elips ekuivalen (4 x akar variansi terbesar), kembali ke piksel image_rgb
+    diameter_px = 4 * np.sqrt(np.maximum(major_variance, 0)) / crop_scale
+
+    return {
+        "asymmetry_major": asymmetry_major,
+        "asymmetry_minor": asymmetry_minor,
+        "border_irregularity": border_irregularity,
+        "color_variance": color_variance,
+        "color_count": color_count,
+        "diameter_px": diameter_px,
+    }
+
+
+def add_lesion_features(image_rgb, predictions, scale=1.0, max_lesions=MAX_FEATURE_LESIONS):
+    """
+    Tambahkan fitur ABCDE ke dict prediksi (key "abcde"), disimpan bersama
+    prediksi di riwayat. Prediksi di luar max_lesions teratas tidak diberi fitur.
+    Args:
+        image_rgb: Gambar RGB tempat deteksi dijalankan
+        predictions: List prediksi dengan bbox di koordinat gambar asli
+        scale: Skala image_rgb terhadap gambar asli; diameter dikembalikan
+               dalam piksel gambar asli
+    Returns:
+        predictions (diubah di tempat)
+    """
+    selected = sorted(range(len(predictions)), key=lambda index: predictions[index]['confidence'],
+                      reverse=True)[:max_lesions]
+    if not selected:
+        return predictions
+
+    boxes = np.array([predictions[index]['bbox'] for index in selected], dtype=np.float32) * scale
+    features = compute_features(image_rgb, boxes)
+    features["diameter_px"] = features["diameter_px"] / scale
+    for row, index in enumerate(selected):
+        predictions[index]['abcde'] = {
+            "asymmetry_major": round(float(features["asymmetry_major"][row]), 3),
+            "asymmetry_minor": round(float(features["asymmetry_minor"][row]), 3),
+            "border_irregularity": round(float(features["border_irregularity"][row]), 3),
+            "color_variance": round(float(features["color_variance"][row]), 1),
+            "color_count": int(features["color_count"][row]),
+            "diameter_px": round(float(features["diameter_px"][row]), 1),
+        }
+    return predictions
+
+
+def benchmark_features(image_path, lesions=8, repeat=50):
+    """Waktu ekstraksi fitur per gambar untuk sejumlah bbox acak"""
+    image_bgr = cv2.imread(image_path)
+    if image_bgr is None:
+        raise SystemExit(f"Gagal membaca gambar: {image_path}")
+    image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+    height, width = image_rgb.shape[:2]
+
+    rng = np.random.default_rng(0)
+    sizes = rng.uniform(0.1, 0.5, size=(lesions, 1)) * min(height, width)
+    corners = rng.uniform(0, 1, size=(lesions, 2)) * (np.array([width, height]) - sizes)
+    predictions = [{"class": "lesion", "confidence": float(rng.uniform(0.05, 1)),
+                    "bbox": [int(x), int(y), int(x + size), int(y + size)]}
+                   for (x, y), (size,) in zip(corners, sizes)]
+
+    add_lesion_features(image_rgb, predictions)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        add_lesion_features(image_rgb, predictions)
+    elapsed = (time.perf_counter() - start) / repeat * 1000
+    print(f"{lesions} lesi pada {width}x{height}: {elapsed:.2f} ms per gambar")
+    for pred in predictions[:3]:
+        print(pred["bbox"], pred["abcde"])
+    return elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ekstraksi fitur ABCDE")
+    parser.add_argument("image", help="Path gambar contoh")
+    parser.add_argument("--lesions", type=int, default=8, help="Jumlah bbox per gambar")
+    parser.add_argument("--repeat", type=int, default=50, help="Jumlah pengulangan")
+    args = parser.parse_args()
+
+    benchmark_features(args.image, args.lesions, args.repeat)
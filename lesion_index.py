@@ -0,0 +1,388 @@
+import argparse
+import hashlib
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from utils import parse_predictions
+
+DEFAULT_INDEX_DIR = "lesion_index"
+
+# Ukuran crop lesi yang dinormalisasi sebelum fitur dihitung
+CROP_SIZE = 64
+# Margin di sekitar bbox (proporsi lebar/tinggi bbox) agar tepi lesi ikut terlihat
+CROP_MARGIN = 0.15
+# Lesi yang di-index per gambar: prediksi dengan confidence >= batas ini, paling banyak MAX_LESIONS
+MIN_INDEX_CONFIDENCE = 0.25
+MAX_LESIONS = 5
+
+# Blok fitur (semua tahan rotasi, skala dan sebagian perubahan pencahayaan):
+# kontras warna lesi terhadap kulit, histogram kromatisitas lesi relatif
+# terhadap kulit, distribusi kecerahan di dalam lesi, bentuk mask lesi
+# (momen Hu dan sebaran radial) serta profil kecerahan dari pusat ke tepi
+CHROMA_BINS = 5
+TEXTURE_BINS = 8
+RADIAL_BINS = 8
+HU_MOMENTS = 4
+EMBEDDING_DIM = 6 + CHROMA_BINS ** 2 + TEXTURE_BINS + HU_MOMENTS + RADIAL_BINS * 2
+
+# Satu baris metadata per vektor (ukuran tetap, bisa di-memmap seperti vektornya)
+KEY_DTYPE = np.dtype([
+    ("image_hash", "S64"),
+    ("lesion", "<i2"),
+    ("class", "S8"),
+    ("created", "<f8"),
+])
+VECTOR_BYTES = EMBEDDING_DIM * 4
+# Dinaikkan setiap kali fitur berubah; index versi lama diabaikan dan dibangun ulang lewat CLI
+INDEX_VERSION = 1
+
+_YY, _XX = np.mgrid[0:CROP_SIZE, 0:CROP_SIZE].astype(np.float32)
+
+
+def _centered(vector, scale=1.0):
+    """Kurangi rata-rata lalu normalisasi panjang, dikali bobot blok"""
+    vector = vector - vector.mean()
+    norm = np.linalg.norm(vector)
+    return vector * (scale / norm) if norm > 0 else vector
+
+
+def crop_lesion(image_rgb, bbox=None):
+    """
+    Potong area lesi (dengan margin) dan ubah ke CROP_SIZE x CROP_SIZE
+    Args:
+        image_rgb: Gambar RGB (numpy array)
+        bbox: [x1, y1, x2, y2] di koordinat gambar, None = seluruh gambar
+    """
+    height, width = image_rgb.shape[:2]
+    if bbox is not None:
+        x1, y1, x2, y2 = bbox
+        margin_x = (x2 - x1) * CROP_MARGIN
+        margin_y = (y2 - y1) * CROP_MARGIN
+        x1 = int(max(0, x1 - margin_x))
+        y1 = int(max(0, y1 - margin_y))
+        x2 = int(min(width, x2 + margin_x))
+        y2 = int(min(height, y2 + margin_y))
+        if x2 > x1 and y2 > y1:
+            image_rgb = image_rgb[y1:y2, x1:x2]
+    return cv2.resize(image_rgb, (CROP_SIZE, CROP_SIZE), interpolation=cv2.INTER_AREA)
+
+
+def lesion_mask(lightness):
+    """
+    Mask lesi: piksel yang lebih gelap dari threshold Otsu pada kanal L.
+    Jika hasilnya hampir kosong atau hampir penuh, seluruh crop dianggap lesi.
+    """
+    _, mask = cv2.threshold(lightness, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    mask = mask.astype(bool)
+    fraction = mask.mean()
+    if fraction < 0.02 or fraction > 0.98:
+        mask[:] = True
+    return mask
+
+
+def compute_embedding(image_rgb, bbox=None):
+    """
+    Embedding ringkas (EMBEDDING_DIM float32, panjang 1) untuk satu lesi.
+    Dot product dua embedding = cosine similarity. Fitur dihitung dari crop
+    kecil dengan operasi NumPy tervektorisasi (tanpa model), sehingga tetap
+    murah di CPU. Similarity-nya hanya bermakna sebagai urutan: nilainya
+    menumpuk di dekat 1 dan tidak menyatakan dua foto berisi lesi yang sama.
+    """
+    crop = crop_lesion(image_rgb, bbox)
+    lab = cv2.cvtColor(crop, cv2.COLOR_RGB2LAB)
+    mask = lesion_mask(lab[:, :, 0])
+    lab = lab.astype(np.float32)
+    lesion = lab[mask]
+    skin = lab[~mask] if (~mask).any() else lab.reshape(-1, 3)
+    lesion_mean = lesion.mean(axis=0)
+    skin_mean = skin.mean(axis=0)
+
+    # Warna lesi relatif terhadap kulit di sekitarnya, dan variasinya
+    color = np.concatenate([(lesion_mean - skin_mean) / 40.0, lesion.std(axis=0) / 20.0])
+
+    # Histogram kromatisitas (a, b) lesi relatif terhadap kulit
+    chroma = (lesion[:, 1:] - skin_mean[1:] + 40.0) * (CHROMA_BINS / 80.0)
+    chroma = np.clip(chroma.astype(np.int64), 0, CHROMA_BINS - 1)
+    chroma_hist = np.bincount(chroma[:, 0] * CHROMA_BINS + chroma[:, 1],
+                              minlength=CHROMA_BINS ** 2).astype(np.float32)
+    chroma_hist = np.sqrt(chroma_hist / len(lesion))
+
+    # Distribusi kecerahan di dalam lesi (pola jaringan/titik), relatif terhadap rata-ratanya
+    relative_l = (lesion[:, 0] - lesion_mean[0]) / (lesion[:, 0].std() + 1.0)
+    texture = np.clip(((relative_l + 2.0) * (TEXTURE_BINS / 4.0)).astype(np.int64), 0, TEXTURE_BINS - 1)
+    texture_hist = np.sqrt(np.bincount(texture, minlength=TEXTURE_BINS) / len(lesion)).astype(np.float32)
+
+    # Bentuk mask: momen Hu (skala log) dan sebaran piksel terhadap radius ekuivalen
+    hu = cv2.HuMoments(cv2.moments(mask.astype(np.uint8), binaryImage=True)).ravel()[:HU_MOMENTS]
+    hu = -np.sign(hu) * np.log10(np.abs(hu) + 1e-12)
+    hu = np.clip(hu, 0, 12).astype(np.float32) / 12.0
+
+    center_y = _YY[mask].mean()
+    center_x = _XX[mask].mean()
+    radius = np.hypot(_YY - center_y, _XX - center_x)
+    equivalent_radius = np.sqrt(mask.sum() / np.pi) + 1e-6
+    rings = np.minimum((radius / equivalent_radius * (RADIAL_BINS / 2.0)).astype(np.int64),
+                       RADIAL_BINS - 1).ravel()
+    flat_mask = mask.ravel()
+    ring_area = np.bincount(rings, minlength=RADIAL_BINS).astype(np.float32)
+    ring_lesion = np.bincount(rings, weights=flat_mask, minlength=RADIAL_BINS).astype(np.float32)
+    occupancy = ring_lesion / np.maximum(ring_area, 1.0)
+    # Profil kecerahan dari pusat lesi ke luar, relatif terhadap kulit
+    ring_l = np.bincount(rings, weights=lab[:, :, 0].ravel(), minlength=RADIAL_BINS)
+    profile = ((ring_l / np.maximum(ring_area, 1.0)) - skin_mean[0]) / 40.0
+    profile = np.where(ring_area > 0, profile, 0.0).astype(np.float32)
+
+    embedding = np.concatenate([
+        color * 0.6,
+        _centered(chroma_hist, 0.8),
+        _centered(texture_hist, 0.5),
+        _centered(hu, 0.5),
+        _centered(occupancy, 0.7),
+        profile * 0.4,
+    ]).astype(np.float32)
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm > 0 else embedding
+
+
+def lesion_embeddings(image_rgb, predictions, min_confidence=MIN_INDEX_CONFIDENCE, max_lesions=MAX_LESIONS,
+                      scale=1.0):
+    """
+    Embedding untuk lesi-lesi utama pada satu gambar
+    Jika tidak ada prediksi yang cukup yakin, seluruh gambar dipakai sebagai satu lesi
+    (foto lesi biasanya diambil dari dekat).
+    Args:
+        scale: Skala image_rgb terhadap gambar asli (bbox prediksi dalam koordinat asli)
+    Returns:
+        tuple: (array (n, EMBEDDING_DIM), list nama kelas)
+    """
+    selected = sorted(
+        (pred for pred in predictions if pred['confidence'] >= min_confidence),
+        key=lambda pred: pred['confidence'], reverse=True,
+    )[:max_lesions]
+    if not selected:
+        return compute_embedding(image_rgb)[None, :], [""]
+    vectors = np.stack([compute_embedding(image_rgb, [value * scale for value in pred['bbox']])
+                        for pred in selected])
+    return vectors, [pred['class'] for pred in selected]
+
+
+class LesionIndex:
+    """
+    Index vektor lesi per user untuk mencari foto lama yang tampak serupa
+    (kriteria "Evolving" pada aturan ABCDE).
+    Setiap user punya dua file append-only di direktori sendiri:
+    vectors.vN.f32 (baris float32 EMBEDDING_DIM) dan keys.vN.bin (baris KEY_DTYPE:
+    image_hash, nomor lesi, kelas, waktu). Pencarian me-memmap kedua file dan
+    menghitung similarity untuk semua baris dengan satu perkalian matriks
+    NumPy, jadi ribuan riwayat tetap dicari dalam hitungan milidetik tanpa
+    memuat index ke memori proses. Jumlah baris diambil dari ukuran file
+    terkecil, sehingga baris yang belum selesai ditulis diabaikan.
+    Entri milik riwayat yang sudah dihapus disaring saat hasil dicocokkan ke
+    database dan dibuang permanen oleh compact().
+    """
+
+    def __init__(self, root=DEFAULT_INDEX_DIR):
+        self.root = root
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _user_dir(self, username):
+        # Nama direktori dari hash username (username bebas karakter)
+        return os.path.join(self.root, hashlib.sha256(username.encode("utf-8")).hexdigest()[:32])
+
+    def _paths(self, username):
+        directory = self._user_dir(username)
+        return (os.path.join(directory, f"vectors.v{INDEX_VERSION}.f32"),
+                os.path.join(directory, f"keys.v{INDEX_VERSION}.bin"))
+
+    def _lock(self, username):
+        with self._locks_guard:
+            return self._locks.setdefault(username, threading.Lock())
+
+    def _open(self, username):
+        """
+        Memmap vektor dan key milik user (read-only)
+        Returns: tuple (vectors (n, EMBEDDING_DIM), keys (n,)) atau (None, None) jika kosong
+        """
+        vectors_path, keys_path = self._paths(username)
+        try:
+            count = min(os.path.getsize(vectors_path) // VECTOR_BYTES,
+                        os.path.getsize(keys_path) // KEY_DTYPE.itemsize)
+        except FileNotFoundError:
+            return None, None
+        if count == 0:
+            return None, None
+        vectors = np.memmap(vectors_path, dtype=np.float32, mode="r", shape=(count, EMBEDDING_DIM))
+        keys = np.memmap(keys_path, dtype=KEY_DTYPE, mode="r", shape=(count,))
+        return vectors, keys
+
+    def count(self, username):
+        """Jumlah vektor lesi di index user"""
+        _, keys = self._open(username)
+        return 0 if keys is None else len(keys)
+
+    def contains(self, username, image_hash):
+        """Apakah gambar ini sudah di-index untuk user"""
+        _, keys = self._open(username)
+        return keys is not None and bool(np.any(keys["image_hash"] == image_hash.encode("ascii")))
+
+    def add(self, username, image_hash, vectors, classes):
+        """
+        Tambahkan embedding lesi dari satu gambar (dilewati jika gambar sudah ada)
+        Returns: jumlah vektor yang ditambahkan
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        keys = np.zeros(len(vectors), dtype=KEY_DTYPE)
+        keys["image_hash"] = image_hash.encode("ascii")
+        keys["lesion"] = np.arange(len(vectors))
+        keys["class"] = [name.encode("ascii", "ignore")[:8] for name in classes]
+        keys["created"] = time.time()
+
+        with self._lock(username):
+            if self.contains(username, image_hash):
+                return 0
+            os.makedirs(self._user_dir(username), exist_ok=True)
+            vectors_path, keys_path = self._paths(username)
+            # Potong sisa baris yang tidak lengkap (misal proses mati saat menulis)
+            self._truncate_to_common_count(vectors_path, keys_path)
+            with open(vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(keys_path, "ab") as f:
+                f.write(keys.tobytes())
+        return len(vectors)
+
+    @staticmethod
+    def _truncate_to_common_count(vectors_path, keys_path):
+        if not (os.path.exists(vectors_path) and os.path.exists(keys_path)):
+            return
+        count = min(os.path.getsize(vectors_path) // VECTOR_BYTES,
+                    os.path.getsize(keys_path) // KEY_DTYPE.itemsize)
+        for path, row_bytes in ((vectors_path, VECTOR_BYTES), (keys_path, KEY_DTYPE.itemsize)):
+            if os.path.getsize(path) != count * row_bytes:
+                os.truncate(path, count * row_bytes)
+
+    def search(self, username, query_vectors, exclude_hash=None, top_k=5, min_similarity=0.9):
+        """
+        Cari gambar lama yang paling mirip dengan salah satu lesi query
+        Args:
+            query_vectors: array (m, EMBEDDING_DIM) dari lesion_embeddings()
+            exclude_hash: image_hash gambar saat ini (tidak ikut dicari)
+            top_k: Jumlah gambar maksimal
+            min_similarity: Cosine similarity minimal
+        Returns:
+            list dict: image_hash, similarity, lesion, class (urut dari yang paling mirip,
+            satu entri per gambar)
+        """
+        vectors, keys = self._open(username)
+        if vectors is None:
+            return []
+
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(-1, EMBEDDING_DIM)
+        # (n, m) similarity, ambil lesi query yang paling cocok per baris
+        similarity = (vectors @ queries.T).max(axis=1)
+        hashes = keys["image_hash"]
+        if exclude_hash:
+            similarity[hashes == exclude_hash.encode("ascii")] = -1.0
+
+        candidates = np.flatnonzero(similarity >= min_similarity)
+        if candidates.size == 0:
+            return []
+        # Urutkan kandidat saja, lalu ambil satu baris terbaik per gambar
+        candidates = candidates[np.argsort(-similarity[candidates], kind="stable")]
+
+        results = []
+        seen = set()
+        for row in candidates:
+            image_hash = hashes[row].decode("ascii")
+            if image_hash in seen:
+                continue
+            seen.add(image_hash)
+            results.append({
+                "image_hash": image_hash,
+                "similarity": float(similarity[row]),
+                "lesion": int(keys["lesion"][row]),
+                "class": keys["class"][row].decode("ascii"),
+            })
+            if len(results) >= top_k:
+                break
+        return results
+
+    def compact(self, username, valid_hashes):
+        """
+        Tulis ulang index user tanpa entri yang image_hash-nya tidak lagi dirujuk riwayat
+        Returns: jumlah vektor yang dibuang
+        """
+        valid = np.array([h.encode("ascii") for h in valid_hashes], dtype="S64")
+        with self._lock(username):
+            vectors, keys = self._open(username)
+            if vectors is None:
+                return 0
+            keep = np.isin(keys["image_hash"], valid)
+            removed = int(len(keep) - keep.sum())
+            if removed == 0:
+                return 0
+
+            vectors_path, keys_path = self._paths(username)
+            kept_vectors = np.array(vectors[keep])
+            kept_keys = np.array(keys[keep])
+            del vectors, keys
+            # Tulis ke file sementara lalu ganti secara atomik
+            for path, data in ((vectors_path, kept_vectors), (keys_path, kept_keys)):
+                tmp_path = path + ".tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(data.tobytes())
+                os.replace(tmp_path, path)
+            return removed
+
+
+def rebuild_user_index(db_manager, index, username, batch_size=500):
+    """
+    Isi index user dari riwayat yang sudah ada (gambar yang belum di-index saja)
+    Returns: jumlah gambar yang ditambahkan
+    """
+    added = 0
+    for record in db_manager.iter_detection_history(username, batch_size=batch_size):
+        image_hash = record[6]
+        if not image_hash or index.contains(username, image_hash):
+            continue
+        image_bgr = cv2.imread(record[3])
+        if image_bgr is None:
+            continue
+        image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+        vectors, classes = lesion_embeddings(image_rgb, parse_predictions(record[5]))
+        if index.add(username, image_hash, vectors, classes):
+            added += 1
+    return added
+
+
+if __name__ == "__main__":
+    from sharding import open_database
+
+    parser = argparse.ArgumentParser(description="Bangun ulang / padatkan index kemiripan lesi per user")
+    parser.add_argument("usernames", nargs="*", help="User yang diproses (default: semua user)")
+    parser.add_argument("--db", default="skin_cancer_app.db", help="Path database SQLite")
+    parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR, help="Direktori index")
+    args = parser.parse_args()
+
+    db_manager = open_database(args.db, write_behind=False)
+    index = LesionIndex(args.index_dir)
+    usernames = args.usernames
+    if not usernames:
+        conn = db_manager._connect()
+        try:
+            usernames = [row[0] for row in conn.execute("SELECT username FROM users")]
+        finally:
+            conn.close()
+
+    for username in usernames:
+        start = time.perf_counter()
+        valid = {record[6] for record in db_manager.iter_detection_history(username) if record[6]}
+        removed = index.compact(username, valid)
+        added = rebuild_user_index(db_manager, index, username)
+        print(f"{username}: {added} gambar ditambahkan, {removed} vektor dibuang, "
+              f"total {index.count(username)} vektor ({time.perf_counter() - start:.1f} detik)")
@@ -0,0 +1,477 @@
+import argparse
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+
+from tracing import percentile
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Pola di output aplikasi yang dihitung sebagai error walaupun tidak sampai ke UI
+# (lapisan database mencetak error lalu mengembalikan nilai kosong)
+OUTPUT_ERROR_PATTERNS = ("database is locked", "Error saat", "Traceback")
+
+
+class _OutputMonitor(io.TextIOBase):
+    """
+    Pengganti sys.stdout selama load test: menghitung baris yang cocok dengan
+    OUTPUT_ERROR_PATTERNS lalu meneruskannya (atau membuangnya jika quiet)
+    """
+
+    def __init__(self, target, quiet=True):
+        self.target = target
+        self.quiet = quiet
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        for pattern in OUTPUT_ERROR_PATTERNS:
+            if pattern in text:
+                with self._lock:
+                    self.counts[pattern] += 1
+        if not self.quiet:
+            self.target.write(text)
+        return len(text)
+
+    def flush(self):
+        self.target.flush()
+
+
+def _proc_sample(pid):
+    """RSS (byte), waktu CPU (detik), thread dan file terbuka satu proses dari /proc"""
+    sample = {"rss_bytes": 0, "cpu_seconds": 0.0, "threads": 0, "open_files": None}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                sample["rss_bytes"] = int(line.split()[1]) * 1024
+            elif line.startswith("Threads:"):
+                sample["threads"] = int(line.split()[1])
+    with open(f"/proc/{pid}/stat") as f:
+        # Field setelah "(nama)": utime dan stime ada di posisi 11 dan 12
+        fields = f.read().rsplit(")", 1)[1].split()
+    sample["cpu_seconds"] = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    try:
+        sample["open_files"] = len(os.listdir(f"/proc/{pid}/fd"))
+    except OSError:
+        pass
+    return sample
+
+
+class _ResourceSampler:
+    """Sampling RSS, CPU, thread dan file descriptor (dijumlah) proses user simulasi selama satu tahap"""
+
+    def __init__(self, pids, interval=0.5):
+        self.pids = pids
+        self.interval = interval
+        self.samples = []
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="loadtest-sampler", daemon=True)
+
+    def _sample(self):
+        total = {"rss_bytes": 0, "cpu_seconds": 0.0, "threads": 0, "open_files": 0}
+        for pid in self.pids:
+            try:
+                sample = _proc_sample(pid)
+            except (OSError, IndexError, ValueError):
+                # Proses sudah selesai
+                continue
+            for key in total:
+                total[key] += sample[key] or 0
+        return total
+
+    def _run(self):
+        last_wall = time.monotonic()
+        last_cpu = self._sample()["cpu_seconds"]
+        while not self._stop_event.wait(self.interval):
+            wall = time.monotonic()
+            sample = self._sample()
+            self.samples.append({
+                "rss_bytes": sample["rss_bytes"],
+                "cpu_percent": max(0.0, sample["cpu_seconds"] - last_cpu) / max(wall - last_wall, 1e-6) * 100,
+                "threads": sample["threads"],
+                "open_files": sample["open_files"],
+            })
+            last_wall, last_cpu = wall, sample["cpu_seconds"]
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop_event.set()
+        self._thread.join()
+
+    def summary(self):
+        def peak(key):
+            values = [sample[key] for sample in self.samples if sample[key] is not None]
+            return max(values) if values else None
+
+        cpu = [sample["cpu_percent"] for sample in self.samples]
+        return {
+            "rss_peak_mb": round(peak("rss_bytes") / (1024 * 1024), 1) if peak("rss_bytes") else None,
+            "cpu_mean_percent": round(sum(cpu) / len(cpu), 1) if cpu else None,
+            "threads_peak": peak("threads"),
+            "open_files_peak": peak("open_files"),
+        }
+
+
+class SimulatedUser:
+    """
+    Satu user simulasi yang menjalankan main.py lewat AppTest (tanpa browser):
+    register, login, deteksi pada gambar contoh, buka riwayat, hapus satu
+    riwayat, lalu logout. Setiap at.run() diukur dan dicatat per aksi;
+    deteksi dicatat dua kali: kirim job (kirim_deteksi) dan sampai hasil tampil (deteksi).
+    """
+
+    def __init__(self, app_path, username, images, iterations, results, timeout):
+        self.app_path = app_path
+        self.username = username
+        self.password = "loadtest-" + uuid.uuid4().hex[:8]
+        self.images = images
+        self.iterations = iterations
+        self.results = results
+        self.timeout = timeout
+        self.at = None
+
+    def _step(self, action, fn=None):
+        """Jalankan satu interaksi + at.run(), catat latensi dan pesan error di halaman"""
+        start = time.perf_counter()
+        try:
+            if fn is not None:
+                fn()
+            self.at.run()
+        except Exception as e:
+            self.results.record(action, time.perf_counter() - start, [f"{type(e).__name__}: {e}"])
+            raise
+        errors = [str(exception.value) for exception in self.at.exception]
+        errors += [str(error.value) for error in self.at.error]
+        warnings = [str(warning.value) for warning in self.at.warning]
+        self.results.record(action, time.perf_counter() - start, errors, warnings)
+
+    def _fill_form(self, form_id, values):
+        inputs = [widget for widget in self.at.text_input if widget.form_id == form_id]
+        for widget, value in zip(inputs, values):
+            widget.input(value)
+        next(button for button in self.at.button if button.form_id == form_id).click()
+
+    def _select_menu(self, menu):
+        self.at.sidebar.selectbox[0].select(menu)
+
+    def _wait_for_detection(self, start, poll_interval=0.5):
+        """
+        Deteksi berjalan sebagai job background: rerun halaman (seperti polling
+        fragment di browser) sampai hasilnya tampil. Latensi "deteksi" dihitung
+        dari klik sampai hasil tampil.
+        """
+        deadline = start + self.timeout
+        while time.perf_counter() < deadline:
+            if any("Deteksi selesai" in str(success.value) for success in self.at.success):
+                self.results.record("deteksi", time.perf_counter() - start)
+                return
+            errors = [str(error.value) for error in self.at.error]
+            errors += [str(exception.value) for exception in self.at.exception]
+            if errors:
+                self.results.record("deteksi", time.perf_counter() - start, errors)
+                return
+            time.sleep(poll_interval)
+            self.at.run()
+        self.results.record("deteksi", time.perf_counter() - start, ["Hasil deteksi tidak muncul sebelum timeout"])
+
+    def _button(self, label_prefix):
+        for button in self.at.button:
+            if button.label.startswith(label_prefix):
+                return button
+        return None
+
+    def run(self):
+        from streamlit.testing.v1 import AppTest
+
+        self.at = AppTest.from_file(self.app_path, default_timeout=self.timeout)
+        try:
+            self._step("buka_aplikasi")
+            self._step("register", lambda: self._fill_form(
+                "register_form", [f"Load {self.username}", self.username, self.password, self.password]))
+            self._step("login", lambda: self._fill_form("login_form", [self.username, self.password]))
+            if not self.at.session_state["logged_in"]:
+                self.results.record("login_gagal", 0.0, ["Login tidak berhasil"])
+                return
+
+            for iteration in range(self.iterations):
+                filename, data = self.images[iteration % len(self.images)]
+                self._step("menu_deteksi", lambda: self._select_menu("🔍 Deteksi"))
+                self._step("upload", lambda: self.at.file_uploader[0].set_value(
+                    (filename, data, "image/jpeg")))
+                detect_button = self._button("🔬 Mulai Deteksi")
+                if detect_button is not None:
+                    start = time.perf_counter()
+                    self._step("kirim_deteksi", detect_button.click)
+                    self._wait_for_detection(start)
+
+                self._step("menu_riwayat", lambda: self._select_menu("📈 Riwayat"))
+                # Hapus riwayat di iterasi genap supaya riwayat tetap bertambah
+                delete_button = self._button("🗑️ Hapus")
+                if iteration % 2 == 0 and delete_button is not None:
+                    self._step("hapus_riwayat", delete_button.click)
+
+            self._step("logout", lambda: self._select_menu("🚪 Logout"))
+        except Exception:
+            # Sudah dicatat oleh _step; user ini berhenti
+            pass
+
+
+class LoadTestResults:
+    """Kumpulan latensi, error dan peringatan per aksi (thread-safe)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self.warnings = defaultdict(Counter)
+
+    def record(self, action, seconds, errors=(), warnings=()):
+        with self._lock:
+            self.latencies[action].append(seconds * 1000)
+            for message in errors:
+                self.errors[action][message[:120]] += 1
+            for message in warnings:
+                self.warnings[action][message[:120]] += 1
+
+    def state(self):
+        """Isi hasil sebagai dict biasa (dikirim dari proses user ke proses induk)"""
+        with self._lock:
+            return {
+                "latencies": dict(self.latencies),
+                "errors": {action: dict(counter) for action, counter in self.errors.items()},
+                "warnings": {action: dict(counter) for action, counter in self.warnings.items()},
+            }
+
+    def merge(self, state):
+        """Gabungkan hasil dari state() proses lain"""
+        with self._lock:
+            for action, values in state["latencies"].items():
+                self.latencies[action].extend(values)
+            for action, counter in state["errors"].items():
+                self.errors[action].update(counter)
+            for action, counter in state["warnings"].items():
+                self.warnings[action].update(counter)
+
+    def summary(self):
+        with self._lock:
+            actions = {}
+            for action, values in self.latencies.items():
+                values = sorted(values)
+                actions[action] = {
+                    "count": len(values),
+                    "p50_ms": round(percentile(values, 50), 1),
+                    "p95_ms": round(percentile(values, 95), 1),
+                    "p99_ms": round(percentile(values, 99), 1),
+                    "max_ms": round(values[-1], 1),
+                    "errors": sum(self.errors[action].values()),
+                    "warnings": sum(self.warnings[action].values()),
+                }
+            error_messages = Counter()
+            for counter in self.errors.values():
+                error_messages.update(counter)
+            warning_messages = Counter()
+            for counter in self.warnings.values():
+                warning_messages.update(counter)
+            return {
+                "actions": actions,
+                "error_messages": dict(error_messages.most_common(10)),
+                "warning_messages": dict(warning_messages.most_common(10)),
+            }
+
+
+def load_images(paths):
+    """Gambar contoh: file atau direktori (jpg/jpeg/png), returns list (nama, bytes)"""
+    images = []
+    for path in paths:
+        files = [path]
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, name) for name in os.listdir(path)
+                           if name.lower().endswith((".jpg", ".jpeg", ".png")))
+        for file_path in files:
+            with open(file_path, "rb") as f:
+                images.append((os.path.basename(file_path), f.read()))
+    return images
+
+
+def _sample_image():
+    """Gambar sintetis jika tidak ada gambar contoh"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (800, 600), (214, 170, 150))
+    ImageDraw.Draw(image).ellipse((300, 200, 480, 360), fill=(90, 50, 35))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return [("sample.jpg", buffer.getvalue())]
+
+
+def _user_process(app_path, workdir, username, images, iterations, timeout, quiet, barrier, output):
+    """
+    Satu user simulasi di prosesnya sendiri (satu AppTest per proses, runtime
+    Streamlit tidak dibagi). Hasil dikirim ke proses induk lewat `output`.
+    """
+    os.chdir(workdir)
+    if APP_DIR not in sys.path:
+        sys.path.insert(0, APP_DIR)
+    results = LoadTestResults()
+    monitor = _OutputMonitor(sys.stdout, quiet=quiet)
+    started = finished = time.time()
+    try:
+        # Semua user mulai bersamaan setelah Streamlit selesai di-import
+        importlib.import_module("streamlit.testing.v1")
+        barrier.wait(timeout)
+        started = time.time()
+        sys.stdout = monitor
+        try:
+            SimulatedUser(app_path, username, images, iterations, results, timeout).run()
+        finally:
+            sys.stdout = sys.__stdout__
+        finished = time.time()
+    except Exception as e:
+        results.record("proses_user", 0.0, [f"{type(e).__name__}: {e}"])
+    output.put({"username": username, "results": results.state(), "output_errors": dict(monitor.counts),
+                "started": started, "finished": finished})
+
+
+def run_step(app_path, workdir, concurrency, images, iterations, timeout, run_id, step_index, quiet=True):
+    """
+    Jalankan `concurrency` user simulasi bersamaan, masing-masing di proses sendiri
+    Returns: dict ringkasan tahap
+    """
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(concurrency)
+    output = context.Queue()
+    processes = [
+        context.Process(target=_user_process, name=f"loadtest-user-{index}",
+                        args=(app_path, workdir, f"lt{run_id}s{step_index}u{index}", images, iterations,
+                              timeout, quiet, barrier, output))
+        for index in range(concurrency)
+    ]
+    for process in processes:
+        process.start()
+
+    results = LoadTestResults()
+    output_errors = Counter()
+    reports = []
+    with _ResourceSampler([process.pid for process in processes]) as sampler:
+        while len(reports) < concurrency:
+            try:
+                reports.append(output.get(timeout=1.0))
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    break
+    for process in processes:
+        process.join()
+
+    for report in reports:
+        results.merge(report["results"])
+        output_errors.update(report["output_errors"])
+    for process in processes[len(reports):]:
+        results.record("proses_user", 0.0, [f"Proses user berhenti tanpa hasil (exit code {process.exitcode})"])
+    elapsed = (max(report["finished"] for report in reports) - min(report["started"] for report in reports)
+               if reports else 0.0)
+
+    summary = results.summary()
+    summary.update({
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 1),
+        "actions_per_second": round(sum(a["count"] for a in summary["actions"].values()) / max(elapsed, 1e-6), 2),
+        "resources": sampler.summary(),
+        "output_errors": dict(output_errors),
+    })
+    return summary
+
+
+def run_load_test(user_steps, images=None, iterations=2, workdir=None, model_path=None,
+                  timeout=120, quiet=True):
+    """
+    Naikkan jumlah user bersamaan bertahap dan ukur setiap tahap.
+    Aplikasi dijalankan di direktori kerja terpisah (database, gambar dan log
+    sendiri) sehingga data asli tidak tersentuh. Setiap user simulasi berjalan
+    di proses sendiri dengan AppTest sendiri: AppTest tidak mendukung beberapa
+    run bersamaan dalam satu proses. Akibatnya setiap user memuat aplikasi
+    (dan modelnya) sendiri, seperti beberapa instance server yang berbagi
+    database; resource dijumlah dari semua proses user.
+    Args:
+        user_steps: List jumlah user bersamaan per tahap, contoh [1, 2, 4, 8]
+        images: List (nama, bytes) gambar contoh
+        iterations: Jumlah siklus deteksi + riwayat per user
+        workdir: Direktori kerja (default direktori sementara baru)
+        model_path: best.pt yang disalin ke direktori kerja (tanpa model deteksi gagal dan tercatat sebagai error)
+        timeout: Batas waktu satu at.run() (detik)
+    Returns:
+        list dict: ringkasan per tahap
+    """
+    images = images or _sample_image()
+    workdir = os.path.abspath(workdir or tempfile.mkdtemp(prefix="loadtest-"))
+    os.makedirs(workdir, exist_ok=True)
+    if model_path:
+        shutil.copy(model_path, os.path.join(workdir, "best.pt"))
+
+    app_path = os.path.join(APP_DIR, "main.py")
+    run_id = uuid.uuid4().hex[:6]
+    steps = []
+    for step_index, concurrency in enumerate(user_steps):
+        summary = run_step(app_path, workdir, concurrency, images, iterations, timeout, run_id, step_index,
+                           quiet=quiet)
+        steps.append(summary)
+        print_step(summary)
+    return steps
+
+
+def print_step(summary):
+    total_errors = sum(action["errors"] for action in summary["actions"].values())
+    print(f"\n== {summary['concurrency']} user bersamaan: {summary['elapsed_seconds']} detik, "
+          f"{summary['actions_per_second']} aksi/detik, {total_errors} error ==")
+    print(f"{'aksi':<16} {'n':>5} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9} {'error':>6} {'warn':>5}  (ms)")
+    for action, stats in summary["actions"].items():
+        print(f"{action:<16} {stats['count']:>5} {stats['p50_ms']:>9} {stats['p95_ms']:>9} "
+              f"{stats['p99_ms']:>9} {stats['max_ms']:>9} {stats['errors']:>6} {stats['warnings']:>5}")
+    for message, count in summary["error_messages"].items():
+        print(f"  error x{count}: {message}")
+    for message, count in summary["warning_messages"].items():
+        print(f"  peringatan x{count}: {message}")
+    for pattern, count in summary["output_errors"].items():
+        print(f"  output '{pattern}' x{count}")
+    resources = summary["resources"]
+    print(f"  resource: RSS puncak {resources['rss_peak_mb']} MB, CPU rata-rata {resources['cpu_mean_percent']}%, "
+          f"thread puncak {resources['threads_peak']}, file terbuka puncak {resources['open_files_peak']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test aplikasi Streamlit dengan user simulasi (AppTest)")
+    parser.add_argument("--users", default="1,2,4,8", help="Jumlah user bersamaan per tahap, dipisah koma")
+    parser.add_argument("--iterations", type=int, default=2, help="Siklus deteksi + riwayat per user")
+    parser.add_argument("--images", nargs="*", default=[], help="File/direktori gambar contoh")
+    parser.add_argument("--model", default="best.pt" if os.path.exists("best.pt") else None,
+                        help="Model yang disalin ke direktori kerja")
+    parser.add_argument("--workdir", default=None, help="Direktori kerja (default direktori sementara)")
+    parser.add_argument("--timeout", type=int, default=120, help="Batas waktu satu rerun (detik)")
+    parser.add_argument("--verbose", action="store_true", help="Tampilkan output aplikasi")
+    parser.add_argument("--json", metavar="FILE", help="Simpan hasil lengkap sebagai JSON")
+    args = parser.parse_args()
+
+    steps = run_load_test(
+        [int(value) for value in args.users.split(",") if value.strip()],
+        images=load_images(args.images) if args.images else None,
+        iterations=args.iterations,
+        workdir=args.workdir,
+        model_path=args.model,
+        timeout=args.timeout,
+        quiet=not args.verbose,
+    )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(steps, f, indent=2, ensure_ascii=False)
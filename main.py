@@ -1,12 +1,27 @@
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import os
 from auth import AuthManager
-from detection import SkinCancerDetector
-from database import DatabaseManager
-from utils import setup_directories
-from PIL import Image
+from password_hashing import HasherBusy
+from detection import SkinCancerDetector, CONFIDENCE_FLOOR, DEFAULT_CONFIDENCE_THRESHOLD
+from remote_detection import RemoteSkinCancerDetector
+from utils import setup_directories, parse_predictions, log_activity, format_file_size
+from diagnostics import probe_capabilities, run_diagnostics_subprocess
+from sharding import open_database, open_job_queue, open_retention_job
+from janitor import DiskJanitor
+from image_store import get_variant
+from export import export_history_zip
+from ingest import ingest_upload, InvalidImage, WORKING_MAX_SIDE
+from admission import admission_from_env
+from lesion_index import LesionIndex
+from job_queue import DetectionJobWorker, JOB_QUEUED, JOB_DONE, JOB_FAILED, ACTIVE_STATUSES
+from tracing import StageTimer, trace_request, image_info
 import datetime
+import uuid
 import pytz
+import cv2
+import numpy as np
+from collections import OrderedDict
 
 # Setup halaman Streamlit
 st.set_page_config(
@@ -22,12 +37,85 @@ setup_directories()
 # Inisialisasi managers
 @st.cache_resource
 def init_managers():
-    db_manager = DatabaseManager()
+    # TENANT_DIRECTORY: satu database SQLite per klinik (lihat sharding.py)
+    db_manager = open_database()
     auth_manager = AuthManager(db_manager)
-    detector = SkinCancerDetector()
-    return db_manager, auth_manager, detector
+    # INFERENCE_WORKERS (dipisah koma, contoh tcp://10.0.0.5:7601,unix:///run/skd.sock):
+    # inferensi dijalankan di worker remote, model tidak dimuat di proses ini.
+    # Worker di alamat jaringan memakai shared secret yang sama (INFERENCE_SECRET)
+    workers = [address.strip() for address in os.environ.get("INFERENCE_WORKERS", "").split(",") if address.strip()]
+    detector = RemoteSkinCancerDetector(workers) if workers else SkinCancerDetector()
+    # Batas inferensi bersamaan, antrian dengan deadline dan pin thread torch/OpenCV
+    admission = admission_from_env()
+    # Index kemiripan lesi per user (foto lama yang tampak serupa)
+    lesion_index = LesionIndex()
+    # Deteksi berjalan sebagai job di SQLite; DETECTION_JOB_WORKERS=0 berarti
+    # job hanya diproses worker terpisah (python job_queue.py)
+    job_queue = open_job_queue(db_manager)
+    job_threads = int(os.environ.get("DETECTION_JOB_WORKERS", "1"))
+    if job_threads > 0:
+        DetectionJobWorker(job_queue, detector, admission=admission, lesion_index=lesion_index,
+                           threads=job_threads).start()
+    
+    # Retensi history bersifat opt-in: HISTORY_RETENTION_DAYS=<hari> menghapus riwayat
+    # yang lebih tua dari itu (dan file yatim) secara berkala di background
+    retention_days = int(os.environ.get("HISTORY_RETENTION_DAYS", "0"))
+    if retention_days > 0:
+        open_retention_job(db_manager, days=retention_days).start()
+    # Batas umur dan kuota disk untuk temp/, uploads/ dan history_images/
+    DiskJanitor(db_manager).start()
+    return db_manager, auth_manager, detector, admission, lesion_index, job_queue
+
+db_manager, auth_manager, detector, admission, lesion_index, job_queue = init_managers()
+
+# Jumlah record riwayat per halaman
+HISTORY_PAGE_SIZE = 20
+
+# Jumlah hasil deteksi yang disimpan per sesi (per hash upload)
+DETECTION_CACHE_SIZE = 4
+
+# Sisi terpanjang gambar hasil
+DISPLAY_MAX_SIDE = 1280
+
+# Jarak polling status job deteksi (detik)
+JOB_POLL_SECONDS = 1.5
 
-db_manager, auth_manager, detector = init_managers()
+# Panel yang di-rerun sendiri tanpa menjalankan ulang seluruh skrip:
+# st.fragment (Streamlit >= 1.37), st.experimental_fragment (1.33-1.36),
+# versi lebih lama tetap berjalan dengan rerun penuh
+if hasattr(st, "fragment"):
+    fragment = st.fragment
+elif hasattr(st, "experimental_fragment"):
+    fragment = st.experimental_fragment
+else:
+    def fragment(func):
+        return func
+
+def polling_fragment(func):
+    """
+    Fragment yang di-rerun otomatis setiap JOB_POLL_SECONDS untuk memantau
+    status job. Tanpa dukungan run_every status diperbarui lewat tombol.
+    """
+    try:
+        return fragment(run_every=JOB_POLL_SECONDS)(func)
+    except TypeError:
+        return fragment(func)
+
+def rerun_fragment():
+    """
+    Rerun fragment yang sedang berjalan saja. Rerun penuh jika scope tidak
+    didukung atau fragment sedang dijalankan sebagai bagian dari rerun penuh.
+    """
+    try:
+        st.rerun(scope="fragment")
+    except (TypeError, StreamlitAPIException):
+        st.rerun()
+
+# Nama query parameter URL yang menyimpan token sesi (dibuat saat login, dicabut saat logout)
+SESSION_QUERY_PARAM = "sid"
+
+# User yang boleh membuka halaman diagnostik (env ADMIN_USERS, dipisah koma)
+ADMIN_USERS = {name.strip() for name in os.environ.get("ADMIN_USERS", "").split(",") if name.strip()}
 
 # Dictionary untuk menjelaskan jenis kanker kulit
 SKIN_CANCER_TYPES = {
@@ -127,6 +215,17 @@ def main():
     if 'selected_menu' not in st.session_state:
         st.session_state.selected_menu = "🔍 Deteksi"
 
+    # Pulihkan login dari token sesi di URL (refresh browser / reconnect). Token
+    # tidak diganti di sini: rerun yang menulis token baru bisa saja tidak sampai
+    # ke browser, dan tab yang diduplikasi memakai token yang sama
+    if not st.session_state.logged_in and SESSION_QUERY_PARAM in st.query_params:
+        username = auth_manager.resume_session(st.query_params[SESSION_QUERY_PARAM])
+        if username:
+            st.session_state.logged_in = True
+            st.session_state.username = username
+        else:
+            del st.query_params[SESSION_QUERY_PARAM]
+
     # Header aplikasi
     st.markdown('<h1 class="main-header">🔬 SkinGuard 🔬 Aplikasi Deteksi Kanker Kulit</h1>', unsafe_allow_html=True)
     
@@ -167,9 +266,22 @@ def show_login_page():
         
         if submit_button:
             if username and password:
-                if auth_manager.login(username, password):
+                timer = StageTimer()
+                try:
+                    with timer.stage("verify"):
+                        login_ok = auth_manager.login(username, password)
+                except HasherBusy as e:
+                    log_activity(username, "login_busy")
+                    trace_request(username, "login", "busy", timer=timer, error=e)
+                    st.warning("⏳ Server sedang sibuk, silakan coba login lagi sebentar lagi.")
+                    return
+                log_activity(username, "login", success=login_ok, latency_ms=timer.elapsed_ms())
+                trace_request(username, "login", "ok" if login_ok else "failed", timer=timer)
+
+                if login_ok:
                     st.session_state.logged_in = True
                     st.session_state.username = username
+                    st.query_params[SESSION_QUERY_PARAM] = auth_manager.create_session(username)
                     st.success("✅ Login berhasil!")
                     st.rerun()
                 else:
@@ -194,6 +306,7 @@ def show_register_page():
                 elif len(password) < 6:
                     st.error("❌ Password minimal 6 karakter!")
                 elif auth_manager.register(nama_lengkap, username, password):
+                    log_activity(username, "register")
                     st.success("✅ Registrasi berhasil! Silakan login.")
                 else:
                     st.error("❌ Username sudah digunakan!")
@@ -216,6 +329,7 @@ def show_reset_password_page():
                 elif len(new_password) < 6:
                     st.error("❌ Password minimal 6 karakter!")
                 elif auth_manager.reset_password(username, new_password):
+                    log_activity(username, "reset_password")
                     st.success("✅ Password berhasil direset! Silakan login dengan password baru.")
                 else:
                     st.error("❌ Username tidak ditemukan!")
@@ -228,6 +342,8 @@ def show_main_app():
         st.write(f"👋 Selamat datang, **{st.session_state.username}**!")
         
         menu_options = ["🔍 Deteksi", "📈 Riwayat", "👤 Info Akun", "📚 Edukasi", "🚪 Logout"]
+        if st.session_state.username in ADMIN_USERS:
+            menu_options.insert(-1, "🛠️ Diagnostik")
         selected = st.selectbox("Pilih Menu:", menu_options, index=menu_options.index(st.session_state.selected_menu) if st.session_state.selected_menu in menu_options else 0)
         
         if selected != st.session_state.selected_menu:
@@ -235,6 +351,10 @@ def show_main_app():
             st.rerun()
         
         if selected == "🚪 Logout":
+            if SESSION_QUERY_PARAM in st.query_params:
+                auth_manager.logout(st.query_params[SESSION_QUERY_PARAM])
+                del st.query_params[SESSION_QUERY_PARAM]
+            log_activity(st.session_state.username, "logout")
             st.session_state.logged_in = False
             st.session_state.username = None
             st.session_state.selected_menu = "🔍 Deteksi"
@@ -249,6 +369,8 @@ def show_main_app():
         show_account_info_page()
     elif st.session_state.selected_menu == "📚 Edukasi":
         show_education_page()
+    elif st.session_state.selected_menu == "🛠️ Diagnostik" and st.session_state.username in ADMIN_USERS:
+        show_diagnostics_page()
 
 def get_cancer_type_info(class_name):
     """Mendapatkan informasi lengkap tentang jenis kanker kulit"""
@@ -264,6 +386,33 @@ def get_cancer_type_info(class_name):
             'description': 'Jenis lesi kulit yang memerlukan evaluasi lebih lanjut oleh dokter spesialis.'
         }
 
+def get_ingested_upload(uploaded_file, display_name):
+    """
+    Ingest upload sekali per file; rerun Streamlit berikutnya memakai hasil
+    yang disimpan di session_state. Pesan error ditampilkan jika upload ditolak.
+    Gambar di memori dibatasi ke WORKING_MAX_SIDE; file asli disimpan utuh.
+    """
+    file_id = getattr(uploaded_file, "file_id", None) or display_name
+    cached = st.session_state.get("ingested_upload")
+    if cached and cached[0] == file_id:
+        return cached[1]
+
+    timer = StageTimer()
+    data = uploaded_file.getvalue()
+    try:
+        with timer.stage("ingest"):
+            ingested = ingest_upload(data, display_name, max_side=WORKING_MAX_SIDE)
+    except InvalidImage as e:
+        trace_request(st.session_state.username, "ingest", "invalid", timer=timer,
+                      image={"bytes": len(data)}, error=e)
+        st.error(f"❌ {e}")
+        return None
+
+    trace_request(st.session_state.username, "ingest", timer=timer, image=image_info(ingested))
+    st.session_state.ingested_upload = (file_id, ingested)
+    return ingested
+
+@fragment
 def show_detection_page():
     st.header("🔍 Deteksi Kanker Kulit")
 
@@ -271,91 +420,361 @@ def show_detection_page():
     input_method = st.radio("Pilih metode input gambar:", ["📁 Upload Gambar", "📸 Kamera Langsung"])
 
     uploaded_file = None
-    image_source = None
+    display_name = None
 
     if input_method == "📁 Upload Gambar":
         uploaded_file = st.file_uploader("Pilih gambar kulit untuk dianalisis", type=['jpg', 'jpeg', 'png'])
         if uploaded_file:
-            image_source = Image.open(uploaded_file)
+            display_name = uploaded_file.name
     else:
         camera_image = st.camera_input("Ambil gambar menggunakan webcam")
         if camera_image:
-            image_source = Image.open(camera_image)
             uploaded_file = camera_image
-            uploaded_file.name = f"webcam_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
+            display_name = f"webcam_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
 
-    if image_source:
+    # Upload di-decode sekali lalu dipakai bersama untuk tampilan, penyimpanan dan deteksi
+    ingested = get_ingested_upload(uploaded_file, display_name) if uploaded_file else None
+
+    if ingested:
         col1, col2 = st.columns(2)
         with col1:
             st.subheader("📷 Gambar Asli")
-            st.image(image_source, caption="Gambar yang dimasukkan", use_container_width=True)
+            st.image(ingested.image, caption="Gambar yang dimasukkan", use_container_width=True)
 
-        if st.button("🔬 Mulai Deteksi", type="primary"):
-            with st.spinner("Sedang menganalisis gambar..."):
-                try:
-                    temp_path = f"temp/{uploaded_file.name}"
-                    os.makedirs("temp", exist_ok=True)
-                    image_source.save(temp_path)  # Simpan gambar
-
-                    # Deteksi
-                    result_image, predictions = detector.detect(temp_path)
-
-                    # Simpan ke riwayat
-                    db_manager.save_detection_history(
-                        st.session_state.username,
-                        uploaded_file.name,
-                        temp_path,
-                        str(predictions)
-                    )
-
-                    with col2:
-                        st.subheader("🎯 Hasil Deteksi")
-                        st.image(result_image, caption="Hasil deteksi", use_container_width=True)
-
-                    st.subheader("📊 Hasil Analisis Detail")
-                    if predictions:
-                        for i, pred in enumerate(predictions):
-                            confidence = pred['confidence'] * 100
-                            class_name = pred['class']
-                            
-                            # Dapatkan informasi lengkap tentang jenis kanker
-                            cancer_info = get_cancer_type_info(class_name)
-                            
-                            if confidence > 50:
-                                st.markdown(f"""
-                                    <div class="warning-box">
-                                        <strong>🔍 Deteksi {i+1}:</strong><br>
-                                        <strong>Jenis:</strong> {class_name.upper()} ({cancer_info['full_name']})<br>
-                                        <strong>Deskripsi:</strong> {cancer_info['description']}<br>
-                                        <strong>Tingkat Keyakinan:</strong> {confidence:.2f}%<br>
-                                        <em>⚠️ Tingkat keyakinan tinggi - Sangat disarankan untuk konsultasi dengan dokter spesialis kulit segera!</em>
-                                    </div>
-                                """, unsafe_allow_html=True)
-                            else:
-                                st.markdown(f"""
-                                    <div class="info-box">
-                                        <strong>🔍 Deteksi {i+1}:</strong><br>
-                                        <strong>Jenis:</strong> {class_name.upper()} ({cancer_info['full_name']})<br>
-                                        <strong>Deskripsi:</strong> {cancer_info['description']}<br>
-                                        <strong>Tingkat Keyakinan:</strong> {confidence:.2f}%<br>
-                                        <em>ℹ️ Tingkat keyakinan rendah, namun tetap disarankan pemeriksaan rutin dengan dokter.</em>
-                                    </div>
-                                """, unsafe_allow_html=True)
-                        
-                    else:
-                        st.markdown("""
-                            <div class="success-box">
-                                <strong>✅ Hasil Deteksi:</strong><br>
-                                Tidak ada deteksi kanker kulit yang signifikan ditemukan pada gambar ini.<br>
-                                <em>Namun, tetap disarankan untuk melakukan pemeriksaan rutin dengan dokter spesialis kulit.</em>
-                            </div>
-                        """, unsafe_allow_html=True)
+        # Hasil untuk gambar yang sama langsung ditampilkan dari cache sesi,
+        # tanpa inferensi ulang dan tanpa menyimpan riwayat dua kali
+        cache_key = (ingested.content_hash, detector.model_version)
+        # Satu upload bisa dirender ulang berkali-kali (slider, fragment); hit dicatat sekali per upload
+        upload_key = (getattr(uploaded_file, "file_id", None) or display_name, cache_key)
+        timer = StageTimer()
+        with timer.stage("cache"):
+            result = get_cached_detection(cache_key)
+        if result is not None and st.session_state.get("detection_served_upload") != upload_key:
+            st.session_state.detection_served_upload = upload_key
+            log_activity(st.session_state.username, "detect", latency_ms=timer.elapsed_ms(),
+                         model_version=detector.model_version, cache_hit=True,
+                         image_hash=ingested.content_hash, detections=len(result["raw_predictions"]))
+
+        # Deteksi berjalan sebagai job background; halaman hanya memantau statusnya
+        submitted_jobs = st.session_state.setdefault("detection_job_ids", {})
+        job_id = submitted_jobs.get(cache_key)
+        if result is None and job_id is not None:
+            job = job_queue.get_job(job_id, st.session_state.username)
+            if job is None:
+                submitted_jobs.pop(cache_key, None)
+            elif job["status"] == JOB_DONE:
+                result = detection_result_from_job(job, ingested)
+                if result is not None:
+                    put_cached_detection(cache_key, result)
+                    # Deteksi ini sudah dicatat worker (cache_hit=False)
+                    st.session_state.detection_served_upload = upload_key
+                submitted_jobs.pop(cache_key, None)
+            elif job["status"] == JOB_FAILED:
+                st.error(f"❌ Terjadi kesalahan saat deteksi: {job['error']}")
+                submitted_jobs.pop(cache_key, None)
+            else:
+                watch_detection_job(job_id)
+
+        if result is None and cache_key not in submitted_jobs and st.button("🔬 Mulai Deteksi", type="primary"):
+            try:
+                submitted_jobs[cache_key] = submit_detection_job(ingested, display_name)
+            except Exception as e:
+                st.error(f"❌ Terjadi kesalahan saat deteksi: {str(e)}")
+            else:
+                rerun_fragment()
+
+        if result is not None:
+            # Ganti threshold cukup memfilter deteksi mentah dan menggambar ulang, model tidak dipanggil
+            threshold = st.slider("Ambang keyakinan (%)", int(CONFIDENCE_FLOOR * 100), 95,
+                                  int(DEFAULT_CONFIDENCE_THRESHOLD * 100), step=5) / 100
+            predictions = detector.filter_predictions(result["raw_predictions"], threshold)
+            with col2:
+                st.subheader("🎯 Hasil Deteksi")
+                st.image(detector.annotate(result["display_image"], predictions, scale=result["scale"]),
+                         caption="Hasil deteksi", use_container_width=True)
+            show_detection_details(predictions)
+            show_similar_lesions(result.get("similar", []))
+            st.success("✅ Deteksi selesai dan disimpan ke Riwayat!")
+
+def get_cached_detection(cache_key):
+    """Ambil hasil deteksi dari cache sesi (None jika belum ada)"""
+    cache = st.session_state.setdefault("detection_results", OrderedDict())
+    result = cache.get(cache_key)
+    if result is not None:
+        cache.move_to_end(cache_key)
+    return result
+
+def put_cached_detection(cache_key, result):
+    """Simpan hasil deteksi ke cache sesi, entri terlama dibuang jika penuh"""
+    cache = st.session_state.setdefault("detection_results", OrderedDict())
+    cache[cache_key] = result
+    while len(cache) > DETECTION_CACHE_SIZE:
+        cache.popitem(last=False)
+
+def submit_detection_job(ingested, display_name):
+    """
+    Simpan gambar lalu masukkan job deteksi ke antrian. Job tetap diproses
+    walaupun tab ditutup, dan hasilnya masuk ke Riwayat.
+    Returns: id job
+    """
+    timer = StageTimer()
+    # Simpan gambar ke store berbasis hash (upload identik berbagi satu file)
+    image_store = db_manager.image_store_for(st.session_state.username)
+    with timer.stage("store"):
+        image_hash, stored_path = image_store.put(
+            ingested.data, ingested.filename, image=ingested.image
+        )
+    try:
+        with timer.stage("enqueue"):
+            job_id = job_queue.submit(st.session_state.username, display_name, stored_path, image_hash=image_hash)
+    except BaseException:
+        image_store.release(image_hash)
+        raise
+    log_activity(st.session_state.username, "detect_submit", job_id=job_id, image_hash=image_hash)
+    trace_request(st.session_state.username, "detect_submit", timer=timer, image=image_info(ingested))
+    return job_id
+
+def detection_result_from_job(job, ingested):
+    """
+    Bentuk hasil deteksi untuk tampilan dari job yang sudah selesai.
+    Bbox prediksi disimpan dalam koordinat gambar asli; anotasi dilakukan
+    pada gambar ingest (<= WORKING_MAX_SIDE) yang masih ada di sesi.
+    Returns: dict hasil (display_image, scale, raw_predictions, image_hash, similar),
+             None jika riwayatnya sudah dihapus
+    """
+    if job["hasil_deteksi"] is None:
+        return None
+    display_image = np.asarray(ingested.image)
+    display_scale = min(1.0, DISPLAY_MAX_SIDE / max(display_image.shape[:2]))
+    if display_scale < 1.0:
+        display_image = cv2.resize(display_image, None, fx=display_scale, fy=display_scale,
+                                   interpolation=cv2.INTER_AREA)
+    return {"display_image": display_image, "scale": ingested.scale * display_scale,
+            "raw_predictions": parse_predictions(job["hasil_deteksi"]), "image_hash": job["image_hash"],
+            "similar": job["result"].get("similar", [])}
+
+@polling_fragment
+def watch_detection_job(job_id):
+    """Progress satu job deteksi; halaman di-rerun penuh begitu job selesai"""
+    job = job_queue.get_job(job_id, st.session_state.username)
+    if job is None or job["status"] not in ACTIVE_STATUSES:
+        st.rerun()
+    show_job_progress(job)
+    st.caption("Deteksi berjalan di background. Anda boleh menutup halaman ini; "
+               "hasilnya akan tersimpan di menu Riwayat.")
+
+def show_job_progress(job):
+    """Progress bar dan status satu job antrian"""
+    if job["status"] == JOB_FAILED:
+        st.error(f"❌ {job['filename']}: gagal setelah {job['attempts']} percobaan - {job['error']}")
+        return
+    if job["status"] == JOB_QUEUED and job["attempts"] == 0:
+        position = job_queue.queue_position(job["id"])
+        text = f"⏳ {job['filename']}: menunggu di antrian (posisi ke-{position + 1})"
+    else:
+        text = f"🔬 {job['filename']}: {job['stage'] or 'diproses'}"
+    st.progress(min(max(job["progress"], 0.0), 1.0), text=text)
+    if job["error"]:
+        st.caption(f"Percobaan sebelumnya gagal: {job['error']}")
+
+def show_similar_lesions(similar):
+    """
+    Tampilkan foto lama yang tampak serupa, urut dari yang paling mirip.
+    Skor kemiripan tidak dikalibrasi, jadi tidak ditampilkan sebagai persen
+    dan foto tidak disebut sebagai lesi yang sama
+    """
+    if not similar:
+        return
+    # Foto yang riwayatnya sudah dihapus tidak ditampilkan
+    records = db_manager.get_history_by_image_hashes(st.session_state.username,
+                                                     [item["image_hash"] for item in similar])
+    matches = [(item, records[item["image_hash"]]) for item in similar if item["image_hash"] in records]
+    if not matches:
+        return
+
+    st.subheader("🕰️ Foto Lama dengan Tampilan Serupa")
+    st.caption("Dipilih otomatis dari kemiripan warna dan bentuk, urut dari yang paling mirip. "
+               "Foto ini belum tentu lesi yang sama; jika memang lesi yang sama, bandingkan untuk "
+               "melihat perubahan (E - Evolving). Perubahan ukuran, bentuk atau warna sebaiknya "
+               "diperiksakan ke dokter.")
+    columns = st.columns(len(matches))
+    for rank, (column, (item, (_, filename, filepath, tanggal))) in enumerate(zip(columns, matches), start=1):
+        with column:
+            if os.path.exists(filepath):
+                st.image(get_variant(filepath, "preview"), use_container_width=True)
+            try:
+                tanggal = datetime.datetime.strptime(tanggal, "%Y-%m-%d %H:%M:%S").strftime("%d-%m-%Y")
+            except (TypeError, ValueError):
+                pass
+            st.write(f"📅 {tanggal}")
+            st.write(f"Urutan kemiripan: #{rank}")
+            st.caption(filename)
+
+def abcde_summary(pred):
+    """Ringkasan fitur ABCDE satu prediksi (HTML), string kosong untuk riwayat lama tanpa fitur"""
+    features = pred.get('abcde')
+    if not features:
+        return ""
+    asymmetry = max(features['asymmetry_major'], features['asymmetry_minor'])
+    return (f"<strong>ABCDE:</strong> Asimetri {asymmetry:.2f} · Border {features['border_irregularity']:.2f} · "
+            f"{features['color_count']} warna (variansi {features['color_variance']:.0f}) · "
+            f"Diameter {features['diameter_px']:.0f} px<br>")
 
-                    st.success("✅ Deteksi selesai dan disimpan ke Riwayat!")
+def show_detection_details(predictions):
+    st.subheader("📊 Hasil Analisis Detail")
+    if predictions:
+        for i, pred in enumerate(predictions):
+            confidence = pred['confidence'] * 100
+            class_name = pred['class']
+            
+            # Dapatkan informasi lengkap tentang jenis kanker
+            cancer_info = get_cancer_type_info(class_name)
+            
+            if confidence > 50:
+                st.markdown(f"""
+                    <div class="warning-box">
+                        <strong>🔍 Deteksi {i+1}:</strong><br>
+                        <strong>Jenis:</strong> {class_name.upper()} ({cancer_info['full_name']})<br>
+                        <strong>Deskripsi:</strong> {cancer_info['description']}<br>
+                        <strong>Tingkat Keyakinan:</strong> {confidence:.2f}%<br>{abcde_summary(pred)}
+                        <em>⚠️ Tingkat keyakinan tinggi - Sangat disarankan untuk konsultasi dengan dokter spesialis kulit segera!</em>
+                    </div>
+                """, unsafe_allow_html=True)
+            else:
+                st.markdown(f"""
+                    <div class="info-box">
+                        <strong>🔍 Deteksi {i+1}:</strong><br>
+                        <strong>Jenis:</strong> {class_name.upper()} ({cancer_info['full_name']})<br>
+                        <strong>Deskripsi:</strong> {cancer_info['description']}<br>
+                        <strong>Tingkat Keyakinan:</strong> {confidence:.2f}%<br>{abcde_summary(pred)}
+                        <em>ℹ️ Tingkat keyakinan rendah, namun tetap disarankan pemeriksaan rutin dengan dokter.</em>
+                    </div>
+                """, unsafe_allow_html=True)
+        
+    else:
+        st.markdown("""
+            <div class="success-box">
+                <strong>✅ Hasil Deteksi:</strong><br>
+                Tidak ada deteksi kanker kulit yang signifikan ditemukan pada gambar ini.<br>
+                <em>Namun, tetap disarankan untuk melakukan pemeriksaan rutin dengan dokter spesialis kulit.</em>
+            </div>
+        """, unsafe_allow_html=True)
+
+def show_history_export(threshold):
+    """Ekspor seluruh riwayat user ke ZIP (CSV, JSONL dan gambar), prediksi di bawah threshold tidak ikut"""
+    with st.expander("📦 Ekspor Riwayat"):
+        st.write("Unduh seluruh riwayat deteksi dalam format CSV/JSON beserta gambarnya.")
+
+        if st.button("📦 Siapkan File Ekspor"):
+            with st.spinner("Sedang menyiapkan file ekspor..."):
+                # Ekspor sebelumnya di sesi ini tidak dipakai lagi; sisanya dibersihkan DiskJanitor (temp/)
+                previous_path = st.session_state.pop("export_path", None)
+                if previous_path and os.path.exists(previous_path):
+                    os.remove(previous_path)
+                # Arsip ditulis langsung ke disk secara streaming, bukan dirangkai di memori
+                export_path = os.path.join("temp", f"export_{uuid.uuid4().hex}.zip")
+                timer = StageTimer()
+                with timer.stage("export"):
+                    records = export_history_zip(db_manager, st.session_state.username, export_path,
+                                                 threshold=threshold)
+                log_activity(st.session_state.username, "export", records=records,
+                             latency_ms=timer.elapsed_ms())
+                trace_request(st.session_state.username, "export", timer=timer, records=records)
+                st.session_state.export_path = export_path
+
+        export_path = st.session_state.get("export_path")
+        if export_path and os.path.exists(export_path):
+            # File baru dibuka saat tombol diklik, bukan di setiap rerun (data callable
+            # butuh Streamlit >= 1.52)
+            st.download_button(
+                "⬇️ Unduh Ekspor (ZIP)",
+                export_reader(export_path),
+                file_name=f"riwayat_{st.session_state.username}.zip",
+                mime="application/zip"
+            )
+
+def export_reader(export_path):
+    """
+    Data unduhan ekspor: file handle dibuka saat tombol diklik dan dibaca oleh
+    Streamlit, bisa diklik berkali-kali. File tidak dihapus di sini; ekspor
+    lama di temp/ dibersihkan DiskJanitor
+    """
+    def open_export():
+        return open(export_path, "rb")
+    return open_export
 
-                except Exception as e:
-                    st.error(f"❌ Terjadi kesalahan saat deteksi: {str(e)}")
+def show_history_filters():
+    """
+    Kontrol filter riwayat (jenis lesi, rentang keyakinan, rentang tanggal)
+    dan ambang keyakinan tampilan
+    Returns: tuple (dict argumen untuk db_manager.search_detection_history, threshold)
+    """
+    with st.expander("🔎 Filter Riwayat"):
+        classes = st.multiselect(
+            "Jenis lesi",
+            list(SKIN_CANCER_TYPES.keys()),
+            format_func=lambda key: f"{key.upper()} - {SKIN_CANCER_TYPES[key]['full_name']}"
+        )
+        confidence_range = st.slider("Rentang keyakinan (%)", 0, 100, (0, 100))
+        date_range = st.date_input("Rentang tanggal", value=())
+        # Riwayat menyimpan deteksi mentah; threshold hanya memfilter tampilan
+        threshold = st.slider("Ambang keyakinan tampilan (%)", int(CONFIDENCE_FLOOR * 100), 95,
+                              int(DEFAULT_CONFIDENCE_THRESHOLD * 100), step=5) / 100
 
+    date_from = date_to = None
+    if isinstance(date_range, (list, tuple)) and len(date_range) == 2:
+        date_from, date_to = date_range
+
+    min_confidence = confidence_range[0] / 100 if confidence_range[0] > 0 else None
+    max_confidence = confidence_range[1] / 100 if confidence_range[1] < 100 else None
+    if classes or min_confidence is not None or max_confidence is not None:
+        # Filter prediksi tidak boleh cocok dengan deteksi yang disembunyikan threshold
+        min_confidence = max(min_confidence or 0, threshold)
+
+    return {
+        "classes": classes or None,
+        "min_confidence": min_confidence,
+        "max_confidence": max_confidence,
+        "date_from": date_from,
+        "date_to": date_to,
+    }, threshold
+
+def show_detection_jobs():
+    """Job deteksi milik user yang masih berjalan atau gagal, di atas daftar riwayat"""
+    username = st.session_state.username
+    jobs = job_queue.user_jobs(username)
+    if not jobs:
+        return
+
+    st.subheader("⏳ Deteksi dalam Proses")
+    active_ids = tuple(job["id"] for job in jobs if job["status"] in ACTIVE_STATUSES)
+    if active_ids:
+        watch_history_jobs(active_ids)
+
+    for job in jobs:
+        if job["status"] != JOB_FAILED:
+            continue
+        show_job_progress(job)
+        col1, col2, _ = st.columns([1, 1, 3])
+        with col1:
+            if st.button("🔁 Coba Lagi", key=f"retry_job_{job['id']}"):
+                job_queue.retry(job["id"], username)
+                rerun_fragment()
+        with col2:
+            if st.button("✖️ Tutup", key=f"dismiss_job_{job['id']}"):
+                job_queue.dismiss(job["id"], username)
+                rerun_fragment()
+
+@polling_fragment
+def watch_history_jobs(job_ids):
+    """Progress job yang sedang berjalan; riwayat dimuat ulang begitu salah satunya selesai"""
+    jobs = [job_queue.get_job(job_id, st.session_state.username) for job_id in job_ids]
+    if any(job is None or job["status"] not in ACTIVE_STATUSES for job in jobs):
+        st.rerun()
+    for job in jobs:
+        show_job_progress(job)
+
+@fragment
 def show_history_page():
     st.header("📈 Riwayat Deteksi")
     
@@ -363,10 +782,39 @@ def show_history_page():
 
     if "delete_history_id" not in st.session_state:
         st.session_state.delete_history_id = None
+    if "history_page_cursors" not in st.session_state:
+        st.session_state.history_page_cursors = [None]
+
+    show_detection_jobs()
+    filters, threshold = show_history_filters()
+
+    # Filter berubah -> kembali ke halaman pertama
+    if st.session_state.get("history_filters") != filters:
+        st.session_state.history_filters = filters
+        st.session_state.history_page_cursors = [None]
+
+    timer = StageTimer()
+    with timer.stage("query"):
+        history, next_cursor = db_manager.search_detection_history(
+            st.session_state.username,
+            cursor=st.session_state.history_page_cursors[-1],
+            limit=HISTORY_PAGE_SIZE,
+            **filters
+        )
+    # Hanya nama filter yang aktif dicatat, nilainya tidak
+    trace_request(st.session_state.username, "history", timer=timer, rows=len(history), limit=HISTORY_PAGE_SIZE,
+                  page=len(st.session_state.history_page_cursors),
+                  filters=sorted(key for key, value in filters.items() if value is not None))
+
+    # Halaman selain halaman pertama kosong (misalnya record terakhirnya baru dihapus):
+    # mundur satu halaman supaya user tidak tertahan tanpa tombol navigasi
+    if not history and len(st.session_state.history_page_cursors) > 1:
+        st.session_state.history_page_cursors.pop()
+        rerun_fragment()
 
-    history = db_manager.get_detection_history(st.session_state.username)
-    
     if history:
+        show_history_export(threshold)
+
         for record in history:
             try:
                 utc_dt = dt.strptime(record[4], "%Y-%m-%d %H:%M:%S")
@@ -384,19 +832,20 @@ def show_history_page():
                 col1, col2 = st.columns([2, 1])
                 with col1:
                     if os.path.exists(record[3]):
-                        st.image(record[3], caption="Gambar yang dideteksi", width=300)
+                        # Tampilkan varian preview yang kecil, bukan file asli
+                        st.image(get_variant(record[3], "preview"), caption="Gambar yang dideteksi", width=300)
                     else:
                         st.write("🖼️ Gambar tidak tersedia")
                     
                     # Tombol hapus
                     if st.button("🗑️ Hapus Riwayat Ini", key=f"delete_{record[0]}"):
                         st.session_state.delete_history_id = record[0]
-                        st.rerun()
+                        rerun_fragment()
                 
                 with col2:
                     st.write("**📊 Hasil Deteksi Detail:**")
                     try:
-                        predictions = eval(record[5]) if record[5] != 'None' else []
+                        predictions = detector.filter_predictions(parse_predictions(record[5]), threshold)
                         if predictions:
                             for i, pred in enumerate(predictions):
                                 cancer_info = get_cancer_type_info(pred['class'])
@@ -406,30 +855,46 @@ def show_history_page():
                                     <div class="cancer-type-box">
                                         <strong>{pred['class'].upper()}</strong><br>
                                         <small>{cancer_info['full_name']}</small><br>
-                                        <strong>Keyakinan:</strong> {confidence:.2f}%
+                                        <strong>Keyakinan:</strong> {confidence:.2f}%<br><small>{abcde_summary(pred)}</small>
                                     </div>
                                 """, unsafe_allow_html=True)
                         else:
                             st.write("✅ Tidak ada deteksi kanker kulit")
                     except:
                         st.write("❌ Data tidak valid")
-        
+
+        # Navigasi halaman
+        nav_col1, nav_col2, nav_col3 = st.columns([1, 2, 1])
+        with nav_col1:
+            if len(st.session_state.history_page_cursors) > 1 and st.button("⬅️ Sebelumnya"):
+                st.session_state.history_page_cursors.pop()
+                rerun_fragment()
+        with nav_col2:
+            st.caption(f"Halaman {len(st.session_state.history_page_cursors)}")
+        with nav_col3:
+            if next_cursor is not None and st.button("Berikutnya ➡️"):
+                st.session_state.history_page_cursors.append(next_cursor)
+                rerun_fragment()
+
         # Handle penghapusan riwayat
         if st.session_state.delete_history_id:
-            deleted = db_manager.delete_detection_history(st.session_state.delete_history_id)
+            deleted = db_manager.delete_detection_history(st.session_state.delete_history_id,
+                                                      st.session_state.username)
             if deleted:
                 st.success("✅ Riwayat berhasil dihapus!")
             else:
                 st.error("❌ Gagal menghapus riwayat.")
             st.session_state.delete_history_id = None
-            st.rerun()
+            rerun_fragment()
+    elif any(value is not None for value in filters.values()):
+        st.info("🔎 Tidak ada riwayat yang cocok dengan filter.")
     else:
         st.info("📁 Belum ada riwayat deteksi. Silakan lakukan deteksi terlebih dahulu.")
 
 def show_account_info_page():
     st.header("👤 Informasi Akun")
     
-    user_info = db_manager.get_user_info(st.session_state.username)
+    user_info = auth_manager.get_user_info(st.session_state.username)
     
     if user_info:
         # Format tanggal pembuatan akun tanpa jam
@@ -454,7 +919,7 @@ def show_account_info_page():
         </div>
         """, unsafe_allow_html=True)
         
-        history_count = len(db_manager.get_detection_history(st.session_state.username))
+        history_count = db_manager.count_detection_history(st.session_state.username)
         st.markdown(f"""
         <div class="success-box">
             <strong>📊 Statistik Penggunaan:</strong><br>
@@ -462,6 +927,71 @@ def show_account_info_page():
         </div>
         """, unsafe_allow_html=True)
 
+def show_diagnostics_page():
+    """Halaman admin: kemampuan host, micro-benchmark dan rekomendasi pengaturan"""
+    st.header("🛠️ Diagnostik Sistem")
+
+    capabilities = probe_capabilities(detector.model_path)
+    col1, col2, col3 = st.columns(3)
+    col1.metric("CPU", capabilities["cpu_count"])
+    col2.metric("Memori", format_file_size(capabilities["memory_bytes"]) if capabilities["memory_bytes"] else "?")
+    col3.metric("Model", "Tersedia" if capabilities["model_available"] else "Tidak ada")
+
+    st.subheader("📦 Paket")
+    st.table([
+        {"Modul": module, "Status": (info["version"] or "terpasang") if info["installed"] else "❌ tidak ada"}
+        for module, info in capabilities["packages"].items()
+    ])
+
+    st.subheader("🚦 Antrian Deteksi")
+    st.table([{"Status": key, "Nilai": str(value)} for key, value in admission.snapshot().items()])
+
+    st.subheader("🗂️ Job Deteksi")
+    st.table([{"Status": key, "Nilai": str(value)} for key, value in job_queue.stats().items()])
+
+    if hasattr(db_manager, "tenant_stats"):
+        st.subheader("🏥 Tenant")
+        st.table([{
+            "Tenant": row["tenant"], "User": row["users"], "Riwayat": row.get("history", "-"),
+            "Gambar": row.get("images", "-"), "Ukuran gambar": format_file_size(row.get("image_bytes", 0)),
+            "Ukuran database": format_file_size(row.get("db_bytes", 0)),
+        } for row in db_manager.tenant_stats()])
+
+    if isinstance(detector, RemoteSkinCancerDetector):
+        st.subheader("🖧 Worker Inferensi")
+        st.table(detector.endpoint_status())
+
+    if st.button("⏱️ Jalankan Benchmark", type="primary"):
+        # Proses terpisah: setelan thread torch benchmark tidak boleh memengaruhi inferensi user
+        with st.spinner("Menjalankan benchmark singkat..."):
+            try:
+                st.session_state.diagnostics_report = run_diagnostics_subprocess(detector.model_path, quick=True)
+            except Exception as e:
+                st.error(f"❌ Benchmark gagal: {e}")
+
+    report = st.session_state.get("diagnostics_report")
+    if report:
+        inference = report["inference"]
+        st.subheader(f"🧠 Inferensi CPU ({inference['source'] or 'dilewati'})")
+        if inference["results"]:
+            st.table(inference["results"])
+
+        st.subheader("💾 SQLite & Disk")
+        sqlite_result = report["sqlite"]
+        st.write(f"Commit p50 {sqlite_result['p50_ms']} ms, p99 {sqlite_result['p99_ms']} ms "
+                 f"({sqlite_result['commits_per_sec']} commit/detik)")
+        for directory, speed in report["disk_mb_per_sec"].items():
+            st.write(f"Tulis {directory}/: {speed} MB/detik")
+
+        st.subheader("✅ Rekomendasi Pengaturan")
+        recommendation = report["recommendation"]
+        st.table([
+            {"Variabel environment": name, "Nilai": str(value)}
+            for name, value in recommendation["env"].items()
+        ])
+        for note in recommendation["notes"]:
+            st.caption(note)
+
 def show_education_page():
     st.header("📚 Edukasi Kanker Kulit")
     
@@ -522,6 +1052,11 @@ def show_education_page():
         - **D**iameter: Diameter lebih dari 6mm
         - **E**volving: Perubahan ukuran, bentuk, atau warna
         
+        Setiap hasil deteksi menampilkan ukuran ABCDE yang dihitung dari gambar:
+        asimetri (0 = simetris), border (1 = bulat rata, makin besar makin tidak rata),
+        jumlah warna dan variansinya, serta diameter dalam piksel foto (bukan mm,
+        karena jarak kamera tidak diketahui). Angka ini hanya pendukung, bukan diagnosis.
+        
         **Gejala Lain:**
         - Luka yang tidak sembuh
         - Benjolan yang tumbuh
@@ -0,0 +1,217 @@
+import argparse
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SCRYPT_PREFIX = "scrypt"
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+
+class HasherBusy(Exception):
+    """Antrian hashing penuh, login harus dicoba lagi"""
+
+
+class PasswordHasher:
+    """
+    Hashing password dengan scrypt yang biayanya dikalibrasi otomatis.
+    Saat inisialisasi parameter N dicari sehingga satu hash memakan kira-kira
+    target_ms di mesin ini. Hash dijalankan di worker pool terbatas (hashlib.scrypt
+    melepas GIL) dan jumlah permintaan yang menunggu dibatasi, sehingga lonjakan
+    login tidak menghabiskan CPU untuk deteksi.
+    Format hash: scrypt$N$r$p$salt$hash (salt dan hash dalam base64)
+    """
+
+    def __init__(self, target_ms=100, max_workers=None, max_pending=32, wait_timeout=10.0,
+                 r=8, p=1, min_log_n=14, max_log_n=17):
+        """
+        Args:
+            target_ms: Target waktu satu hash (milidetik)
+            max_workers: Jumlah thread hashing, default setengah jumlah CPU
+            max_pending: Jumlah maksimal hash yang berjalan + menunggu
+            wait_timeout: Waktu tunggu (detik) untuk slot antrian sebelum HasherBusy
+            r, p: Parameter blok dan paralelisme scrypt
+            min_log_n, max_log_n: Batas log2(N) saat kalibrasi
+        """
+        self.target_ms = target_ms
+        self.r = r
+        self.p = p
+        self.min_log_n = min_log_n
+        self.max_log_n = max_log_n
+        self.wait_timeout = wait_timeout
+
+        workers = max_workers or max(1, (os.cpu_count() or 2) // 2)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hasher")
+        self._slots = threading.BoundedSemaphore(max_pending)
+
+        self.n = 2 ** min_log_n
+        self.calibrate()
+
+    # ------------------------------------------------------------------
+    # Kalibrasi
+    # ------------------------------------------------------------------
+
+    def _scrypt(self, password, salt, n, r, p):
+        return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * r * n + 1024 * 1024, dklen=KEY_BYTES)
+
+    def calibrate(self):
+        """
+        Cari N terbesar (pangkat 2) yang waktunya masih di bawah target
+        Returns: N yang dipakai
+        """
+        salt = os.urandom(SALT_BYTES)
+        log_n = self.min_log_n
+        while log_n < self.max_log_n:
+            start = time.perf_counter()
+            self._scrypt(b"kalibrasi", salt, 2 ** log_n, self.r, self.p)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            # Biaya scrypt linear terhadap N, N berikutnya kira-kira 2x lebih lama
+            if elapsed_ms * 2 > self.target_ms:
+                break
+            log_n += 1
+
+        self.n = 2 ** log_n
+        print(f"Kalibrasi scrypt: N=2^{log_n}, r={self.r}, p={self.p}")
+        return self.n
+
+    # ------------------------------------------------------------------
+    # Hash dan verifikasi (sinkron, dijalankan di worker pool)
+    # ------------------------------------------------------------------
+
+    def _hash_sync(self, password):
+        salt = os.urandom(SALT_BYTES)
+        key = self._scrypt(password.encode(), salt, self.n, self.r, self.p)
+        return "$".join([
+            SCRYPT_PREFIX, str(self.n), str(self.r), str(self.p),
+            base64.b64encode(salt).decode(), base64.b64encode(key).decode(),
+        ])
+
+    def _verify_sync(self, password, stored_hash):
+        """Returns: (cocok, perlu di-hash ulang)"""
+        if is_legacy_hash(stored_hash):
+            legacy = hashlib.sha256(password.encode()).hexdigest()
+            return hmac.compare_digest(legacy, stored_hash), True
+
+        try:
+            prefix, n, r, p, salt, key = stored_hash.split("$")
+            n, r, p = int(n), int(r), int(p)
+            if prefix != SCRYPT_PREFIX:
+                return False, False
+            salt = base64.b64decode(salt)
+            key = base64.b64decode(key)
+        except (ValueError, TypeError):
+            return False, False
+
+        candidate = self._scrypt(password.encode(), salt, n, r, p)
+        ok = hmac.compare_digest(candidate, key)
+        # Hanya naik: hash yang lebih kuat dari kalibrasi saat ini tidak diturunkan
+        needs_rehash = n < self.n or r < self.r or p < self.p
+        return ok, needs_rehash
+
+    def _run(self, fn, *args):
+        """Jalankan fungsi di worker pool dengan batas antrian"""
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise HasherBusy("Server sedang sibuk memproses login, silakan coba lagi")
+        try:
+            return self._pool.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        """Hash password baru dengan parameter hasil kalibrasi"""
+        return self._run(self._hash_sync, password)
+
+    def hash_many(self, passwords):
+        """
+        Hash banyak password sekaligus (provisioning massal).
+        Semua password dikirim ke worker pool secara paralel, tetapi tetap
+        memakai slot antrian yang sama sehingga login tidak tertahan terlalu lama.
+        Returns: list hash dengan urutan yang sama dengan passwords
+        """
+        futures = []
+        try:
+            for password in passwords:
+                if not self._slots.acquire(timeout=self.wait_timeout):
+                    raise HasherBusy("Server sedang sibuk memproses login, silakan coba lagi")
+                future = self._pool.submit(self._hash_sync, password)
+                future.add_done_callback(lambda _: self._slots.release())
+                futures.append(future)
+            return [future.result() for future in futures]
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    def verify(self, password, stored_hash):
+        """
+        Verifikasi password terhadap hash tersimpan (scrypt atau SHA-256 lama)
+        Returns:
+            tuple: (cocok, perlu di-hash ulang)
+        """
+        return self._run(self._verify_sync, password, stored_hash)
+
+    def dummy_verify(self, password):
+        """Verifikasi palsu agar username yang tidak ada butuh waktu yang sama"""
+        self._run(self._scrypt, password.encode(), b"\0" * SALT_BYTES, self.n, self.r, self.p)
+
+
+def is_legacy_hash(stored_hash):
+    """Hash lama berupa SHA-256 tanpa salt (64 karakter hex)"""
+    return len(stored_hash) == 64 and all(c in "0123456789abcdef" for c in stored_hash)
+
+
+def benchmark_logins(users=32, concurrency_levels=(1, 2, 4, 8, 16), target_ms=100):
+    """
+    Ukur throughput login (AuthManager.login) pada beberapa tingkat konkurensi
+    memakai database sementara
+    """
+    import statistics
+    import tempfile
+    from database import DatabaseManager
+    from auth import AuthManager
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_manager = DatabaseManager(os.path.join(tmp, "bench.db"), write_behind=False)
+        auth_manager = AuthManager(db_manager, PasswordHasher(target_ms=target_ms))
+        for i in range(users):
+            auth_manager.register(f"User {i}", f"user{i}", "password123")
+
+        print(f"{'konkurensi':>10} {'login/detik':>12} {'p50 (ms)':>10} {'p99 (ms)':>10}")
+        for concurrency in concurrency_levels:
+            latencies = []
+            lock = threading.Lock()
+
+            def worker(index):
+                for attempt in range(users // concurrency or 1):
+                    start = time.perf_counter()
+                    auth_manager.login(f"user{(index + attempt) % users}", "password123")
+                    with lock:
+                        latencies.append((time.perf_counter() - start) * 1000)
+
+            start = time.perf_counter()
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            latencies.sort()
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+            print(f"{concurrency:>10} {len(latencies) / elapsed:>12.1f} "
+                  f"{statistics.median(latencies):>10.1f} {p99:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Kalibrasi dan benchmark hashing password")
+    parser.add_argument("--target-ms", type=int, default=100, help="Target waktu satu hash (ms)")
+    parser.add_argument("--users", type=int, default=32, help="Jumlah user untuk benchmark")
+    parser.add_argument("--concurrency", default="1,2,4,8,16", help="Tingkat konkurensi, dipisah koma")
+    args = parser.parse_args()
+
+    benchmark_logins(args.users, [int(c) for c in args.concurrency.split(",")], args.target_ms)
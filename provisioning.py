@@ -0,0 +1,104 @@
+import argparse
+import csv
+import os
+import time
+
+from password_hashing import PasswordHasher
+
+
+def read_users_csv(path):
+    """
+    Baca CSV user dengan kolom nama_lengkap, username, password
+    Returns: list tuple (nomor baris, nama_lengkap, username, password)
+    """
+    rows = []
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        missing = {"nama_lengkap", "username", "password"} - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"Kolom CSV tidak lengkap, tidak ada: {', '.join(sorted(missing))}")
+
+        for line_number, row in enumerate(reader, start=2):
+            rows.append((line_number, row["nama_lengkap"].strip(), row["username"].strip(), row["password"]))
+    return rows
+
+
+def bulk_provision(db_manager, rows, hasher=None, chunk_size=500, min_password_length=6):
+    """
+    Buat banyak user sekaligus.
+    Password di-hash paralel di worker pool PasswordHasher, lalu user disimpan
+    lewat DatabaseManager.create_users_bulk dengan executemany per chunk.
+    Username duplikat (sudah ada di database atau muncul dua kali di CSV)
+    dilaporkan tanpa membatalkan user lain; user di chunk yang transaksinya
+    gagal dilaporkan di "failed".
+    Args:
+        db_manager: DatabaseManager tujuan
+        rows: list tuple (nomor baris, nama_lengkap, username, password)
+        hasher: PasswordHasher, dibuat otomatis jika None
+        chunk_size: Jumlah user per transaksi
+        min_password_length: Panjang password minimal (sama dengan form register)
+    Returns:
+        dict: {"created": [...], "duplicates": [...], "invalid": [(baris, alasan), ...], "failed": [...]}
+    """
+    hasher = hasher or PasswordHasher()
+    report = {"created": [], "duplicates": [], "invalid": [], "failed": []}
+
+    # Validasi dan buang duplikat di dalam file sebelum hashing yang mahal
+    seen = set()
+    valid_rows = []
+    for line_number, nama_lengkap, username, password in rows:
+        if not nama_lengkap or not username or not password:
+            report["invalid"].append((line_number, "kolom kosong"))
+        elif len(password) < min_password_length:
+            report["invalid"].append((line_number, f"password kurang dari {min_password_length} karakter"))
+        elif username in seen:
+            report["duplicates"].append(username)
+        else:
+            seen.add(username)
+            valid_rows.append((nama_lengkap, username, password))
+
+    for start in range(0, len(valid_rows), chunk_size):
+        chunk = valid_rows[start:start + chunk_size]
+
+        # Lewati hashing untuk username yang sudah ada
+        existing = db_manager.existing_usernames([username for _, username, _ in chunk])
+        report["duplicates"].extend(username for _, username, _ in chunk if username in existing)
+        chunk = [row for row in chunk if row[1] not in existing]
+
+        hashed = hasher.hash_many([password for _, _, password in chunk])
+        created, duplicates, failed = db_manager.create_users_bulk(
+            [(nama_lengkap, username, hashed_password)
+             for (nama_lengkap, username, _), hashed_password in zip(chunk, hashed)]
+        )
+        report["created"].extend(created)
+        report["duplicates"].extend(duplicates)
+        report["failed"].extend(failed)
+
+    return report
+
+
+if __name__ == "__main__":
+    from sharding import open_database
+
+    parser = argparse.ArgumentParser(description="Provisioning user massal dari file CSV")
+    parser.add_argument("csv_path", help="File CSV dengan kolom nama_lengkap,username,password")
+    parser.add_argument("--db", default="skin_cancer_app.db", help="Path database SQLite")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Jumlah user per transaksi")
+    parser.add_argument("--workers", type=int, default=None, help="Jumlah thread hashing (default semua CPU)")
+    args = parser.parse_args()
+
+    db_manager = open_database(args.db, write_behind=False)
+    hasher = PasswordHasher(max_workers=args.workers or os.cpu_count(), max_pending=1024)
+
+    start = time.perf_counter()
+    report = bulk_provision(db_manager, read_users_csv(args.csv_path), hasher, args.chunk_size)
+    elapsed = time.perf_counter() - start
+
+    for username in report["duplicates"]:
+        print(f"Duplikat, dilewati: {username}")
+    for line_number, reason in report["invalid"]:
+        print(f"Baris {line_number} tidak valid: {reason}")
+    for username in report["failed"]:
+        print(f"Gagal disimpan: {username}")
+    print(f"{len(report['created'])} user dibuat, {len(report['duplicates'])} duplikat, "
+          f"{len(report['invalid'])} tidak valid, {len(report['failed'])} gagal dalam {elapsed:.1f} detik")
@@ -0,0 +1,296 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from detection import SkinCancerDetector
+from inference_worker import (connect, send_frame, recv_frame, ProtocolError,
+                              MSG_DETECT, MSG_HEALTH, MSG_RESULT)
+
+
+class WorkerUnavailable(Exception):
+    """Tidak ada worker inferensi yang bisa melayani permintaan"""
+
+
+class _Endpoint:
+    """Status satu worker di sisi client: pool koneksi dan beban terakhir"""
+
+    def __init__(self, address):
+        self.address = address
+        self.idle = []
+        self.inflight = 0  # permintaan dari client ini yang sedang berjalan
+        self.remote_inflight = 0  # dilaporkan worker (termasuk dari replika lain)
+        self.healthy = True
+        self.failures = 0
+        self.retry_at = 0.0
+        self.model_version = None
+        self.served = 0
+        self.last_error = None
+
+    def load(self):
+        return self.inflight + self.remote_inflight
+
+
+class RemoteSkinCancerDetector(SkinCancerDetector):
+    """
+    Detector dengan antarmuka sama seperti SkinCancerDetector (detect,
+    detect_raw, filter_predictions, annotate), tetapi inferensi dijalankan
+    di worker remote (inference_worker.py) lewat TCP atau Unix socket.
+    - Koneksi per worker disimpan di pool dan dipakai ulang.
+    - Setiap permintaan dikirim ke worker sehat dengan beban terendah
+      (permintaan yang sedang berjalan dari client ini + inflight yang
+      dilaporkan worker pada respons/health check terakhir).
+    - Jika worker gagal (koneksi putus, timeout, sibuk), permintaan dipindah
+      ke worker berikutnya; worker yang gagal ditandai tidak sehat dan dicoba
+      lagi oleh health check dengan backoff.
+    Gambar dikirim sebagai piksel RGB mentah dan anotasi tetap dilakukan di
+    sisi client, jadi hanya daftar prediksi yang dikirim balik.
+    """
+
+    def __init__(self, addresses, pool_size=4, connect_timeout=3.0, request_timeout=60.0,
+                 health_interval=5.0, max_backoff=60.0, secret=None):
+        """
+        Args:
+            addresses: List alamat worker ("tcp://host:port" / "unix:///path")
+            pool_size: Koneksi idle maksimal per worker
+            connect_timeout: Batas waktu membuka koneksi (detik)
+            request_timeout: Batas waktu satu inferensi (detik)
+            health_interval: Jarak antar health check (detik)
+            max_backoff: Jeda maksimal sebelum worker yang gagal dicoba lagi
+            secret: Shared secret worker, default dari env INFERENCE_SECRET
+        """
+        if not addresses:
+            raise ValueError("Minimal satu alamat worker inferensi")
+        # Tidak memanggil SkinCancerDetector.__init__: model tidak dimuat di proses ini
+        self.model_path = "best.pt"
+        self.model = None
+        self.model_version = None
+
+        self.endpoints = [_Endpoint(address) for address in addresses]
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.health_interval = health_interval
+        self.max_backoff = max_backoff
+        self.secret = secret or os.environ.get("INFERENCE_SECRET")
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.check_health()
+        self._health_thread = threading.Thread(target=self._health_loop, name="inference-health", daemon=True)
+        self._health_thread.start()
+
+    # ------------------------------------------------------------------
+    # Pool koneksi
+    # ------------------------------------------------------------------
+
+    def _acquire(self, endpoint):
+        """Returns: tuple (socket, dipakai ulang dari pool?)"""
+        with self._lock:
+            if endpoint.idle:
+                return endpoint.idle.pop(), True
+        return connect(endpoint.address, self.connect_timeout, self.secret), False
+
+    def _release(self, endpoint, sock):
+        with self._lock:
+            if len(endpoint.idle) < self.pool_size and not self._stop_event.is_set():
+                endpoint.idle.append(sock)
+                return
+        sock.close()
+
+    def _request(self, endpoint, msg_type, meta, payload=b"", timeout=None):
+        """
+        Kirim satu permintaan dan tunggu balasannya. Koneksi dari pool yang
+        ternyata sudah putus sebelum ada balasan (worker restart) dicoba sekali
+        lagi dengan koneksi baru. Timeout tidak dicoba ulang: worker mungkin masih
+        memproses permintaan itu.
+        """
+        for attempt in range(2):
+            sock, reused = self._acquire(endpoint)
+            retry = reused and attempt == 0
+            try:
+                sock.settimeout(timeout or self.request_timeout)
+                send_frame(sock, msg_type, meta, payload)
+                frame = recv_frame(sock)
+            except (ConnectionResetError, BrokenPipeError):
+                sock.close()
+                if retry:
+                    continue
+                raise
+            except (OSError, ProtocolError):
+                sock.close()
+                raise
+            if frame is None:
+                sock.close()
+                if retry:
+                    continue
+                raise ConnectionError("Worker menutup koneksi")
+            self._release(endpoint, sock)
+            return frame
+        raise ConnectionError("Worker menutup koneksi")
+
+    def _mark_failed(self, endpoint, error):
+        with self._lock:
+            endpoint.healthy = False
+            endpoint.failures += 1
+            endpoint.last_error = str(error)
+            endpoint.retry_at = time.monotonic() + min(self.max_backoff, 2 ** endpoint.failures)
+            idle, endpoint.idle = endpoint.idle, []
+        for sock in idle:
+            sock.close()
+
+    def _mark_healthy(self, endpoint, meta):
+        with self._lock:
+            endpoint.healthy = True
+            endpoint.failures = 0
+            endpoint.last_error = None
+            endpoint.remote_inflight = meta.get("inflight", endpoint.remote_inflight)
+            endpoint.model_version = meta.get("model_version", endpoint.model_version)
+            if self.model_version is None:
+                self.model_version = endpoint.model_version
+
+    # ------------------------------------------------------------------
+    # Health check
+    # ------------------------------------------------------------------
+
+    def check_health(self):
+        """
+        Cek semua worker (worker tidak sehat hanya jika masa backoff-nya lewat)
+        Returns: jumlah worker sehat
+        """
+        now = time.monotonic()
+        for endpoint in self.endpoints:
+            if not endpoint.healthy and now < endpoint.retry_at:
+                continue
+            try:
+                msg_type, meta, _ = self._request(endpoint, MSG_HEALTH, {}, timeout=self.connect_timeout)
+                if msg_type != MSG_RESULT:
+                    raise ConnectionError(meta.get("error", "Health check gagal"))
+                self._mark_healthy(endpoint, meta)
+            except Exception as e:
+                self._mark_failed(endpoint, e)
+        return sum(1 for endpoint in self.endpoints if endpoint.healthy)
+
+    def _health_loop(self):
+        while not self._stop_event.wait(self.health_interval):
+            try:
+                self.check_health()
+            except Exception as e:
+                print(f"Error saat health check worker inferensi: {e}")
+
+    def endpoint_status(self):
+        """Status setiap worker untuk halaman diagnostik"""
+        with self._lock:
+            return [{
+                "worker": endpoint.address,
+                "sehat": endpoint.healthy,
+                "inflight": endpoint.inflight,
+                "inflight_remote": endpoint.remote_inflight,
+                "dilayani": endpoint.served,
+                "model": endpoint.model_version,
+                "error": endpoint.last_error,
+            } for endpoint in self.endpoints]
+
+    def close(self):
+        """Hentikan health check dan tutup semua koneksi di pool"""
+        self._stop_event.set()
+        with self._lock:
+            sockets = [sock for endpoint in self.endpoints for sock in endpoint.idle]
+            for endpoint in self.endpoints:
+                endpoint.idle = []
+        for sock in sockets:
+            sock.close()
+
+    # ------------------------------------------------------------------
+    # Routing
+    # ------------------------------------------------------------------
+
+    def _choose(self, tried):
+        """
+        Pilih worker sehat dengan beban terendah yang belum dicoba, lalu naikkan
+        inflight-nya dalam lock yang sama (permintaan bersamaan tidak menumpuk
+        di worker yang sama). Worker tidak sehat hanya dipilih jika tidak ada
+        yang sehat (misal semua baru saja restart).
+        Returns: _Endpoint atau None jika semua sudah dicoba
+        """
+        with self._lock:
+            remaining = [endpoint for endpoint in self.endpoints if endpoint not in tried]
+            healthy = [endpoint for endpoint in remaining if endpoint.healthy]
+            if healthy:
+                # Beban sama: pilih yang paling sedikit dilayani supaya permintaan merata
+                endpoint = min(healthy, key=lambda endpoint: (endpoint.load(), endpoint.served))
+            elif remaining and not any(endpoint.healthy for endpoint in self.endpoints):
+                endpoint = min(remaining, key=lambda endpoint: endpoint.retry_at)
+            else:
+                return None
+            endpoint.inflight += 1
+            return endpoint
+
+    def detect_raw(self, image_path, image=None, image_scale=1.0):
+        """
+        Sama dengan SkinCancerDetector.detect_raw, inferensi di worker remote
+        Returns:
+            tuple: (gambar RGB, list semua prediksi >= CONFIDENCE_FLOOR)
+        """
+        if image is not None:
+            image_rgb = np.array(image if isinstance(image, np.ndarray) or image.mode == "RGB"
+                                 else image.convert("RGB"))
+            meta = {"encoding": "raw", "shape": list(image_rgb.shape), "image_scale": image_scale}
+            payload = image_rgb
+        else:
+            with open(image_path, "rb") as f:
+                payload = f.read()
+            meta = {"encoding": "encoded", "image_scale": image_scale}
+            image_rgb = None
+
+        errors = []
+        tried = []
+        while True:
+            endpoint = self._choose(tried)
+            if endpoint is None:
+                break
+            tried.append(endpoint)
+            try:
+                msg_type, reply, _ = self._request(endpoint, MSG_DETECT, meta, payload)
+            except (OSError, ProtocolError) as e:
+                self._mark_failed(endpoint, e)
+                errors.append(f"{endpoint.address}: {e}")
+                continue
+            finally:
+                with self._lock:
+                    endpoint.inflight -= 1
+
+            if msg_type != MSG_RESULT:
+                if reply.get("retryable"):
+                    # Worker sibuk atau gagal sementara: coba worker lain tanpa menandainya mati
+                    with self._lock:
+                        endpoint.remote_inflight = reply.get("inflight", endpoint.remote_inflight)
+                    errors.append(f"{endpoint.address}: {reply.get('error')}")
+                    continue
+                raise Exception(f"Error saat deteksi: {reply.get('error')}")
+
+            self._mark_healthy(endpoint, reply)
+            with self._lock:
+                endpoint.served += 1
+            if image_rgb is None:
+                image_rgb = self._read_rgb(image_path)
+            return image_rgb, reply["predictions"]
+
+        raise WorkerUnavailable("Tidak ada worker inferensi yang tersedia: " + "; ".join(errors))
+
+    @staticmethod
+    def _read_rgb(image_path):
+        import cv2
+
+        image_bgr = cv2.imread(image_path)
+        if image_bgr is None:
+            raise Exception("Gagal membaca gambar")
+        return cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB, dst=image_bgr)
+
+    def get_model_info(self):
+        return {
+            "model_type": "remote",
+            "model_version": self.model_version,
+            "workers": [endpoint.address for endpoint in self.endpoints],
+        }
@@ -0,0 +1,498 @@
+import argparse
+import datetime
+import io
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from tracing import StageTimer, load_traces, percentile
+
+# Password semua user replay (user dibuat ulang di database replay)
+REPLAY_PASSWORD = "replay-password"
+# Trace hanya menyimpan nama filter riwayat; nilai wakil untuk replay
+REPLAY_FILTER_VALUES = {
+    "classes": ["mel", "bcc"],
+    "min_confidence": 0.5,
+    "max_confidence": 0.95,
+    "date_from": datetime.date(2000, 1, 1),
+    "date_to": datetime.date(2100, 1, 1),
+}
+# Isi hasil_deteksi untuk riwayat awal user replay
+SEED_PREDICTIONS = str([
+    {"class": "mel", "confidence": 0.82, "bbox": [120, 80, 360, 300]},
+    {"class": "nv", "confidence": 0.41, "bbox": [400, 220, 520, 330]},
+])
+# Aksi dengan sampel lebih sedikit dari ini tidak dinilai regresi
+MIN_COMPARE_SAMPLES = 5
+# Keterlambatan jadwal (p99) yang dilaporkan sebagai replay tidak mampu mengikuti trace
+LAG_WARNING_MS = 1000
+
+
+class ReplayImages:
+    """
+    Gambar pengganti sesuai ukuran dan format di trace (trace tidak menyimpan
+    isi gambar). Tanpa gambar contoh dibuat gambar sintetis kulit + lesi;
+    dengan gambar contoh, gambar dipilih bergiliran lalu di-resize ke ukuran
+    yang tercatat. Hasil encode di-cache per (lebar, tinggi, format).
+    """
+
+    def __init__(self, sample_paths=(), max_cached=64):
+        self.samples = sample_paths
+        self.max_cached = max_cached
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def get(self, image):
+        width = int(image.get("width") or 800)
+        height = int(image.get("height") or 600)
+        image_format = image.get("format") or "JPEG"
+        key = (width, height, image_format)
+        with self._lock:
+            data = self._cache.get(key)
+        if data is None:
+            data = self._render(width, height, image_format, index=len(self._cache))
+            with self._lock:
+                if len(self._cache) >= self.max_cached:
+                    self._cache.pop(next(iter(self._cache)))
+                self._cache[key] = data
+        return data
+
+    def _render(self, width, height, image_format, index):
+        from PIL import Image, ImageDraw
+
+        if self.samples:
+            with Image.open(self.samples[index % len(self.samples)]) as sample:
+                picture = sample.convert("RGB").resize((width, height))
+        else:
+            picture = Image.new("RGB", (width, height), (214, 170, 150))
+            ImageDraw.Draw(picture).ellipse((width * 0.38, height * 0.33, width * 0.6, height * 0.6),
+                                            fill=(90, 50, 35))
+        buffer = io.BytesIO()
+        if image_format == "JPEG":
+            picture.save(buffer, format="JPEG", quality=90)
+        else:
+            picture.save(buffer, format=image_format)
+        return buffer.getvalue()
+
+
+class TraceReplayer:
+    """
+    Jalankan ulang workload dari trace terhadap SkinCancerDetector dan
+    DatabaseManager di direktori kerja terpisah (database, gambar dan index
+    sendiri), tanpa Streamlit dan tanpa data produksi.
+    - Jadwal mengikuti jarak waktu antar permintaan di trace, dibagi `speed`
+      (speed=0: secepat mungkin, dibatasi `concurrency`).
+    - Setiap pseudonim di trace menjadi user replay dengan riwayat awal
+      sebanyak riwayat terbesar yang tercatat untuknya.
+    - Deteksi memakai jalur yang sama dengan worker job: ingest, kontrol
+      masuk (DETECTION_CONCURRENCY dll.), detect_raw + fitur, index lesi,
+      lalu insert_history_records.
+    Hasil berupa record dengan skema trace (action, outcome, latency_ms,
+    stages) ditambah lag_ms: keterlambatan mulai terhadap jadwal.
+    """
+
+    def __init__(self, detector, db_manager, auth_manager=None, admission=None, lesion_index=None,
+                 images=None, speed=1.0, concurrency=4):
+        from job_queue import DetectionJobWorker
+        from sharding import open_job_queue
+
+        self.detector = detector
+        self.db_manager = db_manager
+        self.auth_manager = auth_manager
+        self.admission = admission
+        self.images = images or ReplayImages()
+        self.speed = speed
+        self.concurrency = concurrency
+        self.job_queue = open_job_queue(db_manager)
+        # Hanya dipakai untuk index_lesions; thread worker tidak dijalankan
+        self.worker = DetectionJobWorker(self.job_queue, detector, lesion_index=lesion_index)
+        self.handlers = {
+            "ingest": self.replay_ingest,
+            "detect_submit": self.replay_detect_submit,
+            "detect": self.replay_detect,
+            "history": self.replay_history,
+            "export": self.replay_export,
+            "login": self.replay_login,
+        }
+
+    @staticmethod
+    def username(actor):
+        return f"replay_{actor or 'anon'}"
+
+    def prepare(self, records):
+        """Buat user replay dan isi riwayat awal per pseudonim"""
+        from provisioning import bulk_provision
+
+        history_rows = defaultdict(int)
+        for record in records:
+            rows = record.get("records") if record["action"] == "export" else record.get("rows")
+            history_rows[record.get("actor")] = max(history_rows[record.get("actor")], rows or 0)
+
+        rows = [(index, "Replay", self.username(actor), REPLAY_PASSWORD)
+                for index, actor in enumerate(history_rows)]
+        bulk_provision(self.db_manager, rows, hasher=self.auth_manager.hasher if self.auth_manager else None)
+
+        seed_image = self.images.get({"width": 640, "height": 480, "format": "JPEG"})
+        for actor, count in history_rows.items():
+            history = []
+            for _ in range(count):
+                image_hash, path = self.db_manager.image_store_for(self.username(actor)).put(seed_image, "seed.jpg")
+                history.append((self.username(actor), "seed.jpg", path, SEED_PREDICTIONS, image_hash))
+            if history:
+                self.db_manager.insert_detection_history_batch(history)
+
+    # ------------------------------------------------------------------
+    # Handler per aksi: isi StageTimer dengan tahap yang sama seperti aplikasi
+    # ------------------------------------------------------------------
+
+    def _ingest(self, record, timer):
+        from ingest import ingest_upload, WORKING_MAX_SIDE
+
+        data = self.images.get(record.get("image") or {})
+        with timer.stage("ingest"):
+            return ingest_upload(data, "replay", max_side=WORKING_MAX_SIDE)
+
+    def replay_ingest(self, record, timer):
+        self._ingest(record, timer)
+
+    def replay_detect_submit(self, record, timer):
+        ingested = self._ingest(record, StageTimer())
+        username = self.username(record.get("actor"))
+        with timer.stage("store"):
+            image_hash, stored_path = self.db_manager.image_store_for(username).put(
+                ingested.data, ingested.filename, image=ingested.image)
+        with timer.stage("enqueue"):
+            self.job_queue.submit(username, ingested.filename, stored_path, image_hash=image_hash)
+
+    def replay_detect(self, record, timer):
+        ingested = self._ingest(record, timer)
+        username = self.username(record.get("actor"))
+
+        if self.admission is not None:
+            waiting_since = time.perf_counter()
+            with self.admission.slot():
+                timer.add("admission", waiting_since)
+                with timer.stage("inference"):
+                    image_rgb, raw_predictions = self.detector.detect_raw(
+                        None, image=ingested.image, image_scale=ingested.scale)
+        else:
+            with timer.stage("inference"):
+                image_rgb, raw_predictions = self.detector.detect_raw(
+                    None, image=ingested.image, image_scale=ingested.scale)
+
+        job = {"username": username, "image_hash": ingested.content_hash}
+        with timer.stage("index"):
+            self.worker.index_lesions(job, image_rgb, raw_predictions, ingested.scale)
+        del image_rgb
+
+        # Di aplikasi gambar disimpan saat submit; di sini ikut dihitung di tahap store
+        with timer.stage("store"):
+            image_hash, stored_path = self.db_manager.image_store_for(username).put(
+                ingested.data, ingested.filename, image=ingested.image)
+            self.db_manager.insert_detection_history_batch(
+                [(username, ingested.filename, stored_path, str(raw_predictions), image_hash)])
+        return {"detections": len(raw_predictions)}
+
+    def replay_history(self, record, timer):
+        filters = {key: REPLAY_FILTER_VALUES[key] for key in record.get("filters") or ()
+                   if key in REPLAY_FILTER_VALUES}
+        with timer.stage("query"):
+            history, _ = self.db_manager.search_detection_history(
+                self.username(record.get("actor")), limit=record.get("limit") or 20, **filters)
+        return {"rows": len(history)}
+
+    def replay_export(self, record, timer):
+        from export import export_history_zip
+
+        export_path = os.path.join("temp", f"export_{threading.get_ident()}_{time.monotonic_ns()}.zip")
+        try:
+            with timer.stage("export"):
+                records = export_history_zip(self.db_manager, self.username(record.get("actor")), export_path)
+        finally:
+            if os.path.exists(export_path):
+                os.remove(export_path)
+        return {"records": records}
+
+    def replay_login(self, record, timer):
+        if self.auth_manager is None:
+            raise RuntimeError("Replay login membutuhkan AuthManager")
+        # Login gagal di trace diulang dengan password salah (jalur verifikasi yang sama)
+        password = REPLAY_PASSWORD if record.get("outcome") != "failed" else REPLAY_PASSWORD + "-salah"
+        with timer.stage("verify"):
+            login_ok = self.auth_manager.login(self.username(record.get("actor")), password)
+        return {"outcome": "ok" if login_ok else "failed"}
+
+    # ------------------------------------------------------------------
+    # Penjadwalan
+    # ------------------------------------------------------------------
+
+    def _run_one(self, record, due):
+        from admission import DetectorBusy
+        from ingest import InvalidImage
+
+        started = time.perf_counter()
+        timer = StageTimer()
+        result = {"t": record["t"], "actor": record.get("actor"), "action": record["action"], "outcome": "ok",
+                  "lag_ms": round(max(0.0, started - due) * 1000, 2)}
+        try:
+            extra = self.handlers[record["action"]](record, timer)
+            if extra:
+                result.update(extra)
+        except DetectorBusy as e:
+            result.update(outcome="busy", error_type=type(e).__name__)
+        except InvalidImage as e:
+            result.update(outcome="invalid", error_type=type(e).__name__)
+        except Exception as e:
+            result.update(outcome="error", error_type=type(e).__name__, error=str(e))
+        result["latency_ms"] = timer.elapsed_ms()
+        result["stages"] = dict(timer.stages)
+        if record.get("image"):
+            result["image"] = record["image"]
+        return result
+
+    def run(self, records, progress=None):
+        """
+        Jalankan record trace sesuai jadwal
+        Args:
+            records: Record dari load_traces() (aksi tanpa handler dilewati)
+            progress: Callback (selesai, total) opsional
+        Returns:
+            list record hasil replay
+        """
+        records = [record for record in records if record["action"] in self.handlers]
+        if not records:
+            return []
+        origin = records[0]["t"]
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="replay") as executor:
+            start = time.perf_counter()
+            for record in records:
+                due = start + ((record["t"] - origin) / self.speed if self.speed > 0 else 0.0)
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(executor.submit(self._run_one, record, due))
+                if progress:
+                    progress(len(futures), len(records))
+            results = [future.result() for future in futures]
+        return results
+
+
+def write_results(path, results):
+    import json
+
+    with open(path, "w", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(result, ensure_ascii=False, default=str) + "\n")
+
+
+def summarize(records):
+    """
+    Distribusi latensi per aksi dan per tahap
+    Returns: dict aksi -> {count, errors, mean_ms, p50_ms, p90_ms, p99_ms, max_ms, stages}
+    """
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    stages = defaultdict(lambda: defaultdict(list))
+    for record in records:
+        action = record["action"]
+        if record.get("outcome") in ("error", "busy"):
+            errors[action] += 1
+            continue
+        if record.get("latency_ms") is None:
+            continue
+        latencies[action].append(record["latency_ms"])
+        for stage, value in (record.get("stages") or {}).items():
+            stages[action][stage].append(value)
+
+    summary = {}
+    for action in sorted(set(latencies) | set(errors)):
+        values = sorted(latencies[action])
+        summary[action] = {
+            "count": len(values),
+            "errors": errors[action],
+            "mean_ms": round(sum(values) / len(values), 2) if values else None,
+            "p50_ms": percentile(values, 50),
+            "p90_ms": percentile(values, 90),
+            "p99_ms": percentile(values, 99),
+            "max_ms": values[-1] if values else None,
+            "stages": {stage: {"p50_ms": percentile(sorted(samples), 50),
+                               "p90_ms": percentile(sorted(samples), 90)}
+                       for stage, samples in sorted(stages[action].items())},
+        }
+    return summary
+
+
+def compare(baseline, candidate, percentile=90, threshold=10.0):
+    """
+    Bandingkan distribusi latensi dua trace/hasil replay
+    Args:
+        baseline, candidate: Hasil summarize()
+        percentile: Persentil yang dinilai (50, 90 atau 99)
+        threshold: Kenaikan (%) yang dianggap regresi
+    Returns:
+        list dict per aksi dan tahap: nilai baseline, candidate, perubahan (%) dan regresi
+    """
+    key = f"p{percentile}_ms"
+    rows = []
+    for action in sorted(set(baseline) | set(candidate)):
+        base = baseline.get(action, {})
+        cand = candidate.get(action, {})
+        pairs = [(action, None, base.get(key), cand.get(key))]
+        for stage in sorted(set(base.get("stages", {})) | set(cand.get("stages", {}))):
+            pairs.append((action, stage, base.get("stages", {}).get(stage, {}).get(key),
+                          cand.get("stages", {}).get(stage, {}).get(key)))
+        enough = min(base.get("count", 0), cand.get("count", 0)) >= MIN_COMPARE_SAMPLES
+        for action_name, stage, before, after in pairs:
+            change = None
+            if before and after is not None:
+                change = round((after - before) / before * 100, 1)
+            rows.append({
+                "action": action_name, "stage": stage, "baseline_ms": before, "candidate_ms": after,
+                "change_percent": change,
+                "regression": bool(stage is None and enough and change is not None and change > threshold),
+            })
+    return rows
+
+
+def print_summary(summary):
+    print(f"{'aksi':<14} {'n':>6} {'error':>6} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}  (ms)")
+    for action, stats in summary.items():
+        print(f"{action:<14} {stats['count']:>6} {stats['errors']:>6} {stats['mean_ms']!s:>9} "
+              f"{stats['p50_ms']!s:>9} {stats['p90_ms']!s:>9} {stats['p99_ms']!s:>9} {stats['max_ms']!s:>9}")
+        for stage, values in stats["stages"].items():
+            print(f"  {stage:<12} {'':>6} {'':>6} {'':>9} {values['p50_ms']!s:>9} {values['p90_ms']!s:>9}")
+
+
+def print_comparison(rows, percentile):
+    print(f"{'aksi/tahap':<26} {'baseline':>10} {'kandidat':>10} {'ubah %':>8}  (p{percentile}, ms)")
+    for row in rows:
+        name = row["action"] if row["stage"] is None else f"  {row['stage']}"
+        change = "" if row["change_percent"] is None else f"{row['change_percent']:+.1f}"
+        flag = "  REGRESI" if row["regression"] else ""
+        print(f"{name:<26} {row['baseline_ms']!s:>10} {row['candidate_ms']!s:>10} {change:>8}{flag}")
+
+
+def run_replay(args):
+    trace_paths = [os.path.abspath(path) for path in args.traces]
+    records = load_traces(trace_paths)
+    if args.actions:
+        records = [record for record in records if record["action"] in args.actions]
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        raise SystemExit("Trace kosong")
+    out_path = os.path.abspath(args.out)
+    samples = []
+    for path in args.images:
+        if os.path.isdir(path):
+            samples.extend(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                  if name.lower().endswith((".jpg", ".jpeg", ".png"))))
+        else:
+            samples.append(path)
+    samples = [os.path.abspath(path) for path in samples]
+    model_path = os.path.abspath(args.model)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="replay-")
+    os.makedirs(workdir, exist_ok=True)
+    # Database, gambar, index dan log replay ditulis di direktori kerja sendiri
+    os.chdir(workdir)
+
+    from admission import admission_from_env
+    from auth import AuthManager
+    from database import DatabaseManager
+    from utils import setup_directories
+
+    setup_directories()
+    db_manager = DatabaseManager("replay.db", write_behind=False)
+    auth_manager = AuthManager(db_manager)
+    workers = [address.strip() for address in args.inference_workers.split(",") if address.strip()]
+    if workers:
+        from remote_detection import RemoteSkinCancerDetector
+        detector = RemoteSkinCancerDetector(workers)
+    else:
+        from detection import SkinCancerDetector
+        detector = SkinCancerDetector(model_path)
+        if detector.model is None:
+            raise SystemExit(f"Model tidak dapat dimuat: {model_path}")
+    lesion_index = None
+    if not args.no_lesion_index:
+        from lesion_index import LesionIndex
+        lesion_index = LesionIndex()
+
+    replayer = TraceReplayer(detector, db_manager, auth_manager=auth_manager, admission=admission_from_env(),
+                             lesion_index=lesion_index, images=ReplayImages(samples),
+                             speed=args.speed, concurrency=args.concurrency)
+    print(f"Menyiapkan {len(records)} permintaan di {workdir}...")
+    replayer.prepare(records)
+    duration = records[-1]["t"] - records[0]["t"]
+    print(f"Replay {duration:.1f} detik trace dengan kecepatan "
+          f"{'maksimal' if args.speed <= 0 else f'{args.speed}x'}, {args.concurrency} thread")
+
+    start = time.perf_counter()
+    results = replayer.run(records)
+    elapsed = time.perf_counter() - start
+    write_results(out_path, results)
+    if not args.keep_workdir and not args.workdir:
+        os.chdir(tempfile.gettempdir())
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    lags = sorted(result["lag_ms"] for result in results)
+    print(f"\n{len(results)} permintaan dalam {elapsed:.1f} detik, lag jadwal p50 {percentile(lags, 50)} ms "
+          f"p99 {percentile(lags, 99)} ms")
+    if args.speed > 0 and percentile(lags, 99) > LAG_WARNING_MS:
+        print("⚠️ Replay tidak mampu mengikuti kecepatan trace (concurrency terlalu kecil atau speed terlalu tinggi)")
+    print_summary(summarize(results))
+    print(f"\nHasil disimpan ke {out_path}")
+
+
+def run_compare(args):
+    baseline = summarize(load_traces([args.baseline]))
+    if args.candidate is None:
+        print_summary(baseline)
+        return 0
+    rows = compare(baseline, summarize(load_traces([args.candidate])), args.percentile, args.threshold)
+    print_comparison(rows, args.percentile)
+    regressions = [row["action"] for row in rows if row["regression"]]
+    if regressions:
+        print(f"\nRegresi > {args.threshold}% pada p{args.percentile}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay trace permintaan (TRACE_REQUESTS=1) dan bandingkan latensi")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    replay_parser = commands.add_parser("run", help="Jalankan ulang trace terhadap detector dan database lokal")
+    replay_parser.add_argument("traces", nargs="+", help="File trace (traces.jsonl dan hasil rotasinya)")
+    replay_parser.add_argument("--out", required=True, help="File hasil replay (JSON lines)")
+    replay_parser.add_argument("--model", default="best.pt", help="Path model YOLO")
+    replay_parser.add_argument("--inference-workers", default=os.environ.get("INFERENCE_WORKERS", ""),
+                               help="Alamat worker inferensi remote, dipisah koma")
+    replay_parser.add_argument("--speed", type=float, default=1.0,
+                               help="Kelipatan kecepatan trace (1 = asli, 10 = 10x lebih cepat, 0 = secepat mungkin)")
+    replay_parser.add_argument("--concurrency", type=int, default=4, help="Permintaan bersamaan maksimal")
+    replay_parser.add_argument("--images", nargs="*", default=[], help="File/direktori gambar contoh")
+    replay_parser.add_argument("--actions", nargs="*", help="Hanya replay aksi ini")
+    replay_parser.add_argument("--limit", type=int, help="Jumlah permintaan maksimal")
+    replay_parser.add_argument("--no-lesion-index", action="store_true", help="Lewati index kemiripan lesi")
+    replay_parser.add_argument("--workdir", help="Direktori kerja (default direktori sementara, dihapus setelah selesai)")
+    replay_parser.add_argument("--keep-workdir", action="store_true", help="Jangan hapus direktori kerja sementara")
+
+    compare_parser = commands.add_parser("compare", help="Bandingkan distribusi latensi dua trace/hasil replay")
+    compare_parser.add_argument("baseline", help="Trace atau hasil replay build lama")
+    compare_parser.add_argument("candidate", nargs="?", help="Hasil replay build baru (kosong: ringkasan baseline saja)")
+    compare_parser.add_argument("--percentile", type=int, choices=(50, 90, 99), default=90)
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="Kenaikan latensi (%%) yang dianggap regresi")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        run_replay(args)
+    else:
+        sys.exit(run_compare(args))
@@ -0,0 +1,390 @@
+import argparse
+import datetime
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from image_store import variant_source
+from utils import format_file_size
+
+# Direktori file sementara; direktori ImageStore milik database ditambahkan per job
+IMAGE_DIRECTORIES = ("temp", "uploads")
+
+
+def init_checkpoint_table(db_manager):
+    """Tabel status job pemeliharaan (retensi, janitor)"""
+    conn = db_manager._connect()
+    try:
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS maintenance_checkpoints (
+                    job TEXT PRIMARY KEY,
+                    phase TEXT NOT NULL,
+                    cutoff TEXT NOT NULL,
+                    last_id INTEGER NOT NULL DEFAULT 0,
+                    rows_removed INTEGER NOT NULL DEFAULT 0,
+                    files_removed INTEGER NOT NULL DEFAULT 0,
+                    bytes_reclaimed INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+    finally:
+        conn.close()
+
+
+class RetentionJob:
+    """
+    Job retensi bertahap untuk detection_history.
+    Record kadaluarsa diproses per chunk dengan transaksi pendek, file dihapus
+    paralel, dan posisi terakhir disimpan di tabel maintenance_checkpoints
+    sehingga job bisa dilanjutkan setelah crash. Setelah itu file yatim
+    (tidak dirujuk database) ikut dibersihkan.
+    Record yang file gambarnya hilang hanya dilaporkan, kecuali delete_dangling
+    aktif. Cek ini hanya memeriksa record baru sejak eksekusi sebelumnya
+    (high-water mark) dan memindai ulang semua record setiap dangling_rescan_days.
+    Path relatif diselesaikan terhadap base_dir (direktori aplikasi),
+    bukan direktori kerja proses.
+    """
+
+    JOB_NAME = "retention"
+
+    def __init__(self, db_manager, days=30, chunk_size=500, workers=8,
+                 directories=None, orphan_grace_hours=1, interval_hours=24, delete_dangling=False,
+                 base_dir=None, dangling_rescan_days=7):
+        """
+        Args:
+            db_manager: DatabaseManager yang dibersihkan
+            days: Umur maksimal record (hari)
+            chunk_size: Jumlah record per transaksi
+            workers: Jumlah thread untuk menghapus file
+            directories: Direktori gambar yang direkonsiliasi, default IMAGE_DIRECTORIES
+                         ditambah root ImageStore database ini (shard lain tidak disentuh)
+            orphan_grace_hours: File lebih muda dari ini tidak dianggap yatim
+            interval_hours: Jarak antar eksekusi saat berjalan di background
+            delete_dangling: Hapus record yang file gambarnya tidak ada (default: hanya dilaporkan)
+            base_dir: Direktori acuan path relatif, default direktori file database
+            dangling_rescan_days: Jarak antar pemindaian penuh record tanpa file (0 = selalu penuh)
+        """
+        self.db_manager = db_manager
+        self.days = days
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.directories = directories or (*IMAGE_DIRECTORIES, db_manager.image_store.root)
+        self.orphan_grace_hours = orphan_grace_hours
+        self.interval_hours = interval_hours
+        self.delete_dangling = delete_dangling
+        self.base_dir = base_dir or os.path.dirname(os.path.abspath(db_manager.db_path))
+        self.dangling_rescan_days = dangling_rescan_days
+        # Record tanpa file yang ditemukan di eksekusi terakhir (tidak dihapus)
+        self.dangling_found = 0
+
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._run_lock = threading.Lock()
+        init_checkpoint_table(db_manager)
+
+    # ------------------------------------------------------------------
+    # Checkpoint
+    # ------------------------------------------------------------------
+
+    def _load_checkpoint(self):
+        """Ambil checkpoint yang belum selesai atau buat yang baru"""
+        conn = self.db_manager._connect()
+        try:
+            with conn:
+                row = conn.execute('''
+                    SELECT phase, cutoff, last_id, rows_removed, files_removed, bytes_reclaimed
+                    FROM maintenance_checkpoints WHERE job = ?
+                ''', (self.JOB_NAME,)).fetchone()
+
+                if row and row[0] != "done":
+                    print(f"Melanjutkan retensi dari fase '{row[0]}' (id > {row[2]})")
+                    return {
+                        "phase": row[0], "cutoff": row[1], "last_id": row[2],
+                        "rows_removed": row[3], "files_removed": row[4], "bytes_reclaimed": row[5],
+                    }
+
+                # tanggal_deteksi disimpan oleh CURRENT_TIMESTAMP dalam UTC
+                cutoff = (datetime.datetime.utcnow() - datetime.timedelta(days=self.days)).strftime("%Y-%m-%d %H:%M:%S")
+                checkpoint = {
+                    "phase": "expired", "cutoff": cutoff, "last_id": 0,
+                    "rows_removed": 0, "files_removed": 0, "bytes_reclaimed": 0,
+                }
+                self._save_checkpoint(conn, checkpoint)
+                return checkpoint
+        finally:
+            conn.close()
+
+    def _save_checkpoint(self, conn, checkpoint):
+        conn.execute('''
+            INSERT INTO maintenance_checkpoints
+                (job, phase, cutoff, last_id, rows_removed, files_removed, bytes_reclaimed, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(job) DO UPDATE SET
+                phase = excluded.phase,
+                cutoff = excluded.cutoff,
+                last_id = excluded.last_id,
+                rows_removed = excluded.rows_removed,
+                files_removed = excluded.files_removed,
+                bytes_reclaimed = excluded.bytes_reclaimed,
+                updated_at = CURRENT_TIMESTAMP
+        ''', (self.JOB_NAME, checkpoint["phase"], checkpoint["cutoff"], checkpoint["last_id"],
+              checkpoint["rows_removed"], checkpoint["files_removed"], checkpoint["bytes_reclaimed"]))
+
+    def _advance(self, checkpoint, phase, last_id=0):
+        checkpoint["phase"] = phase
+        checkpoint["last_id"] = last_id
+        conn = self.db_manager._connect()
+        try:
+            with conn:
+                self._save_checkpoint(conn, checkpoint)
+        finally:
+            conn.close()
+
+    def _dangling_start(self):
+        """
+        Id awal cek record tanpa file: high-water mark eksekusi sebelumnya,
+        atau 0 jika pemindaian penuh terakhir lebih lama dari dangling_rescan_days
+        """
+        conn = self.db_manager._connect()
+        try:
+            row = conn.execute('SELECT cutoff, last_id FROM maintenance_checkpoints WHERE job = ?',
+                               (f"{self.JOB_NAME}:dangling",)).fetchone()
+        finally:
+            conn.close()
+        rescan_after = (datetime.datetime.utcnow()
+                        - datetime.timedelta(days=self.dangling_rescan_days)).strftime("%Y-%m-%d %H:%M:%S")
+        if row is None or row[0] <= rescan_after:
+            return 0
+        return row[1]
+
+    def _save_dangling_mark(self, started_from, last_id):
+        """Simpan high-water mark; waktu pemindaian penuh hanya diperbarui jika mulai dari 0"""
+        now = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+        conn = self.db_manager._connect()
+        try:
+            with conn:
+                conn.execute('''
+                    INSERT INTO maintenance_checkpoints (job, phase, cutoff, last_id, updated_at)
+                    VALUES (?, 'done', ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(job) DO UPDATE SET
+                        cutoff = CASE WHEN ? = 0 THEN excluded.cutoff ELSE cutoff END,
+                        last_id = excluded.last_id,
+                        updated_at = CURRENT_TIMESTAMP
+                ''', (f"{self.JOB_NAME}:dangling", now, last_id, started_from))
+        finally:
+            conn.close()
+
+    # ------------------------------------------------------------------
+    # Fase
+    # ------------------------------------------------------------------
+
+    def _remove_parallel(self, pool, filepaths):
+        """
+        Hapus file secara paralel, path relatif diselesaikan sekali terhadap base_dir
+        Returns: (jumlah file, byte dibebaskan)
+        """
+        if not filepaths:
+            return 0, 0
+        sizes = list(pool.map(
+            lambda path: self.db_manager.remove_files([self._resolve(path)], self.base_dir), filepaths))
+        return sum(1 for size in sizes if size > 0), sum(sizes)
+
+    def _process_chunks(self, pool, checkpoint, select_sql, select_params, filter_rows=None):
+        """
+        Proses record per chunk: hapus di transaksi pendek, simpan checkpoint,
+        lalu hapus file setelah commit
+        """
+        while not self._stop_event.is_set():
+            conn = self.db_manager._connect()
+            try:
+                with conn:
+                    rows = conn.execute(select_sql, (*select_params, checkpoint["last_id"], self.chunk_size)).fetchall()
+                    if not rows:
+                        return True
+
+                    targets = filter_rows(pool, rows) if filter_rows else rows
+                    deleted, unused_files = self.db_manager.delete_history_records(
+                        conn.cursor(), [row[0] for row in targets])
+
+                    checkpoint["last_id"] = rows[-1][0]
+                    checkpoint["rows_removed"] += deleted
+                    self._save_checkpoint(conn, checkpoint)
+            finally:
+                conn.close()
+
+            files, reclaimed = self._remove_parallel(pool, unused_files)
+            checkpoint["files_removed"] += files
+            checkpoint["bytes_reclaimed"] += reclaimed
+        return False
+
+    def _resolve(self, path):
+        """Path absolut terhadap base_dir"""
+        return os.path.normpath(os.path.join(self.base_dir, path))
+
+    def _missing_files(self, pool, rows):
+        exists = pool.map(lambda row: os.path.exists(self._resolve(row[1])), rows)
+        missing = [row for row, found in zip(rows, exists) if not found]
+        if self.delete_dangling:
+            return missing
+        self.dangling_found += len(missing)
+        return []
+
+    def _orphan_files(self, referenced):
+        """Cari file di direktori gambar yang tidak dirujuk database"""
+        cutoff = time.time() - self.orphan_grace_hours * 3600
+        stack = [self._resolve(directory) for directory in self.directories
+                 if os.path.isdir(self._resolve(directory))]
+
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        if entry.path in referenced:
+                            continue
+                        # Varian tampilan mengikuti status gambar sumbernya
+                        source = variant_source(entry.path)
+                        if source and source in referenced:
+                            continue
+                        if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                            yield entry.path
+
+    def _remove_orphans(self, pool, checkpoint):
+        # Record di antrian write-behind harus sudah tersimpan sebelum rekonsiliasi
+        if getattr(self.db_manager, "history_writer", None) is not None:
+            self.db_manager.history_writer.flush()
+
+        referenced = {self._resolve(path) for path in self.db_manager.referenced_image_paths(self.chunk_size)}
+        batch = []
+        for path in self._orphan_files(referenced):
+            batch.append(path)
+            if len(batch) >= self.chunk_size:
+                files, reclaimed = self._remove_parallel(pool, batch)
+                checkpoint["files_removed"] += files
+                checkpoint["bytes_reclaimed"] += reclaimed
+                batch = []
+            if self._stop_event.is_set():
+                return False
+
+        files, reclaimed = self._remove_parallel(pool, batch)
+        checkpoint["files_removed"] += files
+        checkpoint["bytes_reclaimed"] += reclaimed
+        return True
+
+    def run_once(self):
+        """
+        Jalankan satu siklus retensi lengkap
+        Returns:
+            dict: Ringkasan hasil retensi
+        """
+        with self._run_lock:
+            checkpoint = self._load_checkpoint()
+
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                dangling_start = 0
+                if checkpoint["phase"] == "expired":
+                    # Record yang melewati batas umur
+                    finished = self._process_chunks(pool, checkpoint, '''
+                        SELECT id, filepath FROM detection_history
+                        WHERE tanggal_deteksi < ? AND id > ?
+                        ORDER BY id LIMIT ?
+                    ''', (checkpoint["cutoff"],))
+                    if not finished:
+                        return self._summary(checkpoint)
+                    dangling_start = self._dangling_start()
+                    self._advance(checkpoint, "dangling", last_id=dangling_start)
+
+                if checkpoint["phase"] == "dangling":
+                    # Record yang file gambarnya sudah tidak ada. Jika direktori gambar
+                    # tidak ditemukan (volume belum di-mount, base_dir salah) fase dilewati
+                    self.dangling_found = 0
+                    if not dangling_start and checkpoint["last_id"]:
+                        # Dilanjutkan setelah crash: posisi awal tidak diketahui, anggap bukan pemindaian penuh
+                        dangling_start = checkpoint["last_id"]
+                    image_root = self._resolve(self.db_manager.image_store.root)
+                    if not os.path.isdir(image_root):
+                        print(f"Direktori gambar {image_root} tidak ditemukan, cek record tanpa file dilewati")
+                    else:
+                        finished = self._process_chunks(pool, checkpoint, '''
+                            SELECT id, filepath FROM detection_history
+                            WHERE id > ?
+                            ORDER BY id LIMIT ?
+                        ''', (), filter_rows=self._missing_files)
+                        if not finished:
+                            return self._summary(checkpoint)
+                        self._save_dangling_mark(dangling_start, checkpoint["last_id"])
+                        if self.dangling_found:
+                            print(f"{self.dangling_found} record history tanpa file gambar "
+                                  f"(tidak dihapus; gunakan --delete-dangling)")
+                    self._advance(checkpoint, "orphans")
+
+                if checkpoint["phase"] == "orphans":
+                    # File yang tidak dirujuk record mana pun
+                    if not self._remove_orphans(pool, checkpoint):
+                        return self._summary(checkpoint)
+                    self._advance(checkpoint, "done")
+
+            summary = self._summary(checkpoint)
+            print(f"Retensi selesai: {summary['rows_removed']} record, "
+                  f"{summary['files_removed']} file, "
+                  f"{format_file_size(summary['bytes_reclaimed'])} dibebaskan")
+            return summary
+
+    def _summary(self, checkpoint):
+        return {
+            "phase": checkpoint["phase"],
+            "rows_removed": checkpoint["rows_removed"],
+            "files_removed": checkpoint["files_removed"],
+            "bytes_reclaimed": checkpoint["bytes_reclaimed"],
+            "dangling_found": self.dangling_found,
+        }
+
+    # ------------------------------------------------------------------
+    # Background
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """Jalankan retensi secara periodik di thread background"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name="retention-job", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=30.0):
+        """Hentikan job background setelah chunk yang sedang berjalan selesai"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error saat menjalankan retensi: {e}")
+            self._stop_event.wait(self.interval_hours * 3600)
+
+
+if __name__ == "__main__":
+    from sharding import open_database, open_retention_job
+
+    parser = argparse.ArgumentParser(description="Retensi dan rekonsiliasi file history deteksi")
+    parser.add_argument("--db", default="skin_cancer_app.db", help="Path database SQLite")
+    parser.add_argument("--days", type=int, default=30, help="Umur maksimal record (hari)")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Jumlah record per transaksi")
+    parser.add_argument("--workers", type=int, default=8, help="Jumlah thread penghapus file")
+    parser.add_argument("--delete-dangling", action="store_true",
+                        help="Hapus record yang file gambarnya tidak ada (default: hanya dilaporkan)")
+    parser.add_argument("--rescan-dangling", action="store_true",
+                        help="Periksa semua record tanpa file, bukan hanya record baru sejak eksekusi terakhir")
+    args = parser.parse_args()
+
+    # TENANT_DIRECTORY di-set: retensi per shard (lihat sharding.py)
+    db_manager = open_database(args.db, write_behind=False)
+    open_retention_job(db_manager, days=args.days, chunk_size=args.chunk_size, workers=args.workers,
+                       delete_dangling=args.delete_dangling,
+                       dangling_rescan_days=0 if args.rescan_dangling else 7).run_once()
@@ -0,0 +1,171 @@
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+
+class SessionManager:
+    """
+    Token sesi persisten dengan cache LRU di memori.
+    Token disimpan di tabel sessions (hanya hash SHA-256-nya) beserta waktu
+    kadaluarsa, sehingga login tetap berlaku setelah browser di-refresh atau
+    websocket tersambung ulang. Validasi token yang sudah pernah dilihat proses
+    ini dilayani dari cache tanpa menyentuh disk.
+    """
+
+    def __init__(self, db_manager, ttl_hours=24 * 7, cache_size=1024):
+        """
+        Args:
+            db_manager: DatabaseManager pemilik tabel sessions
+            ttl_hours: Masa berlaku token (jam)
+            cache_size: Jumlah token maksimal di cache
+        """
+        self.db_manager = db_manager
+        self.ttl_seconds = ttl_hours * 3600
+        self.cache_size = cache_size
+
+        self._cache = OrderedDict()  # token_hash -> (username, expires_at)
+        self._lock = threading.Lock()
+        # Naik setiap ada pencabutan; hasil baca database yang dimulai sebelum
+        # pencabutan tidak boleh dimasukkan ke cache
+        self._generation = 0
+        self._init_table()
+
+    def _init_table(self):
+        conn = self.db_manager._connect()
+        try:
+            with conn:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS sessions (
+                        token_hash TEXT PRIMARY KEY,
+                        username TEXT NOT NULL,
+                        expires_at REAL NOT NULL,
+                        tanggal_dibuat TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (username) REFERENCES users (username)
+                    )
+                ''')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_username ON sessions (username)')
+                conn.execute('CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)')
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _hash_token(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def _cache_put(self, token_hash, username, expires_at, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._cache[token_hash] = (username, expires_at)
+            self._cache.move_to_end(token_hash)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def create(self, username):
+        """
+        Buat token sesi baru untuk user
+        Returns: token (hanya dikirim ke client, database menyimpan hash-nya)
+        """
+        token = secrets.token_urlsafe(32)
+        token_hash = self._hash_token(token)
+        expires_at = time.time() + self.ttl_seconds
+
+        conn = self.db_manager._connect()
+        try:
+            with conn:
+                # Token kadaluarsa dibersihkan sekalian di transaksi yang sama
+                conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (time.time(),))
+                conn.execute('''
+                    INSERT INTO sessions (token_hash, username, expires_at)
+                    VALUES (?, ?, ?)
+                ''', (token_hash, username, expires_at))
+        finally:
+            conn.close()
+
+        self._cache_put(token_hash, username, expires_at)
+        return token
+
+    def validate(self, token):
+        """
+        Validasi token sesi
+        Returns: username pemilik token, atau None jika tidak valid/kadaluarsa
+        """
+        if not token:
+            return None
+
+        token_hash = self._hash_token(token)
+        now = time.time()
+
+        with self._lock:
+            cached = self._cache.get(token_hash)
+            if cached is not None:
+                if cached[1] > now:
+                    self._cache.move_to_end(token_hash)
+                    return cached[0]
+                del self._cache[token_hash]
+            generation = self._generation
+
+        conn = self.db_manager._connect()
+        try:
+            row = conn.execute('''
+                SELECT username, expires_at FROM sessions
+                WHERE token_hash = ? AND expires_at > ?
+            ''', (token_hash, now)).fetchone()
+        finally:
+            conn.close()
+
+        if row is None:
+            return None
+
+        self._cache_put(token_hash, row[0], row[1], generation)
+        return row[0]
+
+    def revoke(self, token):
+        """Cabut satu token (logout)"""
+        if not token:
+            return
+        token_hash = self._hash_token(token)
+
+        conn = self.db_manager._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM sessions WHERE token_hash = ?', (token_hash,))
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._generation += 1
+            self._cache.pop(token_hash, None)
+
+    def revoke_user(self, username):
+        """Cabut semua token milik user (misalnya setelah reset password)"""
+        conn = self.db_manager._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM sessions WHERE username = ?', (username,))
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._generation += 1
+            for token_hash in [key for key, value in self._cache.items() if value[0] == username]:
+                del self._cache[token_hash]
+
+    def purge_expired(self):
+        """
+        Hapus token yang sudah kadaluarsa
+        Returns: jumlah token yang dihapus
+        """
+        now = time.time()
+        with self._lock:
+            for token_hash in [key for key, value in self._cache.items() if value[1] <= now]:
+                del self._cache[token_hash]
+
+        conn = self.db_manager._connect()
+        try:
+            with conn:
+                return conn.execute('DELETE FROM sessions WHERE expires_at <= ?', (now,)).rowcount
+        finally:
+            conn.close()
@@ -0,0 +1,815 @@
+import argparse
+import csv
+import heapq
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import DatabaseManager, remove_file
+from image_store import DISPLAY_VARIANTS, variant_path
+from retention import IMAGE_DIRECTORIES, RetentionJob
+
+# Mode multi-klinik aktif jika TENANT_DIRECTORY (path database direktori) di-set
+DEFAULT_DIRECTORY_PATH = "tenants.db"
+DEFAULT_SHARD_DIR = "shards"
+DEFAULT_TENANT = "default"
+# Nama tenant dipakai sebagai nama file shard dan direktori gambar
+TENANT_NAME_PATTERN = re.compile(r"^[a-z0-9][a-z0-9_-]{0,63}$")
+# Koneksi idle per shard yang dipakai ulang
+SHARD_POOL_SIZE = 8
+# Umur cache tenant per user (detik) untuk pembacaan; penulisan selalu membaca
+# database direktori karena `sharding.py assign` bisa berjalan di proses lain
+TENANT_CACHE_TTL = 30.0
+
+
+def validate_tenant(tenant):
+    """Returns: nama tenant yang sudah dinormalisasi; ValueError jika tidak valid"""
+    tenant = (tenant or "").strip().lower()
+    if not TENANT_NAME_PATTERN.match(tenant):
+        raise ValueError(f"Nama tenant tidak valid: {tenant!r} (huruf kecil, angka, '-' atau '_')")
+    return tenant
+
+
+class ShardedDatabaseManager(DatabaseManager):
+    """
+    DatabaseManager untuk deployment multi-klinik: satu file SQLite per tenant.
+    - Database direktori (file ini) menyimpan users (dengan kolom tenant),
+      sessions, daftar tenant dan checkpoint pemeliharaan.
+    - Setiap tenant punya shard sendiri (DatabaseManager biasa): history,
+      prediksi, job deteksi dan ImageStore di direktori gambar sendiri, jadi
+      kunci tulis satu klinik tidak menahan klinik lain.
+    - Method per user (history, pencarian, ekspor, gambar) diarahkan ke shard
+      tenant user tersebut; koneksi setiap shard dipakai ulang lewat pool.
+    - Query admin lintas tenant dijalankan paralel di semua shard lalu digabung.
+    Shard dibuka saat pertama dipakai dan tetap terbuka (termasuk thread
+    HistoryWriter-nya jika write_behind aktif).
+    """
+
+    def __init__(self, directory_path=DEFAULT_DIRECTORY_PATH, shard_dir=DEFAULT_SHARD_DIR,
+                 image_root="history_images", default_tenant=DEFAULT_TENANT, write_behind=True,
+                 busy_timeout=30.0, pool_size=SHARD_POOL_SIZE):
+        """
+        Args:
+            directory_path: Path database direktori (users, sessions, tenant)
+            shard_dir: Direktori file shard (<tenant>.db)
+            image_root: Direktori akar gambar; gambar tenant di <image_root>/tenants/<tenant>
+            default_tenant: Tenant untuk user baru tanpa tenant eksplisit
+            write_behind: Write-behind history di setiap shard
+            busy_timeout: Waktu tunggu (detik) saat database dikunci writer lain
+            pool_size: Koneksi idle per database yang dipakai ulang
+        """
+        self.shard_dir = shard_dir
+        self.shard_image_root = os.path.join(image_root, "tenants")
+        self.default_tenant = validate_tenant(default_tenant)
+        self.write_behind = write_behind
+        self.pool_size = pool_size
+        self._shards = {}
+        self._shards_lock = threading.Lock()
+        self._tenant_cache = {}
+        super().__init__(directory_path, write_behind=False, busy_timeout=busy_timeout,
+                         pool_size=pool_size, image_root=image_root)
+
+    def init_database(self):
+        """Inisialisasi database direktori (tanpa tabel history)"""
+        try:
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    conn.execute('PRAGMA synchronous=NORMAL')
+                    cursor = conn.cursor()
+                    self._create_users_table(cursor)
+                    self._ensure_column(cursor, 'users', 'tenant', 'TEXT')
+                    cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_tenant ON users (tenant)')
+                    cursor.execute('''
+                        CREATE TABLE IF NOT EXISTS tenants (
+                            name TEXT PRIMARY KEY,
+                            shard_path TEXT NOT NULL,
+                            tanggal_dibuat TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                        )
+                    ''')
+            finally:
+                conn.close()
+            print("Database direktori tenant berhasil diinisialisasi")
+
+        except Exception as e:
+            print(f"Error saat inisialisasi database direktori: {e}")
+
+    def close(self):
+        with self._shards_lock:
+            shards = list(self._shards.values())
+        for shard in shards:
+            shard.close()
+        super().close()
+
+    # ------------------------------------------------------------------
+    # Direktori tenant
+    # ------------------------------------------------------------------
+
+    def shard_path(self, tenant):
+        return os.path.join(self.shard_dir, f"{tenant}.db")
+
+    def shard(self, tenant):
+        """DatabaseManager shard milik tenant (dibuat jika belum ada)"""
+        shard = self._shards.get(tenant)
+        if shard is not None:
+            return shard
+
+        tenant = validate_tenant(tenant)
+        with self._shards_lock:
+            shard = self._shards.get(tenant)
+            if shard is None:
+                os.makedirs(self.shard_dir, exist_ok=True)
+                path = self.shard_path(tenant)
+                conn = self._connect()
+                try:
+                    with conn:
+                        conn.execute('INSERT INTO tenants (name, shard_path) VALUES (?, ?) '
+                                     'ON CONFLICT(name) DO NOTHING', (tenant, path))
+                finally:
+                    conn.close()
+                shard = DatabaseManager(path, write_behind=self.write_behind, busy_timeout=self.busy_timeout,
+                                        pool_size=self.pool_size,
+                                        image_root=os.path.join(self.shard_image_root, tenant))
+                self._shards[tenant] = shard
+        return shard
+
+    def tenant_of(self, username, cached=True):
+        """
+        Tenant user; user tanpa tenant (atau tidak dikenal) masuk default_tenant
+        Args:
+            cached: False untuk penulisan, tenant dibaca langsung dari database direktori
+        """
+        entry = self._tenant_cache.get(username) if cached else None
+        if entry is not None and entry[1] > time.monotonic():
+            return entry[0]
+
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT tenant FROM users WHERE username = ?', (username,)).fetchone()
+        finally:
+            conn.close()
+        if not row or not row[0]:
+            return self.default_tenant
+        if len(self._tenant_cache) > 10000:
+            self._tenant_cache.clear()
+        self._tenant_cache[username] = (row[0], time.monotonic() + TENANT_CACHE_TTL)
+        return row[0]
+
+    def shard_for(self, username, cached=True):
+        return self.shard(self.tenant_of(username, cached))
+
+    def tenants(self):
+        """Nama semua tenant yang terdaftar, terurut"""
+        conn = self._connect()
+        try:
+            return [row[0] for row in conn.execute('SELECT name FROM tenants ORDER BY name')]
+        finally:
+            conn.close()
+
+    def shards(self):
+        """List (tenant, DatabaseManager) untuk semua tenant"""
+        return [(tenant, self.shard(tenant)) for tenant in self.tenants()]
+
+    def set_user_tenant(self, username, tenant):
+        """
+        Pindahkan user ke tenant lain. Hanya untuk user yang belum punya
+        history di shard lamanya (data tidak dipindah antar shard).
+        Returns: True jika user ada dan tenant-nya diubah
+        """
+        tenant = validate_tenant(tenant)
+        if not self.user_exists(username):
+            return False
+        current = self.tenant_of(username, cached=False)
+        if current != tenant and self.shard(current).count_detection_history(username) > 0:
+            raise ValueError(f"User {username} sudah punya history di tenant {current}")
+
+        self.shard(tenant)
+        conn = self._connect()
+        try:
+            with conn:
+                updated = conn.execute('UPDATE users SET tenant = ? WHERE username = ?',
+                                       (tenant, username)).rowcount
+        finally:
+            conn.close()
+        self._tenant_cache.pop(username, None)
+        return updated > 0
+
+    def create_user(self, nama_lengkap, username, hashed_password, tenant=None):
+        """Membuat user baru di tenant tertentu (default: default_tenant)"""
+        created = super().create_user(nama_lengkap, username, hashed_password)
+        if created:
+            self.set_user_tenant(username, tenant or self.default_tenant)
+        return created
+
+    def create_users_bulk(self, users, tenant=None):
+        """Membuat banyak user sekaligus di satu tenant (default: default_tenant)"""
+        created, existing, failed = super().create_users_bulk(users)
+        if created:
+            tenant = validate_tenant(tenant or self.default_tenant)
+            self.shard(tenant)
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.executemany('UPDATE users SET tenant = ? WHERE username = ?',
+                                     [(tenant, username) for username in created])
+            finally:
+                conn.close()
+        return created, existing, failed
+
+    # ------------------------------------------------------------------
+    # Method per user, diarahkan ke shard tenant
+    # ------------------------------------------------------------------
+
+    def image_store_for(self, username):
+        # Dipakai untuk menyimpan gambar upload, jadi tenant tidak boleh dari cache
+        return self.shard_for(username, cached=False).image_store
+
+    def save_detection_history(self, username, filename, filepath, hasil_deteksi, image_hash=None):
+        return self.shard_for(username, cached=False).save_detection_history(username, filename, filepath,
+                                                                             hasil_deteksi, image_hash)
+
+    def insert_detection_history_batch(self, records):
+        by_shard = {}
+        for record in records:
+            by_shard.setdefault(self.tenant_of(record[0], cached=False), []).append(record)
+        for tenant, shard_records in by_shard.items():
+            self.shard(tenant).insert_detection_history_batch(shard_records)
+
+    def get_detection_history(self, username):
+        return self.shard_for(username).get_detection_history(username)
+
+    def search_detection_history(self, username, **kwargs):
+        return self.shard_for(username).search_detection_history(username, **kwargs)
+
+    def count_detection_history(self, username):
+        return self.shard_for(username).count_detection_history(username)
+
+    def iter_detection_history(self, username, batch_size=500):
+        return self.shard_for(username).iter_detection_history(username, batch_size)
+
+    def get_history_by_image_hashes(self, username, image_hashes):
+        return self.shard_for(username).get_history_by_image_hashes(username, image_hashes)
+
+    def delete_detection_history(self, history_id, username=None):
+        # Id history hanya unik di dalam satu shard
+        if username is None:
+            raise ValueError("delete_detection_history butuh username di mode multi-tenant")
+        return self.shard_for(username, cached=False).delete_detection_history(history_id, username)
+
+    def delete_old_detections(self, days=30):
+        try:
+            ShardedRetentionJob(self, days=days).run_once()
+            return True
+
+        except Exception as e:
+            print(f"Error saat menghapus data lama: {e}")
+            return False
+
+    # ------------------------------------------------------------------
+    # Lintas tenant (fan-out)
+    # ------------------------------------------------------------------
+
+    def fan_out(self, fn, max_workers=8):
+        """
+        Jalankan fn(tenant, shard) di semua shard secara paralel
+        Returns: dict tenant -> hasil; shard yang gagal dilewati (error dicetak)
+        """
+        shards = self.shards()
+        if not shards:
+            return {}
+
+        def run(item):
+            tenant, shard = item
+            try:
+                return tenant, fn(tenant, shard), None
+            except Exception as e:
+                return tenant, None, e
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(shards))) as pool:
+            for tenant, result, error in pool.map(run, shards):
+                if error is not None:
+                    print(f"Error saat query shard {tenant}: {error}")
+                else:
+                    results[tenant] = result
+        return results
+
+    def referenced_image_paths(self, batch_size=500):
+        # Dipakai janitor untuk file yatim: shard yang gagal dibaca harus menggagalkan
+        # seluruh pemindaian, bukan dianggap tidak merujuk file apa pun
+        referenced = set()
+        for tenant, shard in self.shards():
+            referenced.update(shard.referenced_image_paths(batch_size))
+        return referenced
+
+    def remove_files(self, filepaths, base_dir=None):
+        reclaimed = 0
+        by_shard = {}
+        shards = self.shards()
+        for path in filepaths:
+            if base_dir:
+                path = os.path.join(base_dir, path)
+            owner = next((shard for _, shard in shards if shard.image_store.owns(path, base_dir)), None)
+            if owner is None:
+                reclaimed += remove_file(path)
+            else:
+                by_shard.setdefault(owner, []).append(path)
+        for shard, paths in by_shard.items():
+            reclaimed += shard.remove_files(paths, base_dir)
+        return reclaimed
+
+    def tenant_stats(self):
+        """
+        Ringkasan per tenant untuk halaman diagnostik
+        Returns: list dict (tenant, user, history, gambar, ukuran), diakhiri baris total
+        """
+        conn = self._connect()
+        try:
+            users = dict(conn.execute('''
+                SELECT COALESCE(tenant, ?), COUNT(*) FROM users GROUP BY COALESCE(tenant, ?)
+            ''', (self.default_tenant, self.default_tenant)).fetchall())
+        finally:
+            conn.close()
+
+        def shard_stats(tenant, shard):
+            shard_conn = shard._connect()
+            try:
+                history = shard_conn.execute('SELECT COUNT(*) FROM detection_history').fetchone()[0]
+                images, image_bytes = shard_conn.execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM image_blobs').fetchone()
+            finally:
+                shard_conn.close()
+            db_bytes = sum(os.path.getsize(path) for path in (shard.db_path, shard.db_path + "-wal")
+                           if os.path.exists(path))
+            return {"history": history, "images": images, "image_bytes": image_bytes, "db_bytes": db_bytes}
+
+        results = self.fan_out(shard_stats)
+        rows = []
+        for tenant in sorted(set(results) | set(users)):
+            stats = results.get(tenant, {})
+            rows.append({"tenant": tenant, "users": users.get(tenant, 0), **stats})
+        total = {"tenant": "TOTAL", "users": sum(row["users"] for row in rows)}
+        for key in ("history", "images", "image_bytes", "db_bytes"):
+            total[key] = sum(row.get(key, 0) for row in rows)
+        return rows + [total]
+
+    def recent_detections(self, limit=20):
+        """
+        Deteksi terbaru dari semua tenant, digabung urut tanggal
+        Returns: list tuple (tenant, id, username, filename, tanggal_deteksi)
+        """
+        def latest(tenant, shard):
+            conn = shard._connect()
+            try:
+                return [(tenant, *row) for row in conn.execute('''
+                    SELECT id, username, filename, tanggal_deteksi FROM detection_history
+                    ORDER BY tanggal_deteksi DESC, id DESC LIMIT ?
+                ''', (limit,))]
+            finally:
+                conn.close()
+
+        # Setiap shard sudah terurut menurun; cukup merge lalu ambil `limit` teratas
+        merged = heapq.merge(*self.fan_out(latest).values(), key=lambda row: (row[4], row[1]), reverse=True)
+        return list(merged)[:limit]
+
+
+class ShardedJobQueue:
+    """
+    Antrian job deteksi untuk ShardedDatabaseManager: satu DetectionJobQueue
+    di setiap shard (job dan history-nya tetap dalam satu transaksi), dengan
+    antarmuka yang sama. Id job global berbentuk "<tenant>:<id>". Worker
+    mengambil job bergiliran antar tenant, jadi antrian panjang satu klinik
+    tidak menunda klinik lain. Posisi antrian dihitung di dalam tenant.
+    """
+
+    def __init__(self, db_manager, **queue_options):
+        """
+        Args:
+            db_manager: ShardedDatabaseManager
+            **queue_options: Diteruskan ke DetectionJobQueue (max_attempts, lease_seconds, ...)
+        """
+        self.db_manager = db_manager
+        self.queue_options = queue_options
+        self.lease_seconds = queue_options.get("lease_seconds", 60.0)
+        self._queues = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._next_tenant = 0
+
+    def queue(self, tenant):
+        """DetectionJobQueue di shard tenant"""
+        from job_queue import DetectionJobQueue
+
+        with self._lock:
+            queue = self._queues.get(tenant)
+            if queue is None:
+                queue = DetectionJobQueue(self.db_manager.shard(tenant), **self.queue_options)
+                # Submit di shard mana pun membangunkan worker yang sama
+                queue._wakeup = self._wakeup
+                self._queues[tenant] = queue
+            return queue
+
+    @staticmethod
+    def _split(job_id):
+        """Returns: (tenant, id lokal) atau (None, None) jika id bukan id global"""
+        tenant, _, local_id = str(job_id).rpartition(":")
+        if not tenant or not local_id.isdigit():
+            return None, None
+        return tenant, int(local_id)
+
+    @staticmethod
+    def _globalize(tenant, job):
+        if job is not None:
+            job["id"] = f"{tenant}:{job['id']}"
+            job["tenant"] = tenant
+        return job
+
+    def _route(self, job_id):
+        tenant, local_id = self._split(job_id)
+        if tenant is None or tenant not in self.db_manager.tenants():
+            return None, None
+        return self.queue(tenant), local_id
+
+    def submit(self, username, filename, filepath, image_hash=None):
+        tenant = self.db_manager.tenant_of(username, cached=False)
+        return f"{tenant}:{self.queue(tenant).submit(username, filename, filepath, image_hash)}"
+
+    def wait(self, timeout):
+        woken = self._wakeup.wait(timeout)
+        self._wakeup.clear()
+        return woken
+
+    def claim(self, worker_id):
+        """Ambil satu job, dimulai dari tenant sesudah tenant yang terakhir dilayani"""
+        tenants = self.db_manager.tenants()
+        for offset in range(len(tenants)):
+            index = (self._next_tenant + offset) % len(tenants)
+            job = self.queue(tenants[index]).claim(worker_id)
+            if job is not None:
+                self._next_tenant = index + 1
+                return self._globalize(tenants[index], job)
+        return None
+
+    def heartbeat(self, job_id, worker_id, stage=None, progress=None):
+        queue, local_id = self._route(job_id)
+        return queue.heartbeat(local_id, worker_id, stage, progress) if queue else False
+
+    def report_progress(self, job_id, stage, progress):
+        # Hanya di memori: job yang sedang dikerjakan pasti punya antrian di proses ini
+        tenant, local_id = self._split(job_id)
+        queue = self._queues.get(tenant)
+        if queue is not None:
+            queue.report_progress(local_id, stage, progress)
+
+    def complete(self, job_id, worker_id, hasil_deteksi, result=None, username=None):
+        queue, local_id = self._route(job_id)
+        return queue.complete(local_id, worker_id, hasil_deteksi, result, username) if queue else None
+
+    def fail(self, job_id, worker_id, error, retryable=True):
+        queue, local_id = self._route(job_id)
+        return queue.fail(local_id, worker_id, error, retryable) if queue else None
+
+    def postpone(self, job_id, worker_id, delay, stage="Menunggu giliran model"):
+        queue, local_id = self._route(job_id)
+        return queue.postpone(local_id, worker_id, delay, stage) if queue else None
+
+    def retry(self, job_id, username):
+        queue, local_id = self._route(job_id)
+        return queue.retry(local_id, username) if queue else False
+
+    def dismiss(self, job_id, username):
+        queue, local_id = self._route(job_id)
+        return queue.dismiss(local_id, username) if queue else False
+
+    def get_job(self, job_id, username=None):
+        queue, local_id = self._route(job_id)
+        if queue is None:
+            return None
+        return self._globalize(self._split(job_id)[0], queue.get_job(local_id, username))
+
+    def user_jobs(self, username, **kwargs):
+        tenant = self.db_manager.tenant_of(username)
+        return [self._globalize(tenant, job) for job in self.queue(tenant).user_jobs(username, **kwargs)]
+
+    def queue_position(self, job_id):
+        queue, local_id = self._route(job_id)
+        return queue.queue_position(local_id) if queue else 0
+
+    def purge_finished(self, days=7):
+        return sum(self.queue(tenant).purge_finished(days) for tenant in self.db_manager.tenants())
+
+    def stats(self):
+        """Jumlah job per status (dijumlah semua tenant) dan umur job antrian tertua"""
+        per_tenant = self.db_manager.fan_out(lambda tenant, shard: self.queue(tenant).stats())
+        stats = {}
+        for tenant_stats in per_tenant.values():
+            for key, value in tenant_stats.items():
+                if key == "oldest_queued_seconds":
+                    stats[key] = max(stats.get(key, 0.0), value)
+                else:
+                    stats[key] = stats.get(key, 0) + value
+        return stats
+
+
+class ShardedRetentionJob(RetentionJob):
+    """
+    RetentionJob untuk ShardedDatabaseManager. Setiap shard menjalankan
+    RetentionJob sendiri (checkpoint di shard, hanya direktori gambar tenant
+    itu), lalu file yatim di direktori bersama (temp, uploads) dicari terhadap
+    gabungan referensi semua shard, supaya file tenant lain tidak dianggap yatim.
+    """
+
+    def __init__(self, db_manager, directories=None, **options):
+        super().__init__(db_manager, directories=directories or IMAGE_DIRECTORIES, **options)
+        self.options = options
+        self._jobs = {}
+
+    def run_once(self):
+        """Returns: ringkasan gabungan, rincian per tenant ada di key tenants"""
+        with self._run_lock:
+            summaries = {}
+            for tenant, shard in self.db_manager.shards():
+                if self._stop_event.is_set():
+                    break
+                job = self._jobs.get(tenant)
+                if job is None:
+                    # Path gambar shard relatif terhadap direktori aplikasi, bukan shard_dir
+                    job = RetentionJob(shard, directories=(shard.image_store.root,),
+                                       **{**self.options, "base_dir": self.base_dir})
+                    # Berhenti bersama job induk
+                    job._stop_event = self._stop_event
+                    self._jobs[tenant] = job
+                summaries[tenant] = job.run_once()
+
+            shared = {"phase": "orphans", "rows_removed": 0, "files_removed": 0, "bytes_reclaimed": 0}
+            if not self._stop_event.is_set():
+                with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                    if self._remove_orphans(pool, shared):
+                        shared["phase"] = "done"
+
+            summary = self._summary(shared)
+            for tenant_summary in summaries.values():
+                for key in ("rows_removed", "files_removed", "bytes_reclaimed", "dangling_found"):
+                    summary[key] += tenant_summary[key]
+                if tenant_summary["phase"] != "done":
+                    summary["phase"] = tenant_summary["phase"]
+            summary["tenants"] = summaries
+            return summary
+
+
+def open_database(db_path="skin_cancer_app.db", write_behind=True):
+    """
+    Database aplikasi sesuai environment: ShardedDatabaseManager jika
+    TENANT_DIRECTORY di-set (TENANT_SHARD_DIR, DEFAULT_TENANT opsional),
+    selain itu DatabaseManager satu file seperti biasa.
+    Gambar tenant di history_images/tenants tidak dirujuk database satu file,
+    jadi database satu file ditolak setelah split (retensi/janitor akan
+    menganggapnya yatim dan menghapusnya).
+    """
+    directory_path = os.environ.get("TENANT_DIRECTORY")
+    if not directory_path:
+        tenant_images = os.path.join("history_images", "tenants")
+        if os.path.isdir(tenant_images):
+            raise RuntimeError(f"{tenant_images} ada (database sudah di-split): set TENANT_DIRECTORY "
+                               f"untuk memakai database direktori tenant, bukan {db_path}")
+        return DatabaseManager(db_path, write_behind=write_behind)
+    return ShardedDatabaseManager(directory_path,
+                                  shard_dir=os.environ.get("TENANT_SHARD_DIR", DEFAULT_SHARD_DIR),
+                                  default_tenant=os.environ.get("DEFAULT_TENANT", DEFAULT_TENANT),
+                                  write_behind=write_behind)
+
+
+def open_job_queue(db_manager, **queue_options):
+    """DetectionJobQueue, atau ShardedJobQueue untuk ShardedDatabaseManager"""
+    if isinstance(db_manager, ShardedDatabaseManager):
+        return ShardedJobQueue(db_manager, **queue_options)
+    from job_queue import DetectionJobQueue
+
+    return DetectionJobQueue(db_manager, **queue_options)
+
+
+def open_retention_job(db_manager, **options):
+    """RetentionJob, atau ShardedRetentionJob untuk ShardedDatabaseManager"""
+    if isinstance(db_manager, ShardedDatabaseManager):
+        return ShardedRetentionJob(db_manager, **options)
+    return RetentionJob(db_manager, **options)
+
+
+# ----------------------------------------------------------------------
+# Memecah database satu file menjadi shard
+# ----------------------------------------------------------------------
+
+def read_tenant_map(path):
+    """CSV dengan kolom username, tenant. Returns: dict username -> tenant"""
+    mapping = {}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        missing = {"username", "tenant"} - set(reader.fieldnames or [])
+        if missing:
+            raise ValueError(f"Kolom CSV tidak lengkap, tidak ada: {', '.join(sorted(missing))}")
+        for row in reader:
+            mapping[row["username"].strip()] = validate_tenant(row["tenant"])
+    return mapping
+
+
+def _link_or_copy(source, target):
+    """Hard link (tanpa menyalin isi) jika satu filesystem, selain itu salin"""
+    if os.path.exists(target) or not os.path.exists(source):
+        return False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+    return True
+
+
+def _table_exists(conn, schema, table):
+    return conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?",
+                        (table,)).fetchone() is not None
+
+
+def split_database(source_path, sharded, tenant_map=None):
+    """
+    Pecah database satu file (skin_cancer_app.db) ke database direktori dan
+    shard per tenant. Database sumber dan file gambarnya tidak diubah:
+    gambar di-hard link (atau disalin) ke direktori gambar tenant, jadi
+    database lama tetap bisa dipakai sampai hasil split diperiksa. File lama
+    tanpa hash (uploads/) tetap di tempatnya dan dirujuk dari shard.
+    Args:
+        source_path: Database sumber
+        sharded: ShardedDatabaseManager tujuan (direktori sebaiknya masih kosong)
+        tenant_map: dict username -> tenant; user lain dan history tanpa user
+                    masuk sharded.default_tenant
+    Returns:
+        dict tenant -> {"users", "history", "jobs", "images", "files"}
+    """
+    from job_queue import init_job_table, JOB_QUEUED, JOB_RUNNING, JOB_FAILED
+    from sessions import SessionManager
+
+    tenant_map = {username: validate_tenant(tenant) for username, tenant in (tenant_map or {}).items()}
+    source = sqlite3.connect(f"file:{os.path.abspath(source_path)}?mode=ro", uri=True)
+    try:
+        users = source.execute('SELECT id, nama_lengkap, username, password, tanggal_dibuat FROM users').fetchall()
+        history_users = [row[0] for row in source.execute('SELECT DISTINCT username FROM detection_history')]
+        job_users = []
+        if _table_exists(source, "main", "detection_jobs"):
+            job_users = [row[0] for row in source.execute('SELECT DISTINCT username FROM detection_jobs')]
+        has_sessions = _table_exists(source, "main", "sessions")
+    finally:
+        source.close()
+
+    members = {}
+    for username in [row[2] for row in users] + history_users + job_users:
+        members.setdefault(tenant_map.get(username, sharded.default_tenant), set()).add(username)
+
+    # Direktori: user beserta tenant-nya dan sesi yang masih ada
+    conn = sharded._connect()
+    try:
+        with conn:
+            conn.executemany('''
+                INSERT INTO users (id, nama_lengkap, username, password, tanggal_dibuat, tenant)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(username) DO UPDATE SET tenant = excluded.tenant
+            ''', [(*row, tenant_map.get(row[2], sharded.default_tenant)) for row in users])
+    finally:
+        conn.close()
+    if has_sessions:
+        SessionManager(sharded)
+        # Koneksi biasa (bukan dari pool) karena ATTACH menempel di koneksi
+        conn = sqlite3.connect(sharded.db_path, timeout=sharded.busy_timeout)
+        try:
+            conn.execute('ATTACH DATABASE ? AS src', (os.path.abspath(source_path),))
+            with conn:
+                conn.execute('''
+                    INSERT OR IGNORE INTO sessions (token_hash, username, expires_at, tanggal_dibuat)
+                    SELECT token_hash, username, expires_at, tanggal_dibuat FROM src.sessions
+                ''')
+        finally:
+            conn.close()
+
+    report = {}
+    for tenant, usernames in sorted(members.items()):
+        shard = sharded.shard(tenant)
+        init_job_table(shard)
+        conn = sqlite3.connect(shard.db_path, timeout=shard.busy_timeout)
+        try:
+            conn.execute('ATTACH DATABASE ? AS src', (os.path.abspath(source_path),))
+            with conn:
+                conn.execute('CREATE TEMP TABLE moving (username TEXT PRIMARY KEY)')
+                conn.executemany('INSERT INTO temp.moving VALUES (?)', [(username,) for username in usernames])
+
+                conn.execute('''
+                    INSERT INTO detection_history (id, username, filename, filepath, tanggal_deteksi,
+                                                   hasil_deteksi, image_hash)
+                    SELECT id, username, filename, filepath, tanggal_deteksi, hasil_deteksi, image_hash
+                    FROM src.detection_history WHERE username IN (SELECT username FROM temp.moving)
+                ''')
+                history = conn.execute('SELECT changes()').fetchone()[0]
+                conn.execute('''
+                    INSERT INTO detection_predictions (history_id, username, class, confidence, tanggal_deteksi)
+                    SELECT history_id, username, class, confidence, tanggal_deteksi
+                    FROM src.detection_predictions WHERE username IN (SELECT username FROM temp.moving)
+                ''')
+
+                jobs = 0
+                if job_users:
+                    conn.execute('''
+                        INSERT INTO detection_jobs
+                        SELECT * FROM src.detection_jobs WHERE username IN (SELECT username FROM temp.moving)
+                    ''')
+                    jobs = conn.execute('SELECT changes()').fetchone()[0]
+
+                # Blob yang dirujuk tenant ini: refcount = record history + job yang
+                # masih memegang referensi (antrian, berjalan, gagal)
+                blobs = conn.execute(f'''
+                    SELECT b.hash, b.filepath, b.size, b.tanggal_dibuat, refs.total
+                    FROM src.image_blobs b JOIN (
+                        SELECT image_hash, COUNT(*) AS total FROM (
+                            SELECT image_hash FROM detection_history WHERE image_hash IS NOT NULL
+                            {"UNION ALL SELECT image_hash FROM detection_jobs WHERE image_hash IS NOT NULL"
+                             " AND status IN (?, ?, ?)" if job_users else ""}
+                        ) GROUP BY image_hash
+                    ) refs ON refs.image_hash = b.hash
+                ''', (JOB_QUEUED, JOB_RUNNING, JOB_FAILED) if job_users else ()).fetchall()
+
+                moved = []
+                for image_hash, old_path, size, created, refcount in blobs:
+                    new_path = shard.image_store.blob_path(image_hash, os.path.splitext(old_path)[1])
+                    moved.append((image_hash, old_path, new_path, size, created, refcount))
+                conn.executemany('''
+                    INSERT INTO image_blobs (hash, filepath, size, refcount, tanggal_dibuat) VALUES (?, ?, ?, ?, ?)
+                ''', [(image_hash, new_path, size, refcount, created)
+                      for image_hash, _, new_path, size, created, refcount in moved])
+                conn.executemany('UPDATE detection_history SET filepath = ? WHERE image_hash = ?',
+                                 [(new_path, image_hash) for image_hash, _, new_path, *_ in moved])
+                if job_users:
+                    conn.executemany('UPDATE detection_jobs SET filepath = ? WHERE image_hash = ?',
+                                     [(new_path, image_hash) for image_hash, _, new_path, *_ in moved])
+        finally:
+            conn.close()
+
+        files = 0
+        for image_hash, old_path, new_path, *_ in moved:
+            if _link_or_copy(old_path, new_path):
+                files += 1
+            for variant in DISPLAY_VARIANTS:
+                _link_or_copy(variant_path(old_path, variant), variant_path(new_path, variant))
+
+        report[tenant] = {"users": sum(1 for row in users if tenant_map.get(row[2], sharded.default_tenant) == tenant),
+                          "history": history, "jobs": jobs, "images": len(moved), "files": files}
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Database multi-tenant: split, pindah tenant dan statistik")
+    parser.add_argument("--directory", default=os.environ.get("TENANT_DIRECTORY", DEFAULT_DIRECTORY_PATH),
+                        help="Path database direktori tenant")
+    parser.add_argument("--shard-dir", default=os.environ.get("TENANT_SHARD_DIR", DEFAULT_SHARD_DIR),
+                        help="Direktori file shard")
+    parser.add_argument("--default-tenant", default=os.environ.get("DEFAULT_TENANT", DEFAULT_TENANT),
+                        help="Tenant untuk user tanpa pemetaan")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    split_parser = commands.add_parser("split", help="Pecah database satu file menjadi shard per tenant")
+    split_parser.add_argument("--db", default="skin_cancer_app.db", help="Database sumber (tidak diubah)")
+    split_parser.add_argument("--map", help="CSV username,tenant (user lain masuk --default-tenant)")
+    split_parser.add_argument("--force", action="store_true", help="Lanjutkan walaupun database direktori sudah ada")
+
+    assign_parser = commands.add_parser("assign", help="Pindahkan user (tanpa history) ke tenant lain")
+    assign_parser.add_argument("username")
+    assign_parser.add_argument("tenant")
+
+    commands.add_parser("stats", help="Ringkasan per tenant")
+    args = parser.parse_args()
+
+    if args.command == "split":
+        if not os.path.exists(args.db):
+            raise SystemExit(f"Database sumber tidak ditemukan: {args.db}")
+        if os.path.exists(args.directory) and not args.force:
+            raise SystemExit(f"{args.directory} sudah ada; hapus dulu atau pakai --force")
+
+    sharded = ShardedDatabaseManager(args.directory, shard_dir=args.shard_dir,
+                                     default_tenant=args.default_tenant, write_behind=False)
+    if args.command == "split":
+        start = time.perf_counter()
+        report = split_database(args.db, sharded, read_tenant_map(args.map) if args.map else None)
+        for tenant, counts in report.items():
+            print(f"{tenant}: {counts['users']} user, {counts['history']} history, {counts['jobs']} job, "
+                  f"{counts['images']} gambar ({counts['files']} file ditautkan)")
+        print(f"Selesai dalam {time.perf_counter() - start:.1f} detik. Jalankan aplikasi dengan "
+              f"TENANT_DIRECTORY={args.directory} TENANT_SHARD_DIR={args.shard_dir}")
+    elif args.command == "assign":
+        if sharded.set_user_tenant(args.username, args.tenant):
+            print(f"{args.username} dipindah ke tenant {validate_tenant(args.tenant)}")
+        else:
+            print(f"User {args.username} tidak ditemukan")
+    else:
+        for row in sharded.tenant_stats():
+            print(row)
+    sharded.close()
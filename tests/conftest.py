@@ -0,0 +1,45 @@
+import io
+import os
+import sys
+
+import pytest
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager
+
+
+def png_bytes(seed):
+    """Gambar PNG kecil; seed berbeda menghasilkan hash blob berbeda"""
+    buffer = io.BytesIO()
+    Image.new("RGB", (16, 16), (seed % 256, seed * 7 % 256, seed * 13 % 256)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def hasil(class_name="mel", confidence=0.9):
+    return repr([{"class": class_name, "confidence": confidence}])
+
+
+def refcount(db_manager, image_hash):
+    """Refcount blob di image_blobs, None jika baris blob sudah dihapus"""
+    conn = db_manager._connect()
+    try:
+        row = conn.execute('SELECT refcount FROM image_blobs WHERE hash = ?', (image_hash,)).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Direktori aplikasi sementara (path gambar relatif terhadap direktori kerja)"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def db(workdir):
+    manager = DatabaseManager("skin_cancer_app.db", write_behind=False)
+    yield manager
+    manager.close()
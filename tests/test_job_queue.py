@@ -0,0 +1,175 @@
+import os
+import time
+
+from conftest import hasil, png_bytes, refcount
+from job_queue import JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, DetectionJobQueue
+
+
+def submit_image(db, queue, username="alice", seed=1):
+    image_hash, filepath = db.image_store.put(png_bytes(seed), "lesi.png")
+    return queue.submit(username, "lesi.png", filepath, image_hash), image_hash, filepath
+
+
+# ----------------------------------------------------------------------
+# Transisi status
+# ----------------------------------------------------------------------
+
+def test_claim_and_complete(db):
+    queue = DetectionJobQueue(db)
+    job_id, _, _ = submit_image(db, queue)
+
+    job = queue.claim("w1")
+    assert job["id"] == job_id
+    assert job["status"] == JOB_RUNNING
+    assert job["attempts"] == 1
+    # Job yang sedang dipegang tidak bisa diambil worker lain
+    assert queue.claim("w2") is None
+
+    history_id = queue.complete(job_id, "w1", hasil())
+    assert history_id is not None
+    job = queue.get_job(job_id, "alice")
+    assert job["status"] == JOB_DONE
+    assert job["history_id"] == history_id
+    assert job["hasil_deteksi"] == hasil()
+    assert db.count_detection_history("alice") == 1
+
+
+def test_progress_is_kept_in_memory_until_heartbeat(db):
+    queue = DetectionJobQueue(db)
+    job_id, _, _ = submit_image(db, queue)
+    queue.claim("w1")
+
+    queue.report_progress(job_id, "Inferensi", 0.5)
+    assert (queue.get_job(job_id)["stage"], queue.get_job(job_id)["progress"]) == ("Inferensi", 0.5)
+    # Proses lain (queue baru) baru melihatnya setelah heartbeat
+    assert DetectionJobQueue(db).get_job(job_id)["stage"] == "Memulai"
+    assert queue.heartbeat(job_id, "w1")
+    assert DetectionJobQueue(db).get_job(job_id)["stage"] == "Inferensi"
+
+
+def test_expired_lease_is_reclaimed(db):
+    queue = DetectionJobQueue(db, lease_seconds=0.05)
+    job_id, _, _ = submit_image(db, queue)
+    queue.claim("w1")
+    time.sleep(0.1)
+
+    job = queue.claim("w2")
+    assert job["id"] == job_id
+    assert job["attempts"] == 2
+    # Worker lama sudah kehilangan job
+    assert not queue.heartbeat(job_id, "w1")
+    assert queue.complete(job_id, "w1", hasil()) is None
+    assert queue.complete(job_id, "w2", hasil()) is not None
+    assert db.count_detection_history("alice") == 1
+
+
+def test_expired_lease_without_attempts_left_fails(db):
+    queue = DetectionJobQueue(db, lease_seconds=0.05, max_attempts=1)
+    job_id, _, _ = submit_image(db, queue)
+    queue.claim("w1")
+    time.sleep(0.1)
+
+    assert queue.claim("w2") is None
+    job = queue.get_job(job_id)
+    assert job["status"] == JOB_FAILED
+    assert "lease" in job["error"]
+
+
+def test_fail_retries_with_backoff_then_fails(db):
+    queue = DetectionJobQueue(db, max_attempts=2, retry_delay=0.05)
+    job_id, _, _ = submit_image(db, queue)
+
+    queue.claim("w1")
+    assert queue.fail(job_id, "w1", "model error") == JOB_QUEUED
+    # Belum boleh diambil sebelum jeda percobaan ulang lewat
+    assert queue.claim("w1") is None
+    time.sleep(0.1)
+    assert queue.claim("w1")["attempts"] == 2
+
+    assert queue.fail(job_id, "w1", "model error") == JOB_FAILED
+    job = queue.get_job(job_id)
+    assert job["status"] == JOB_FAILED
+    assert job["error"] == "model error"
+    assert queue.claim("w1") is None
+
+
+def test_non_retryable_failure_and_manual_retry(db):
+    queue = DetectionJobQueue(db)
+    job_id, _, _ = submit_image(db, queue)
+    queue.claim("w1")
+
+    assert queue.fail(job_id, "w1", "gambar rusak", retryable=False) == JOB_FAILED
+    # Hanya pemilik job yang bisa mencoba lagi
+    assert not queue.retry(job_id, "bob")
+    assert queue.retry(job_id, "alice")
+    job = queue.claim("w1")
+    assert job["id"] == job_id
+    assert job["attempts"] == 1
+
+
+def test_postpone_does_not_count_attempt(db):
+    queue = DetectionJobQueue(db)
+    job_id, _, _ = submit_image(db, queue)
+    queue.claim("w1")
+
+    queue.postpone(job_id, "w1", delay=0)
+    job = queue.claim("w1")
+    assert job["id"] == job_id
+    assert job["attempts"] == 1
+
+
+# ----------------------------------------------------------------------
+# Refcount gambar
+# ----------------------------------------------------------------------
+
+def test_complete_hands_reference_to_history(db):
+    queue = DetectionJobQueue(db)
+    job_id, image_hash, filepath = submit_image(db, queue)
+    assert refcount(db, image_hash) == 1
+
+    queue.claim("w1")
+    history_id = queue.complete(job_id, "w1", hasil())
+    assert refcount(db, image_hash) == 1
+
+    # Job selesai tidak memegang referensi lagi: purge tidak menyentuh blob
+    assert queue.purge_finished(days=0) == 1
+    assert refcount(db, image_hash) == 1
+    assert os.path.exists(filepath)
+
+    assert db.delete_detection_history(history_id, "alice")
+    assert refcount(db, image_hash) is None
+    assert not os.path.exists(filepath)
+
+
+def test_dismiss_releases_failed_job_reference(db):
+    queue = DetectionJobQueue(db)
+    job_id, image_hash, filepath = submit_image(db, queue)
+    queue.claim("w1")
+    queue.fail(job_id, "w1", "gambar rusak", retryable=False)
+
+    # Hanya job gagal milik user yang bisa dihapus
+    assert not queue.dismiss(job_id, "bob")
+    assert refcount(db, image_hash) == 1
+    assert queue.dismiss(job_id, "alice")
+    assert queue.get_job(job_id) is None
+    assert refcount(db, image_hash) is None
+    assert not os.path.exists(filepath)
+
+
+def test_purge_keeps_blob_shared_with_history(db):
+    queue = DetectionJobQueue(db)
+    # Gambar yang sama diunggah dua kali: satu selesai, satu gagal
+    done_id, image_hash, filepath = submit_image(db, queue)
+    failed_id, same_hash, _ = submit_image(db, queue)
+    assert same_hash == image_hash
+    assert refcount(db, image_hash) == 2
+
+    queue.claim("w1")
+    queue.complete(done_id, "w1", hasil())
+    queue.claim("w1")
+    queue.fail(failed_id, "w1", "gambar rusak", retryable=False)
+
+    assert queue.purge_finished(days=0) == 2
+    assert refcount(db, image_hash) == 1
+    assert os.path.exists(filepath)
+    assert db.count_detection_history("alice") == 1
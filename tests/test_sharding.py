@@ -0,0 +1,109 @@
+import os
+
+import pytest
+
+from conftest import hasil, png_bytes, refcount
+from job_queue import JOB_DONE, JOB_RUNNING, DetectionJobQueue
+from sharding import ShardedDatabaseManager, open_job_queue, split_database
+
+
+@pytest.fixture
+def source(db):
+    """
+    Database satu file: alice (clinic-a) punya dua history yang berbagi satu
+    gambar dan satu job antrian, bob (default) punya satu history
+    """
+    db.create_user("Alice", "alice", "hash-a")
+    db.create_user("Bob", "bob", "hash-b")
+    queue = DetectionJobQueue(db)
+
+    shared_hash, shared_path = db.image_store.put(png_bytes(1), "a.png")
+    db.image_store.put(png_bytes(1), "a.png")
+    bob_hash, bob_path = db.image_store.put(png_bytes(2), "b.png")
+    db.insert_detection_history_batch([
+        ("alice", "a.png", shared_path, hasil("mel", 0.9), shared_hash),
+        ("alice", "a.png", shared_path, hasil("nv", 0.4), shared_hash),
+        ("bob", "b.png", bob_path, hasil("bcc", 0.7), bob_hash),
+    ])
+    job_hash, job_path = db.image_store.put(png_bytes(3), "c.png")
+    job_id = queue.submit("alice", "c.png", job_path, job_hash)
+    return {"shared": shared_hash, "bob": bob_hash, "job": job_hash, "job_id": job_id}
+
+
+@pytest.fixture
+def sharded(workdir):
+    manager = ShardedDatabaseManager("tenants.db", write_behind=False)
+    yield manager
+    manager.close()
+
+
+def count(shard, sql, params=()):
+    conn = shard._connect()
+    try:
+        return conn.execute(sql, params).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_split_report(source, sharded):
+    report = split_database("skin_cancer_app.db", sharded, {"alice": "clinic-a"})
+
+    assert report["clinic-a"] == {"users": 1, "history": 2, "jobs": 1, "images": 2, "files": 2}
+    assert report["default"] == {"users": 1, "history": 1, "jobs": 0, "images": 1, "files": 1}
+    assert sharded.tenant_of("alice", cached=False) == "clinic-a"
+    assert sharded.tenant_of("bob", cached=False) == "default"
+
+
+def test_split_moves_history_and_predictions_per_tenant(source, sharded):
+    split_database("skin_cancer_app.db", sharded, {"alice": "clinic-a"})
+    clinic, default = sharded.shard("clinic-a"), sharded.shard("default")
+
+    assert sharded.count_detection_history("alice") == 2
+    assert sharded.count_detection_history("bob") == 1
+    assert count(clinic, 'SELECT COUNT(*) FROM detection_history WHERE username = ?', ("bob",)) == 0
+    assert count(default, 'SELECT COUNT(*) FROM detection_history WHERE username = ?', ("alice",)) == 0
+
+    # Baris prediksi ikut pindah dan tetap menunjuk ke id history yang sama
+    assert count(clinic, '''
+        SELECT COUNT(*) FROM detection_predictions p JOIN detection_history h ON h.id = p.history_id
+    ''') == 2
+    assert count(default, 'SELECT COUNT(*) FROM detection_predictions') == 1
+    assert len(sharded.search_detection_history("alice", min_confidence=0.5)[0]) == 1
+
+
+def test_split_moves_blobs_with_refcounts(source, sharded):
+    split_database("skin_cancer_app.db", sharded, {"alice": "clinic-a"})
+    clinic, default = sharded.shard("clinic-a"), sharded.shard("default")
+
+    # Dua record history + satu job antrian tetap memegang referensinya
+    assert refcount(clinic, source["shared"]) == 2
+    assert refcount(clinic, source["job"]) == 1
+    assert refcount(clinic, source["bob"]) is None
+    assert refcount(default, source["bob"]) == 1
+
+    for shard in (clinic, default):
+        conn = shard._connect()
+        try:
+            paths = [row[0] for row in conn.execute('SELECT filepath FROM image_blobs')]
+            paths += [row[0] for row in conn.execute('SELECT filepath FROM detection_history')]
+        finally:
+            conn.close()
+        for path in paths:
+            assert shard.image_store.owns(path)
+            assert os.path.exists(path)
+
+
+def test_split_jobs_run_on_tenant_shard(source, sharded):
+    split_database("skin_cancer_app.db", sharded, {"alice": "clinic-a"})
+    queue = open_job_queue(sharded)
+
+    job = queue.claim("w1")
+    assert job["id"] == f"clinic-a:{source['job_id']}"
+    assert job["status"] == JOB_RUNNING
+    assert job["filepath"].startswith(sharded.shard("clinic-a").image_store.root)
+
+    queue.complete(job["id"], "w1", hasil(), username="alice")
+    assert queue.get_job(job["id"], "alice")["status"] == JOB_DONE
+    assert sharded.count_detection_history("alice") == 3
+    # Referensi job berpindah ke record history baru
+    assert refcount(sharded.shard("clinic-a"), source["job"]) == 1
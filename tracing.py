@@ -0,0 +1,151 @@
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+from activity_log import ActivityLogger
+
+# Perekaman trace bersifat opt-in: TRACE_REQUESTS=1 (path file lewat TRACE_PATH)
+DEFAULT_TRACE_PATH = "traces.jsonl"
+TRACE_VERSION = 1
+
+
+class StageTimer:
+    """Durasi per tahap satu permintaan (ms), contoh ingest, inference, store"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, name, since):
+        """Tambahkan waktu sejak perf_counter() `since` ke tahap `name`"""
+        elapsed = (time.perf_counter() - since) * 1000
+        self.stages[name] = round(self.stages.get(name, 0.0) + elapsed, 2)
+
+    @contextmanager
+    def stage(self, name):
+        since = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, since)
+
+    def elapsed_ms(self):
+        return round((time.perf_counter() - self.started) * 1000, 2)
+
+
+def percentile(sorted_values, q):
+    """Persentil q (0-100) dari list yang sudah terurut, None jika kosong"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100 * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+def image_info(ingested):
+    """Ukuran dan format gambar asli dari IngestedImage (tanpa nama file atau hash)"""
+    return {
+        "format": ingested.image_format,
+        "bytes": ingested.size,
+        "width": round(ingested.width / ingested.scale),
+        "height": round(ingested.height / ingested.scale),
+    }
+
+
+class TraceRecorder(ActivityLogger):
+    """
+    Perekam trace permintaan untuk replay offline (python replay.py).
+    Setiap permintaan menjadi satu record JSON lines: aksi, hasil, latensi
+    total dan per tahap, ukuran/format gambar dan versi model. Record
+    dianonimkan: username diganti pseudonim HMAC dengan kunci acak per proses
+    (urutan permintaan per user tetap terlihat, tetapi tidak bisa dibalik atau
+    dicocokkan antar restart), dan tidak ada nama file, hash gambar, hasil
+    deteksi maupun pesan error (hanya nama kelas exception).
+    Penulisan, batching dan rotasi file sama dengan ActivityLogger.
+    """
+
+    def __init__(self, path=DEFAULT_TRACE_PATH, **kwargs):
+        super().__init__(path, **kwargs)
+        self._key = secrets.token_bytes(16)
+
+    def actor(self, username):
+        """Pseudonim username yang stabil selama proses berjalan"""
+        if not username:
+            return None
+        return hmac.new(self._key, username.encode("utf-8"), hashlib.sha256).hexdigest()[:12]
+
+    def record(self, username, action, outcome="ok", timer=None, image=None, error=None, **fields):
+        """
+        Catat satu permintaan tanpa menunggu I/O
+        Args:
+            username: Username pelaku (disimpan sebagai pseudonim)
+            action: Jenis permintaan, contoh "detect" atau "history"
+            outcome: "ok", "failed", "busy", "invalid" atau "error"
+            timer: StageTimer permintaan ini
+            image: dict dari image_info()
+            error: Exception penyebab kegagalan (hanya nama kelasnya yang dicatat)
+            **fields: Field tambahan, contoh model_version, detections, rows
+        Returns:
+            bool: False jika record dibuang
+        """
+        record = {"v": TRACE_VERSION, "t": round(time.time(), 3), "actor": self.actor(username),
+                  "action": action, "outcome": outcome}
+        if timer is not None:
+            record["latency_ms"] = timer.elapsed_ms()
+            record["stages"] = dict(timer.stages)
+        if image is not None:
+            record["image"] = image
+        if error is not None:
+            record["error_type"] = type(error).__name__
+        record.update(fields)
+        return self.enqueue(record)
+
+
+_recorder = None
+_recorder_checked = False
+_recorder_lock = threading.Lock()
+
+
+def get_trace_recorder():
+    """Recorder bersama jika TRACE_REQUESTS aktif, None jika tidak"""
+    global _recorder, _recorder_checked
+    with _recorder_lock:
+        if not _recorder_checked:
+            _recorder_checked = True
+            if os.environ.get("TRACE_REQUESTS", "").lower() in ("1", "true", "yes"):
+                _recorder = TraceRecorder(os.environ.get("TRACE_PATH", DEFAULT_TRACE_PATH))
+        return _recorder
+
+
+def trace_request(username, action, outcome="ok", timer=None, image=None, error=None, **fields):
+    """Catat trace satu permintaan; tidak melakukan apa-apa jika perekaman tidak aktif"""
+    try:
+        recorder = get_trace_recorder()
+        if recorder is not None:
+            recorder.record(username, action, outcome, timer=timer, image=image, error=error, **fields)
+
+    except Exception as e:
+        print(f"Error saat mencatat trace: {e}")
+
+
+def load_traces(paths):
+    """
+    Baca satu atau beberapa file trace (termasuk hasil rotasi)
+    Returns: list record terurut waktu; baris rusak dilewati
+    """
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if isinstance(record, dict) and "action" in record and "t" in record:
+                    records.append(record)
+    records.sort(key=lambda record: record["t"])
+    return records
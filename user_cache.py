@@ -0,0 +1,79 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class CachedUserStore:
+    """
+    Cache record user di antara AuthManager dan DatabaseManager.
+    Hasil get_user_info (termasuk hasil "tidak ada") disimpan selama ttl_seconds.
+    create_user dan update_password diteruskan ke database lalu entri cache
+    user tersebut langsung dibuang (write-through invalidation).
+    Hash password untuk login tidak diambil dari cache, supaya password lama
+    tidak berlaku lagi sedetik pun setelah diganti dari proses lain; kolom
+    password di record user yang di-cache dikosongkan (None).
+    """
+
+    def __init__(self, db_manager, ttl_seconds=60, max_entries=1024):
+        """
+        Args:
+            db_manager: DatabaseManager sumber data user
+            ttl_seconds: Umur maksimal entri cache (detik)
+            max_entries: Jumlah user maksimal di cache
+        """
+        self.db_manager = db_manager
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+
+        self._cache = OrderedDict()  # username -> (user_info atau None, expires_at)
+        self._lock = threading.Lock()
+        # Naik setiap ada invalidasi; hasil baca database yang dimulai sebelum
+        # invalidasi tidak boleh dimasukkan ke cache
+        self._generation = 0
+
+    def invalidate(self, username):
+        """Buang entri cache milik user"""
+        with self._lock:
+            self._generation += 1
+            self._cache.pop(username, None)
+
+    def get_user_info(self, username):
+        """Ambil record user, dari cache jika masih berlaku"""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(username)
+            if cached is not None and cached[1] > now:
+                self._cache.move_to_end(username)
+                return cached[0]
+            generation = self._generation
+
+        user_info = self.db_manager.get_user_info(username)
+        if user_info is not None:
+            # Urutan kolom tetap (id, nama_lengkap, username, password, tanggal_dibuat)
+            user_info = (*user_info[:3], None, *user_info[4:])
+
+        with self._lock:
+            if generation != self._generation:
+                return user_info
+            self._cache[username] = (user_info, now + self.ttl_seconds)
+            self._cache.move_to_end(username)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return user_info
+
+    def user_exists(self, username):
+        return self.get_user_info(username) is not None
+
+    def get_password_hash(self, username):
+        """Selalu dibaca langsung dari database (tidak di-cache)"""
+        return self.db_manager.get_password_hash(username)
+
+    def create_user(self, nama_lengkap, username, hashed_password):
+        created = self.db_manager.create_user(nama_lengkap, username, hashed_password)
+        self.invalidate(username)
+        return created
+
+    def update_password(self, username, new_hashed_password):
+        updated = self.db_manager.update_password(username, new_hashed_password)
+        self.invalidate(username)
+        return updated
@@ -1,8 +1,13 @@
 import os
+import ast
 import shutil
 import datetime
+import uuid
+import importlib.util
 from PIL import Image
 import streamlit as st
+from ingest import ingest_upload, InvalidImage
+from activity_log import get_activity_logger
 
 def setup_directories():
     """
@@ -31,29 +36,18 @@ def validate_image(uploaded_file):
     if uploaded_file is None:
         return False, "Tidak ada file yang diupload"
     
-    # Cek ekstensi file
-    allowed_extensions = ['jpg', 'jpeg', 'png', 'bmp', 'tiff']
-    file_extension = uploaded_file.name.split('.')[-1].lower()
-    
-    if file_extension not in allowed_extensions:
-        return False, f"Format file tidak didukung. Gunakan: {', '.join(allowed_extensions)}"
-    
-    # Cek ukuran file (max 10MB)
-    max_size = 10 * 1024 * 1024  # 10MB in bytes
-    if uploaded_file.size > max_size:
-        return False, "Ukuran file terlalu besar. Maksimal 10MB"
-    
-    # Cek apakah file benar-benar gambar
+    # Format dicek dari magic bytes dan ukuran dicek sebelum decode,
+    # lihat ingest.ingest_upload
     try:
-        image = Image.open(uploaded_file)
-        image.verify()  # Verifikasi integritas gambar
+        ingest_upload(uploaded_file.getvalue(), uploaded_file.name)
         return True, "Valid"
-    except Exception:
-        return False, "File bukan gambar yang valid"
+    except InvalidImage as e:
+        return False, str(e)
 
 def save_uploaded_file(uploaded_file, save_directory="uploads"):
     """
     Simpan file yang diupload
+    Gambar history sebaiknya disimpan lewat ImageStore.put() agar upload identik berbagi satu file
     Args:
         uploaded_file: File yang diupload
         save_directory: Direktori tujuan
@@ -61,15 +55,17 @@ def save_uploaded_file(uploaded_file, save_directory="uploads"):
         str: Path file yang disimpan
     """
     try:
-        # Buat nama file unik dengan timestamp
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{timestamp}_{uploaded_file.name}"
+        # Buat nama file unik dengan timestamp mikrodetik dan id acak
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        filename = f"{timestamp}_{uuid.uuid4().hex[:8]}_{os.path.basename(uploaded_file.name)}"
         filepath = os.path.join(save_directory, filename)
-        
-        # Simpan file
-        with open(filepath, "wb") as f:
+
+        # Simpan ke file sementara lalu rename agar tidak ada file setengah jadi
+        tmp_path = f"{filepath}.tmp"
+        with open(tmp_path, "wb") as f:
             f.write(uploaded_file.getbuffer())
-        
+        os.replace(tmp_path, filepath)
+
         return filepath
     except Exception as e:
         raise Exception(f"Error menyimpan file: {str(e)}")
@@ -86,6 +82,8 @@ def resize_image(image_path, max_width=800, max_height=600):
     """
     try:
         image = Image.open(image_path)
+        # Draft mode: JPEG langsung di-decode pada skala yang cukup untuk ukuran target
+        image.draft("RGB", (max_width, max_height))
         
         # Hitung ratio resize
         width_ratio = max_width / image.width
@@ -95,7 +93,7 @@ def resize_image(image_path, max_width=800, max_height=600):
         if ratio < 1:
             new_width = int(image.width * ratio)
             new_height = int(image.height * ratio)
-            image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+            image = image.resize((new_width, new_height), Image.Resampling.LANCZOS, reducing_gap=3.0)
         
         return image
     except Exception as e:
@@ -104,28 +102,49 @@ def resize_image(image_path, max_width=800, max_height=600):
 def cleanup_temp_files(temp_directory="temp", max_age_hours=24):
     """
     Bersihkan file temporary yang sudah lama
+    (pembersihan terjadwal dengan kuota disk ada di janitor.DiskJanitor)
     Args:
         temp_directory: Direktori temporary
         max_age_hours: Usia maksimal file dalam jam
+    Returns:
+        int: Jumlah byte yang dibebaskan
     """
+    reclaimed = 0
     try:
         if not os.path.exists(temp_directory):
-            return
+            return 0
         
-        current_time = datetime.datetime.now()
-        max_age = datetime.timedelta(hours=max_age_hours)
+        cutoff = datetime.datetime.now().timestamp() - max_age_hours * 3600
         
-        for filename in os.listdir(temp_directory):
-            filepath = os.path.join(temp_directory, filename)
-            
-            if os.path.isfile(filepath):
-                file_time = datetime.datetime.fromtimestamp(os.path.getctime(filepath))
-                if current_time - file_time > max_age:
-                    os.remove(filepath)
-                    print(f"File temporary dihapus: {filename}")
+        # scandir membawa hasil stat bersama entri direktori
+        with os.scandir(temp_directory) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    if stat.st_mtime < cutoff:
+                        os.remove(entry.path)
+                        reclaimed += stat.st_size
+                        print(f"File temporary dihapus: {entry.name}")
     
     except Exception as e:
         print(f"Error cleanup temp files: {e}")
+    return reclaimed
+
+def parse_predictions(hasil_deteksi):
+    """
+    Ubah string hasil_deteksi yang tersimpan di database menjadi list prediksi
+    Args:
+        hasil_deteksi: String repr list prediksi, contoh "[{'class': 'mel', ...}]"
+    Returns:
+        list: List dict prediksi (kosong jika tidak ada atau tidak valid)
+    """
+    if not hasil_deteksi or hasil_deteksi == 'None':
+        return []
+    try:
+        predictions = ast.literal_eval(hasil_deteksi)
+        return predictions if isinstance(predictions, list) else []
+    except (ValueError, SyntaxError):
+        return []
 
 def format_file_size(size_bytes):
     """
@@ -179,7 +198,8 @@ def create_thumbnail(image_path, thumbnail_size=(150, 150)):
     """
     try:
         image = Image.open(image_path)
-        image.thumbnail(thumbnail_size, Image.Resampling.LANCZOS)
+        image.draft("RGB", thumbnail_size)
+        image.thumbnail(thumbnail_size, Image.Resampling.LANCZOS, reducing_gap=2.0)
         return image
     except Exception as e:
         raise Exception(f"Error membuat thumbnail: {str(e)}")
@@ -206,23 +226,20 @@ def validate_model_file(model_path="best.pt"):
     
     return True, "File model valid"
 
-def log_activity(username, activity, details=""):
+def log_activity(username, activity, details="", **fields):
     """
-    Log aktivitas user (opsional untuk debugging)
+    Log aktivitas user ke app_activity.jsonl (JSON lines, asinkron)
     Args:
         username: Username yang melakukan aktivitas
         activity: Jenis aktivitas
         details: Detail tambahan
+        **fields: Field terstruktur, contoh latency_ms, model_version, cache_hit
     """
     try:
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"[{timestamp}] {username}: {activity}"
         if details:
-            log_entry += f" - {details}"
-        
-        # Simpan ke file log (opsional)
-        with open("app_activity.log", "a", encoding="utf-8") as f:
-            f.write(log_entry + "\n")
+            fields["details"] = details
+        # Hanya masuk antrian, penulisan file dilakukan thread activity_log
+        get_activity_logger().log(username, activity, **fields)
     
     except Exception as e:
         print(f"Error logging: {e}")
@@ -241,17 +258,9 @@ def check_system_requirements():
         "streamlit": True
     }
     
-    try:
-        import cv2
-        requirements["opencv"] = True
-    except ImportError:
-        pass
-    
-    try:
-        from ultralytics import YOLO
-        requirements["ultralytics"] = True
-    except ImportError:
-        pass
+    # find_spec hanya mencari modul tanpa meng-import (ultralytics butuh beberapa detik)
+    requirements["opencv"] = importlib.util.find_spec("cv2") is not None
+    requirements["ultralytics"] = importlib.util.find_spec("ultralytics") is not None
     
     return requirements
 